@@ -30,6 +30,9 @@ import select
 import random
 import urllib
 import urllib.request as urlreq
+import urllib.parse
+import http.client
+import http.server
 # import urllib.error  as urlerr
 # import urllib.parse as urlparse
 import time
@@ -37,29 +40,147 @@ import datetime
 import json
 import tempfile
 import shutil
+import socket
+import errno
+import re
+import selectors
+import shlex
+import struct
+import base64
+import io
 import argparse
+import abc
+import hmac
+import ipaddress
+import sqlite3
+import gzip
+import tarfile
+import hashlib
+import concurrent.futures
+import itertools
+import threading
+import collections
+import collections.abc
+import contextlib
+import math
+import statistics
 
-NGINX_PORT = 20000
-IOJS_PORT = 20001
-NODE_PORT = 20002
-REGISTRY_PORT = 20003
+CACHE_PORT = 19999
 TMP_DIR = tempfile.mkdtemp()
 
 parser = argparse.ArgumentParser(description='''Usage: {} [OPTIONS] [BENCHMARKS]'''.format(sys.argv[0]))
-parser.add_argument('benchmarks', help='specify benchmark list delimitted by comma(,)')
-parser.add_argument('--docker', default='docker', help='docker compatible binary')
+parser.add_argument('benchmarks', nargs='?', default='all', help='specify benchmark list delimitted by comma(,)')
+parser.add_argument('--docker', default='docker',
+                    help='docker compatible binary, comma(,) separated to compare runtimes (e.g. docker,podman,nerdctl)')
+parser.add_argument('--order', default='balanced',
+                    help='order of the runtime x bench matrix within a trial (sequential|random|balanced)')
+parser.add_argument('--backend', default='cli',
+                    help='how containers are driven: docker compatible cli, the engine API, an in-process fake or '
+                         'the cli backend on a fake runtime binary (cli|engine|fake|fake-cli)')
+parser.add_argument('--docker-sock', default=os.environ.get('DOCKER_HOST', 'unix:///var/run/docker.sock').replace('unix://', ''),
+                    help='unix socket of the engine API, comma(,) separated to give one per --docker runtime')
 parser.add_argument('--out', default='bench.out', help='specify the output file')
 parser.add_argument('-t', '--add-time-postfix', default=False, action='store_true', help='specify the output file')
-parser.add_argument('--op', default='run', help='(run|push|pull|tag|move)')
+parser.add_argument('--op', default='run',
+                    help='(run|push|pull|tag|move|burst|churn|analyze|index|calibrate|ingest|query|compare|report|'
+                         'export-snapshot|import-snapshot|worker|coordinate)')
+parser.add_argument('--fake-latency', default='',
+                    help='mean latencies of --backend fake and fake-cli in seconds, e.g. pull=0.5,create=0.01,start=0.02,ready=0.1 '
+                         '(pull|push|tag|create|start|ready|remove)')
+parser.add_argument('--fake-dist', default='const', help='latency distribution of --backend fake (const|exp|uniform|lognormal)')
+parser.add_argument('--calibration', default=None,
+                    help='harness overhead file written by --op calibrate; other ops of the cli backend add '
+                         'elapsed_corrected to rows')
+parser.add_argument('--calibrate-ops', default='run,pull', help='comma(,) separated ops --op calibrate measures')
+parser.add_argument('--snapshot', default='snapshot.tar.zst',
+                    help='OCI layout of --op (export|import)-snapshot: a directory, .tar, .tar.gz or .tar.zst')
+parser.add_argument('--snapshot-jobs', default=8, type=int,
+                    help='blobs fetched and gzip chunks compressed concurrently by --op export-snapshot')
+parser.add_argument('--registry-storage', default='reg-dir',
+                    help='filesystem storage of a registry:2 that --op import-snapshot fills')
+parser.add_argument('--listen', default='127.0.0.1:7070',
+                    help='address --op worker accepts a coordinator on; listening on other hosts needs '
+                         'a shared token in $HELLO_BENCH_TOKEN')
+parser.add_argument('--workers', default=None, help='comma(,) separated host:port of the workers of --op coordinate')
+parser.add_argument('--worker-op', default='run', help='op the workers run for --op coordinate')
+parser.add_argument('--shard-size', default=1, type=int, help='benches handed to a worker at once')
+parser.add_argument('--shard-retries', default=2, type=int, help='times a failed shard is handed to a worker again')
+parser.add_argument('--worker-timeout', default=60.0, type=float,
+                    help='seconds without a message after which a worker is considered dead')
+parser.add_argument('--heartbeat', default=5.0, type=float, help='seconds between keep-alive messages of a busy worker')
+parser.add_argument('--db', default=None, help='sqlite results store every row is also written to (required by --op ingest and query)')
+parser.add_argument('--input', nargs='+', default=[], help='result files read by --op (ingest|compare|report)')
+parser.add_argument('--image-index', default='image-index', help='directory of the image metadata index')
+parser.add_argument('--index-images', default=False, action='store_true',
+                    help='add the digest, sizes and layer count of the image to run and pull rows')
+parser.add_argument('--outlier-z', default=3.5, type=float,
+                    help='robust z-score above which --op report flags an image as outlier')
+parser.add_argument('--threshold', default=0.05, type=float, help='relative slowdown --op compare flags as regression')
+parser.add_argument('--test', default='mwu', help='significance test of --op compare (mwu|bootstrap)')
+parser.add_argument('--group-by', default='bench', help='columns --op query aggregates by, comma(,) separated')
+parser.add_argument('--where', action='append', default=[], help='column=value filter of --op query (repeatable)')
+parser.add_argument('--since', default=None, help='only rows with start_time >= this (e.g. 2020-10-01)')
+parser.add_argument('--until', default=None, help='only rows with start_time <= this')
+parser.add_argument('--phase', default=None, help='aggregate this phase duration instead of elapsed')
 parser.add_argument('--registry', default='docker.io', help='image registry from which the images are pulled')
-parser.add_argument('--registry2', help='TODO')
+parser.add_argument('--registry2', help='image registry to which the images are pushed by (push|move)')
+parser.add_argument('--move-engine', default='daemon',
+                    help='how --op move copies images: through the local daemon or registry to registry (daemon|registry)')
+parser.add_argument('--move-jobs', default=4, type=int, help='blobs transferred concurrently by --move-engine registry')
+parser.add_argument('--cache', default=False, action='store_true',
+                    help='pull through a local cache registry started in front of --registry')
+parser.add_argument('--cache-dir', default='registry-cache', help='storage directory of the cache registry')
+parser.add_argument('--cache-port', default=CACHE_PORT, type=int, help='host port of the cache registry (0: any free port)')
+parser.add_argument('--cache-upstream', default=None, help='upstream url of the cache (default: derived from --registry)')
 parser.add_argument('--list', default=False, action='store_true', help='show the image list for bench')
 parser.add_argument('--list-json', default=False, action='store_true', help='show the image list for bench as json')
 parser.add_argument('--clean', default='none', help='(first|each|none)')
+parser.add_argument('--clean-scope', default='targeted',
+                    help='what --clean removes: what the benches created, or every container and image (targeted|global)')
+parser.add_argument('--clean-jobs', default=4, type=int, help='removals run concurrently by --clean-scope targeted')
+parser.add_argument('--run-id', default=None,
+                    help='label of the containers of this run (default: <start time>-<pid>); reuse the id of an '
+                         'interrupted run to let --clean first remove what it left behind')
 parser.add_argument('--trace-file', default=None, help='trace file copy from')
 parser.add_argument('--trace-dir', default=None, help='dest dir of trace file')
+parser.add_argument('--analyze-traces', default=False, action='store_true',
+                    help='index the copied traces and estimate the share of image data read during startup')
+parser.add_argument('-j', '--jobs', default=1, type=int, help='number of benches run concurrently for (pull|push|tag|move)')
+parser.add_argument('--mount-mode', default='link', help='per-run view of staged bind-mount sources (link|copy)')
+parser.add_argument('--probe-container-ip', default=False, action='store_true',
+                    help='probe http benches on the container ip instead of a published port (skips docker-proxy)')
+parser.add_argument('--ready-probe', default='http',
+                    help='readiness probe of http benches: a successful response or a connection that is not '
+                         'closed right away (http|tcp)')
+parser.add_argument('--probe-timeout', default=600.0, type=float, help='seconds to wait for a bench to become ready')
+parser.add_argument('--probe-backoff', default=0.0002, type=float, help='initial retry interval of readiness probes in seconds')
+parser.add_argument('--probe-max-backoff', default=0.005, type=float, help='maximum retry interval of readiness probes in seconds')
+parser.add_argument('--sample-interval', default=None, type=float,
+                    help='sample the cgroup v2 cpu/memory/io usage of run containers every this many seconds')
+parser.add_argument('--host-stats', default=False, action='store_true',
+                    help='record disk, network and docker data-root usage deltas of every operation')
+parser.add_argument('--concurrency', default='1', help='instances started at once by --op burst, comma(,) separated to sweep')
+parser.add_argument('--rate', default=10.0, type=float, help='containers started per second by --op churn')
+parser.add_argument('--duration', default=60.0, type=float, help='seconds --op churn keeps starting containers')
+parser.add_argument('--window', default=10.0, type=float, help='seconds per latency report window of --op churn')
+parser.add_argument('--arrival', default='poisson', help='arrival process of --op churn (poisson|uniform)')
+parser.add_argument('--max-inflight', default=256, type=int,
+                    help='containers --op churn runs at once; later arrivals queue and count as backlog')
+parser.add_argument('--repeat', default=1, type=int, help='number of recorded trials per bench')
+parser.add_argument('--warmup', default=0, type=int, help='number of unrecorded trials run before the recorded ones')
+parser.add_argument('--ci-width', default=None, type=float,
+                    help='keep running trials until the relative width of the median CI drops below this (e.g. 0.05)')
+parser.add_argument('--max-repeat', default=30, type=int, help='upper bound of trials per bench with --ci-width')
+parser.add_argument('--confidence', default=0.95, type=float, help='confidence level of the bootstrap CI and significance tests')
+parser.add_argument('--bootstrap', default=1000, type=int, help='number of bootstrap resamples')
+parser.add_argument('--metrics-port', default=None, type=int,
+                    help='serve live OpenMetrics on http://127.0.0.1:<port>/metrics (0: any free port)')
+parser.add_argument('--progress', default=None, help='append progress events as JSON lines to this file (-: stdout)')
 parser.add_argument('-v', '--verbose', default=False, action='store_true')
 
+# operations that only talk to registries and can safely overlap
+PARALLEL_OPS = set(['pull', 'push', 'tag', 'move'])
+
 
 def exit(status):
     # cleanup
@@ -67,40 +188,2508 @@ def exit(status):
     sys.exit(status)
 
 
-def tmp_dir():
-    tmp_dir.nxt += 1
-    return os.path.join(TMP_DIR, str(tmp_dir.nxt))
+def tmp_dir():
+    return os.path.join(TMP_DIR, str(next(tmp_dir.nxt)))
+
+
+tmp_dir.nxt = itertools.count(1)
+
+
+def source_dir(name):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+
+
+def system_like_exec(cmd, verbose=True):
+    if verbose:
+        p_stdout = None
+        p_stderr = None
+    else:
+        p_stdout = subprocess.DEVNULL
+        p_stderr = subprocess.PIPE
+    p = subprocess.run(cmd, shell=True, stderr=p_stderr, stdout=p_stdout)
+    if (p.returncode != 0):
+        print(p.stderr)
+    return p.returncode
+
+
+def capture_exec(cmd, verbose=True):
+    if verbose:
+        print(cmd)
+    p = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE,
+                       stderr=None if verbose else subprocess.PIPE)
+    if p.returncode != 0 and not verbose:
+        print(p.stderr)
+    return p.returncode, p.stdout.decode()
+
+
+def container_name(repo):
+    # unique even for instances of the same bench started at once
+    return '%s_bench_%d_%d' % (repo, os.getpid(), next(container_name.nxt))
+
+
+container_name.nxt = itertools.count(1)
+
+
+class Measurement:
+    # durations of the phases of one operation, measured with the monotonic clock
+    def __init__(self):
+        self.start = time.monotonic()
+        self.untimed_total = 0.0
+        self.phases = collections.OrderedDict()
+        self.begins = {}
+        self.metrics = {}
+        self.extra = {}  # further row fields, e.g. per-layer pull details
+        self.pulls = []
+        self.sampler = None
+        self.end = None
+
+    @contextlib.contextmanager
+    def phase(self, name, timed=True):
+        # phases with timed=False are reported but kept out of elapsed
+        t = time.monotonic()
+        self.begins.setdefault(name, t)
+        try:
+            yield
+        finally:
+            d = time.monotonic() - t
+            self.add_phase(name, d)
+            if not timed:
+                self.untimed_total += d
+
+    @contextlib.contextmanager
+    def untimed(self):
+        # bookkeeping of the harness that the baseline did not time
+        t = time.monotonic()
+        try:
+            yield
+        finally:
+            self.untimed_total += time.monotonic() - t
+
+    def add_phase(self, name, duration):
+        self.phases[name] = self.phases.get(name, 0.0) + duration
+
+    def finish(self):
+        self.end = time.monotonic()
+
+    def elapsed(self):
+        # like the baseline: from the start of the operation until the container was ready or
+        # exited, without the teardown and image lookups the baseline's `docker run` did not fork
+        return (self.end or time.monotonic()) - self.start - self.untimed_total
+
+    def wait_ready(self, probe):
+        # the ready phase ends when the probe saw the first successful answer
+        t = time.monotonic()
+        try:
+            probe.wait()
+        finally:
+            probe.close()
+        self.add_phase('ready', probe.ready_at - t)
+        self.metrics['ready_attempts'] = probe.attempts
+
+
+class DockerCli:
+    # container operations implemented by a docker compatible cli
+    def __init__(self, docker='docker'):
+        self.docker = docker
+
+    def image_exists(self, ref):
+        cmd = '%s image inspect %s' % (self.docker, ref)
+        p = subprocess.run(cmd, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return p.returncode == 0
+
+    def image_size(self, ref):
+        rc, out = capture_exec("%s image inspect --format '{{.Size}}' %s" % (self.docker, ref), verbose=False)
+        return int(out) if rc == 0 else None
+
+    def pull(self, ref, verbose=True, progress=None):
+        if progress is None:
+            return system_like_exec('%s pull %s' % (self.docker, ref), verbose=verbose)
+        # without a tty the cli prints one '<layer>: <status>' line per layer event
+        cmd = '%s pull %s' % (self.docker, ref)
+        if verbose:
+            print(cmd)
+        p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        out = []
+        for l in p.stdout:
+            t = time.monotonic()
+            l = l.decode(errors='replace').rstrip()
+            out.append(l)
+            if verbose:
+                print(l)
+            mm = re.match(r'^([0-9a-f]{12,64}): (.+)$', l)
+            if mm:
+                progress(t, mm.group(1), mm.group(2))
+        rc = p.wait()
+        if rc != 0 and not verbose:
+            print('\n'.join(out))
+        return rc
+
+    def image_history(self, ref):
+        # sizes of the non-empty layers, oldest first
+        cmd = "%s history --no-trunc --human=false --format '{{.Size}}' %s" % (self.docker, ref)
+        rc, out = capture_exec(cmd, verbose=False)
+        if rc != 0:
+            return []
+        return [int(x) for x in reversed(out.split()) if int(x) > 0]
+
+    def push(self, ref, verbose=True):
+        return system_like_exec('%s push %s' % (self.docker, ref), verbose=verbose)
+
+    def tag(self, src, dst, verbose=True):
+        return system_like_exec('%s tag %s %s' % (self.docker, src, dst), verbose=verbose)
+
+    def create(self, ref, name, cmd='', env={}, ports=[], mounts=[], stdin=False, labels={}, verbose=True):
+        opts = ''.join(['-e %s=%s ' % (k, v) for k, v in env.items()])
+        opts += ''.join(['--label %s=%s ' % (k, v) for k, v in labels.items()])
+        opts += ''.join(['-p %d:%d ' % (h, c) for h, c in ports])
+        opts += ''.join(['-v %s:%s ' % (a, b) for a, b in mounts])
+        if stdin:
+            opts += '-i '
+        cmd = '%s create --name=%s %s%s %s' % (self.docker, name, opts, ref, cmd)
+        rc, out = capture_exec(cmd, verbose=verbose)
+        assert(rc == 0)
+        return out.strip()
+
+    def start(self, cid, verbose=True):
+        rc = system_like_exec('%s start %s' % (self.docker, cid), verbose=False)
+        assert(rc == 0)
+
+    def start_attach(self, cid, stdin=b'', verbose=True):
+        cmd = '%s start -a -i %s' % (self.docker, cid)
+        p = subprocess.Popen(cmd, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT if verbose else subprocess.DEVNULL)
+        out, _ = p.communicate(stdin)
+        return p.returncode, out
+
+    def wait(self, cid):
+        rc, out = capture_exec('%s wait %s' % (self.docker, cid), verbose=False)
+        assert(rc == 0)
+        return int(out.strip())
+
+    def follow_logs(self, cid):
+        cmd = '%s logs -f %s' % (self.docker, cid)
+        return subprocess.Popen(cmd, shell=True, stderr=subprocess.STDOUT, stdout=subprocess.PIPE)
+
+    def print_logs(self, cid):
+        system_like_exec('%s logs %s' % (self.docker, cid))
+
+    def container_ip(self, cid):
+        fmt = '{{range .NetworkSettings.Networks}}{{.IPAddress}} {{end}}'
+        rc, out = capture_exec("%s inspect --format '%s' %s" % (self.docker, fmt, cid), verbose=False)
+        assert(rc == 0 and out.strip() != '')
+        return out.split()[0]
+
+    def container_pid(self, cid):
+        # host pid of the container's init process, None until it runs or once it exited
+        rc, out = capture_exec("%s inspect --format '{{.State.Pid}}' %s" % (self.docker, cid), verbose=False)
+        if rc != 0 or not out.strip().isdigit() or int(out) == 0:
+            return None
+        return int(out)
+
+    def logs(self, cid, since=None):
+        cmd = '%s logs %s%s 2>&1' % (self.docker, '' if since is None else '--since %.3f ' % since, cid)
+        rc, out = capture_exec(cmd, verbose=False)
+        assert(rc == 0)
+        return out
+
+    def remove(self, cid, force=False, verbose=True):
+        cmd = '%s rm %s%s' % (self.docker, '-f ' if force else '', cid)
+        rc = system_like_exec(cmd, verbose=False)
+        assert(rc == 0)
+
+    def image_digest(self, ref):
+        # digest of the manifest (list) the image was pulled by, None for local builds
+        cmd = "%s image inspect --format '{{join .RepoDigests \" \"}}' %s" % (self.docker, ref)
+        p = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        digests = p.stdout.decode().split() if p.returncode == 0 else []
+        return digests[0].split('@')[1] if digests else None
+
+    def data_root(self):
+        rc, out = capture_exec("%s info --format '{{.DockerRootDir}}'" % self.docker, verbose=False)
+        assert(rc == 0)
+        return out.strip()
+
+    def containers(self, labels):
+        # ids of all containers carrying every label filter ('key' or 'key=value')
+        cmd = '%s ps -aq --no-trunc %s' % (self.docker, ' '.join(['--filter label=%s' % l for l in labels]))
+        rc, out = capture_exec(cmd, verbose=False)
+        assert(rc == 0)
+        return out.split()
+
+    def images(self):
+        rc, out = capture_exec('%s images -aq --no-trunc' % self.docker, verbose=False)
+        assert(rc == 0)
+        return set(out.split())
+
+    def remove_image(self, ref, verbose=True):
+        cmd = '%s rmi -f %s' % (self.docker, ref)
+        if verbose:
+            print(cmd)
+        p = subprocess.run(cmd, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return p.returncode
+
+
+class ProbeError(Exception):
+    pass
+
+
+class ProbeTimeout(ProbeError):
+    pass
+
+
+class ReadinessProbe(abc.ABC):
+    # Polls check() until it succeeds. Each attempt records the monotonic time at
+    # which the answer arrived, so readiness is not quantized by the retry interval.
+    def __init__(self, timeout=600.0, backoff=0.0002, max_backoff=0.005):
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.attempts = 0
+        self.ready_at = None
+
+    @abc.abstractmethod
+    def check(self, deadline):
+        # one attempt; sets ready_at and returns True once ready
+        pass
+
+    def wait(self):
+        deadline = time.monotonic() + self.timeout
+        backoff = self.backoff
+        while True:
+            self.attempts += 1
+            if self.check(deadline):
+                return self.ready_at
+            now = time.monotonic()
+            if now >= deadline:
+                raise ProbeTimeout('%s not ready after %.1fs' % (self, self.timeout))
+            if backoff > 0:
+                time.sleep(min(backoff, deadline - now))
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def close(self):
+        pass
+
+
+class TCPProbe(ReadinessProbe):
+    # ready once a TCP connection is accepted and not closed right away: on a
+    # published port docker-proxy accepts before the app listens, then closes or
+    # resets the connection when it cannot reach the app
+    def __init__(self, host, port, attempt_timeout=0.5, settle=0.005, **kwargs):
+        ReadinessProbe.__init__(self, **kwargs)
+        self.host = host
+        self.port = port
+        self.attempt_timeout = attempt_timeout
+        self.settle = settle
+
+    def __str__(self):
+        return 'tcp://%s:%d' % (self.host, self.port)
+
+    def connect(self, deadline):
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setblocking(False)
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        err = s.connect_ex((self.host, self.port))
+        if err not in (0, errno.EINPROGRESS):
+            s.close()
+            return None
+        timeout = max(0, min(self.attempt_timeout, deadline - time.monotonic()))
+        _, w, _ = select.select([], [s], [], timeout)
+        if len(w) == 0 or s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) != 0:
+            s.close()
+            return None
+        return s
+
+    def check(self, deadline):
+        s = self.connect(deadline)
+        if s is None:
+            return False
+        t = time.monotonic()
+        try:
+            # a server may greet right away; only EOF or a reset means nobody is behind the port
+            r, _, _ = select.select([s], [], [], max(0, min(self.settle, deadline - t)))
+            if len(r) > 0 and s.recv(1) == b'':
+                return False
+        except OSError:
+            return False
+        finally:
+            s.close()
+        self.ready_at = t
+        return True
+
+
+class HTTPProbe(TCPProbe):
+    # ready once the server answers a request with an accepted status code
+    def __init__(self, host, port, path='/', ok=lambda status: status < 400, **kwargs):
+        TCPProbe.__init__(self, host, port, **kwargs)
+        self.path = path
+        self.ok = ok
+        self.status = None
+        self.response = b''
+
+    def __str__(self):
+        return 'http://%s:%d%s' % (self.host, self.port, self.path)
+
+    def check(self, deadline):
+        s = self.connect(deadline)
+        if s is None:
+            return False
+        try:
+            req = 'GET %s HTTP/1.0\r\nHost: %s:%d\r\n\r\n' % (self.path, self.host, self.port)
+            s.sendall(req.encode())
+            buf = b''
+            while b'\r\n' not in buf:
+                timeout = max(0, min(self.attempt_timeout, deadline - time.monotonic()))
+                r, _, _ = select.select([s], [], [], timeout)
+                if len(r) == 0:
+                    return False
+                chunk = s.recv(4096)
+                if chunk == b'':
+                    return False  # e.g. docker-proxy closing while the app is not listening yet
+                buf += chunk
+            t = time.monotonic()
+            self.status = int(buf.split(b' ')[1])
+            if not self.ok(self.status):
+                return False
+            self.ready_at = t
+            self.response = buf
+            return True
+        except (OSError, ValueError, IndexError):
+            return False
+        finally:
+            s.close()
+
+
+class LogStream:
+    # Reads lines from one or more pipes through a selector and timestamps each
+    # line with the monotonic clock as soon as it arrives.
+    def __init__(self, *streams):
+        self.sel = selectors.DefaultSelector()
+        self.bufs = {}
+        for s in streams:
+            fd = s if isinstance(s, int) else s.fileno()
+            os.set_blocking(fd, False)
+            self.sel.register(fd, selectors.EVENT_READ)
+            self.bufs[fd] = b''
+        self.first_line_at = None
+        self.nlines = 0
+
+    def read(self, deadline):
+        # returns the complete (timestamp, line) pairs that arrived before deadline
+        if len(self.bufs) == 0:
+            raise EOFError('all log streams are closed')
+        lines = []
+        for key, _ in self.sel.select(max(0, deadline - time.monotonic())):
+            fd = key.fd
+            try:
+                chunk = os.read(fd, 65536)
+            except BlockingIOError:
+                continue
+            t = time.monotonic()
+            if chunk == b'':
+                if len(self.bufs[fd]) > 0:
+                    lines.append((t, self.bufs[fd]))
+                self.sel.unregister(fd)
+                del self.bufs[fd]
+                continue
+            parts = (self.bufs[fd] + chunk).split(b'\n')
+            self.bufs[fd] = parts.pop()
+            lines.extend((t, l) for l in parts)
+        if len(lines) > 0 and self.first_line_at is None:
+            self.first_line_at = lines[0][0]
+        self.nlines += len(lines)
+        return lines
+
+    def close(self):
+        self.sel.close()
+
+
+class LogMatcher:
+    # Matches lines against several wait lines at once. Patterns are either plain
+    # strings (substring match) or compiled regular expressions.
+    def __init__(self, patterns, match_all=False):
+        if isinstance(patterns, (str, re.Pattern)):
+            patterns = [patterns]
+        self.names = [p if isinstance(p, str) else p.pattern for p in patterns]
+        self.patterns = []
+        for p in patterns:
+            if isinstance(p, str):
+                p = re.compile(re.escape(p.encode()))
+            elif isinstance(p.pattern, str):
+                p = re.compile(p.pattern.encode(), p.flags & ~re.UNICODE)
+            self.patterns.append(p)
+        self.match_all = match_all
+        self.matched = collections.OrderedDict()
+
+    def feed(self, t, line):
+        # returns True once the wait condition is satisfied
+        for name, p in zip(self.names, self.patterns):
+            if name not in self.matched and p.search(line):
+                self.matched[name] = t
+        if self.match_all:
+            return len(self.matched) == len(self.patterns)
+        return len(self.matched) > 0
+
+
+class LogLineProbe(ReadinessProbe):
+    # ready once the log lines satisfied the wait line(s)
+    def __init__(self, stream, waitline, match_all=False, verbose=False, **kwargs):
+        # reads block in the selector until a line arrives, so never sleep between them,
+        # whatever --probe-backoff says
+        kwargs['backoff'] = 0
+        kwargs.pop('max_backoff', None)
+        ReadinessProbe.__init__(self, **kwargs)
+        self.stream = LogStream(stream)
+        self.matcher = LogMatcher(waitline, match_all=match_all)
+        self.verbose = verbose
+
+    def __str__(self):
+        return 'log:%r' % self.matcher.names
+
+    def check(self, deadline):
+        try:
+            lines = self.stream.read(deadline)
+        except EOFError:
+            raise ProbeError('log stream closed before %s' % self)
+        for t, l in lines:
+            if self.verbose:
+                print(('out: %.6f %s' % (t, l.decode(errors='replace').strip())))
+            if self.matcher.feed(t, l):
+                self.ready_at = t
+                return True
+        return False
+
+    def close(self):
+        self.stream.close()
+
+
+PROBES = {'tcp': TCPProbe, 'http': HTTPProbe}
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        http.client.HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.connect(self.unix_path)
+        self.sock = s
+
+
+def read_exact(read, n):
+    buf = b''
+    while len(buf) < n:
+        chunk = read(n - len(buf))
+        if len(chunk) == 0:
+            break
+        buf += chunk
+    return buf
+
+
+def demux_stream(read):
+    # splits the stdout/stderr stream of a container without tty into its frames
+    while True:
+        hdr = read_exact(read, 8)
+        if len(hdr) < 8:
+            return
+        size = struct.unpack('>I', hdr[4:])[0]
+        yield hdr[0], read_exact(read, size)
+
+
+def split_ref(ref):
+    # 'localhost:5000/redis:7' -> ('localhost:5000/redis', '7')
+    name, _, tag = ref.rpartition(':')
+    if name == '' or '/' in tag:
+        return ref, 'latest'
+    return name, tag
+
+
+class EngineLogFollower:
+    # Popen look-alike of `docker logs -f`: a thread copies the demultiplexed log
+    # stream into a pipe, so the log readers can select() on it
+    def __init__(self, engine, cid):
+        self.conn, self.resp = engine.stream('GET', '/containers/%s/logs' % cid,
+                                             query={'follow': 1, 'stdout': 1, 'stderr': 1})
+        r, self.w = os.pipe()
+        self.stdout = os.fdopen(r, 'rb', buffering=0)
+        self.thread = threading.Thread(target=self.pump, daemon=True)
+        self.thread.start()
+
+    def pump(self):
+        try:
+            for _, data in demux_stream(self.resp.read):
+                os.write(self.w, data)
+        except (OSError, ValueError, http.client.HTTPException):
+            pass
+        finally:
+            os.close(self.w)
+
+    def kill(self):
+        try:
+            self.conn.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def wait(self):
+        self.thread.join()
+        self.conn.close()
+        self.stdout.close()
+
+
+class DockerEngine:
+    # container operations through the Docker Engine API on a unix socket,
+    # reusing one persistent connection per thread
+    def __init__(self, sock='/var/run/docker.sock'):
+        self.sock = sock
+        self.local = threading.local()
+
+    def conn(self):
+        c = getattr(self.local, 'conn', None)
+        if c is None:
+            c = self.local.conn = UnixHTTPConnection(self.sock)
+        return c
+
+    def url(self, path, query=None):
+        if query:
+            path += '?' + urllib.parse.urlencode(query)
+        return path
+
+    def request(self, method, path, body=None, query=None, headers={}):
+        hdrs = dict(headers)
+        if body is not None:
+            body = json.dumps(body).encode()
+            hdrs['Content-Type'] = 'application/json'
+        for retry in (True, False):
+            c = self.conn()
+            try:
+                c.request(method, self.url(path, query), body=body, headers=hdrs)
+                resp = c.getresponse()
+                return resp.status, resp.read()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                # the daemon closed the idle keep-alive connection
+                c.close()
+                self.local.conn = None
+                if not retry:
+                    raise
+
+    def stream(self, method, path, query=None, headers={}):
+        # long running responses get their own connection
+        c = UnixHTTPConnection(self.sock)
+        c.request(method, self.url(path, query), headers=headers)
+        return c, c.getresponse()
+
+    def progress(self, method, path, query=None, headers={}, verbose=True, on_event=None):
+        c, resp = self.stream(method, path, query=query, headers=headers)
+        rc = 0 if resp.status == 200 else 1
+        try:
+            for line in resp:
+                t = time.monotonic()
+                ev = json.loads(line)
+                if on_event is not None and 'id' in ev:
+                    detail = ev.get('progressDetail') or {}
+                    on_event(t, ev['id'], ev.get('status', ''), detail.get('current'), detail.get('total'))
+                if 'error' in ev:
+                    print(ev['error'])
+                    rc = 1
+                elif verbose:
+                    print(' '.join([ev.get(k, '') for k in ('id', 'status', 'progress')]).strip())
+        finally:
+            c.close()
+        return rc
+
+    def image_exists(self, ref):
+        status, _ = self.request('GET', '/images/%s/json' % ref)
+        return status == 200
+
+    def image_size(self, ref):
+        status, data = self.request('GET', '/images/%s/json' % ref)
+        return json.loads(data)['Size'] if status == 200 else None
+
+    def pull(self, ref, verbose=True, progress=None):
+        name, tag = split_ref(ref)
+        return self.progress('POST', '/images/create', query={'fromImage': name, 'tag': tag},
+                             verbose=verbose, on_event=progress)
+
+    def image_history(self, ref):
+        status, data = self.request('GET', '/images/%s/history' % ref)
+        if status != 200:
+            return []
+        return [h['Size'] for h in reversed(json.loads(data)) if h['Size'] > 0]
+
+    def push(self, ref, verbose=True):
+        name, tag = split_ref(ref)
+        auth = base64.urlsafe_b64encode(b'{}').decode()
+        return self.progress('POST', '/images/%s/push' % name, query={'tag': tag},
+                             headers={'X-Registry-Auth': auth}, verbose=verbose)
+
+    def tag(self, src, dst, verbose=True):
+        name, tag = split_ref(dst)
+        status, data = self.request('POST', '/images/%s/tag' % src, query={'repo': name, 'tag': tag})
+        if status != 201:
+            print(data)
+        return 0 if status == 201 else 1
+
+    def create(self, ref, name, cmd='', env={}, ports=[], mounts=[], stdin=False, labels={}, verbose=True):
+        body = {'Image': ref,
+                'Cmd': shlex.split(cmd) or None,
+                'Env': ['%s=%s' % (k, v) for k, v in env.items()],
+                'Labels': labels,
+                'ExposedPorts': dict(('%d/tcp' % c, {}) for _, c in ports),
+                'AttachStdin': stdin,
+                'OpenStdin': stdin,
+                'StdinOnce': stdin,
+                'HostConfig': {
+                    'PortBindings': dict(('%d/tcp' % c, [{'HostPort': str(h)}]) for h, c in ports),
+                    'Binds': ['%s:%s' % (a, b) for a, b in mounts]}}
+        if verbose:
+            print('POST /containers/create %s' % json.dumps(body))
+        status, data = self.request('POST', '/containers/create', body=body, query={'name': name})
+        assert(status == 201), data
+        return json.loads(data)['Id']
+
+    def start(self, cid, verbose=True):
+        status, data = self.request('POST', '/containers/%s/start' % cid)
+        assert(status in (204, 304)), data
+
+    def start_attach(self, cid, stdin=b'', verbose=True):
+        # attach hijacks a raw connection which carries stdin and the multiplexed output
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.connect(self.sock)
+        try:
+            s.sendall(('POST %s HTTP/1.1\r\nHost: docker\r\nConnection: Upgrade\r\nUpgrade: tcp\r\n\r\n' %
+                       self.url('/containers/%s/attach' % cid,
+                                {'stream': 1, 'stdin': 1, 'stdout': 1, 'stderr': 1})).encode())
+            buf = b''
+            while b'\r\n\r\n' not in buf:
+                chunk = s.recv(4096)
+                assert(chunk != b''), 'attach connection closed'
+                buf += chunk
+            hdr, buf = buf.split(b'\r\n\r\n', 1)
+            assert(hdr.split(b' ')[1] in (b'101', b'200')), hdr
+            self.start(cid, verbose=verbose)
+            s.sendall(stdin)
+            s.shutdown(socket.SHUT_WR)
+            f = s.makefile('rb')
+            pending = io.BytesIO(buf)
+            out = b''.join([data for _, data in demux_stream(lambda n: pending.read(n) or f.read(n))])
+            f.close()
+        finally:
+            s.close()
+        return self.wait(cid), out
+
+    def wait(self, cid):
+        status, data = self.request('POST', '/containers/%s/wait' % cid)
+        assert(status == 200), data
+        return json.loads(data)['StatusCode']
+
+    def follow_logs(self, cid):
+        return EngineLogFollower(self, cid)
+
+    def print_logs(self, cid):
+        c, resp = self.stream('GET', '/containers/%s/logs' % cid, query={'stdout': 1, 'stderr': 1})
+        try:
+            for _, data in demux_stream(resp.read):
+                sys.stdout.write(data.decode(errors='replace'))
+        finally:
+            c.close()
+
+    def container_ip(self, cid):
+        status, data = self.request('GET', '/containers/%s/json' % cid)
+        assert(status == 200), data
+        nets = json.loads(data)['NetworkSettings']['Networks']
+        ips = [n['IPAddress'] for n in nets.values() if n.get('IPAddress')]
+        assert(len(ips) > 0), 'container %s has no ip address' % cid
+        return ips[0]
+
+    def container_pid(self, cid):
+        status, data = self.request('GET', '/containers/%s/json' % cid)
+        if status != 200 or json.loads(data)['State']['Pid'] == 0:
+            return None
+        return json.loads(data)['State']['Pid']
+
+    def logs(self, cid, since=None):
+        query = {'stdout': 1, 'stderr': 1}
+        if since is not None:
+            query['since'] = '%.3f' % since
+        c, resp = self.stream('GET', '/containers/%s/logs' % cid, query=query)
+        try:
+            return b''.join([data for _, data in demux_stream(resp.read)]).decode(errors='replace')
+        finally:
+            c.close()
+
+    def remove(self, cid, force=False, verbose=True):
+        status, data = self.request('DELETE', '/containers/%s' % cid, query={'force': int(force)})
+        assert(status == 204), data
+
+    def image_digest(self, ref):
+        status, data = self.request('GET', '/images/%s/json' % ref)
+        digests = json.loads(data).get('RepoDigests') if status == 200 else None
+        return digests[0].split('@')[1] if digests else None
+
+    def data_root(self):
+        status, data = self.request('GET', '/info')
+        assert(status == 200), data
+        return json.loads(data)['DockerRootDir']
+
+    def containers(self, labels):
+        query = {'all': 1, 'filters': json.dumps({'label': labels})}
+        status, data = self.request('GET', '/containers/json', query=query)
+        assert(status == 200), data
+        return [c['Id'] for c in json.loads(data)]
+
+    def images(self):
+        status, data = self.request('GET', '/images/json', query={'all': 1})
+        assert(status == 200), data
+        return set(i['Id'] for i in json.loads(data))
+
+    def remove_image(self, ref, verbose=True):
+        if verbose:
+            print('DELETE /images/%s' % ref)
+        status, data = self.request('DELETE', '/images/%s' % ref, query={'force': 1})
+        return 0 if status == 200 else 1
+
+
+class FakeLogFollower:
+    # `logs -f` of a fake container: the lines appear on a pipe at the ready time
+    def __init__(self, lines, at):
+        r, w = os.pipe()
+        self.stdout = os.fdopen(r, 'rb')
+        self.w = w
+        self.lock = threading.Lock()
+        self.killed = threading.Event()
+        self.thread = threading.Thread(target=self.feed, args=(lines, at), daemon=True)
+        self.thread.start()
+
+    def feed(self, lines, at):
+        if self.killed.wait(max(0.0, at - time.monotonic())):
+            return
+        with self.lock:
+            if self.w is not None:
+                os.write(self.w, ''.join(l + '\n' for l in lines).encode())
+
+    def kill(self):
+        self.killed.set()
+        with self.lock:
+            if self.w is not None:
+                os.close(self.w)
+                self.w = None
+
+    def wait(self):
+        self.thread.join()
+        self.stdout.close()
+        return 0
+
+
+class FakeHTTPHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '6')
+        self.end_headers()
+        self.wfile.write(b'hello\n')
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeBackend:
+    # In-process stand-in for a container runtime. Every operation sleeps for a
+    # latency drawn from a configurable distribution, published ports start
+    # accepting HTTP and wait-line benches print their wait line once the container
+    # is "ready", so benches, probes and schedulers run without any docker.
+    LATENCY = {'pull': 0.0, 'push': 0.0, 'tag': 0.0, 'create': 0.0, 'start': 0.0, 'ready': 0.0, 'remove': 0.0}
+
+    def __init__(self, latency={}, dist='const', rng=None):
+        self.latency = dict(FakeBackend.LATENCY)
+        self.latency.update(latency)
+        self.dist = dist
+        self.rng = rng or random.Random()
+        self.lock = threading.Lock()
+        self.pulled = set()
+        self.ctrs = {}
+
+    def sample(self, kind):
+        mean = self.latency[kind]
+        if mean <= 0 or self.dist == 'const':
+            return max(0.0, mean)
+        with self.lock:
+            if self.dist == 'exp':
+                return self.rng.expovariate(1.0 / mean)
+            elif self.dist == 'uniform':
+                return self.rng.uniform(0.0, 2 * mean)
+            else:
+                assert(self.dist == 'lognormal'), 'unknown latency distribution: %s' % self.dist
+                # sigma 0.5, with mu chosen so that the mean is the configured one
+                return self.rng.lognormvariate(math.log(mean) - 0.125, 0.5)
+
+    def delay(self, kind):
+        time.sleep(self.sample(kind))
+
+    def image_exists(self, ref):
+        with self.lock:
+            return ref in self.pulled
+
+    def image_size(self, ref):
+        return None
+
+    def image_history(self, ref):
+        return []
+
+    def image_digest(self, ref):
+        return None
+
+    def pull(self, ref, verbose=True, progress=None):
+        layer = hashlib.sha256(ref.encode()).hexdigest()[:12]
+        if progress is not None:
+            progress(time.monotonic(), layer, 'Pulling fs layer')
+        self.delay('pull')
+        if progress is not None:
+            progress(time.monotonic(), layer, 'Pull complete')
+        with self.lock:
+            self.pulled.add(ref)
+        return 0
+
+    def push(self, ref, verbose=True):
+        self.delay('push')
+        return 0
+
+    def tag(self, src, dst, verbose=True):
+        self.delay('tag')
+        with self.lock:
+            self.pulled.add(dst)
+        return 0
+
+    def create(self, ref, name, cmd='', env={}, ports=[], mounts=[], stdin=False, labels={}, verbose=True):
+        self.delay('create')
+        cid = '%064x' % self.rng.getrandbits(256)
+        repo = ref.rsplit('/', 1)[-1]
+        runargs = BenchRunner.CMD_ARG_WAIT.get(repo)
+        waitline = runargs.waitline if runargs is not None else []
+        with self.lock:
+            self.ctrs[cid] = {'ref': ref, 'ports': ports, 'labels': labels, 'servers': [],
+                              'lines': ['hello'] + (waitline if isinstance(waitline, list) else [waitline]),
+                              'ready_at': None}
+        return cid
+
+    def start(self, cid, verbose=True):
+        self.delay('start')
+        c = self.ctrs[cid]
+        ready = self.sample('ready')
+        c['ready_at'] = time.monotonic() + ready
+        if len(c['ports']) > 0:
+            threading.Timer(ready, self.listen, args=(c,)).start()
+
+    def listen(self, c):
+        for host_port, _ in c['ports']:
+            try:
+                srv = http.server.ThreadingHTTPServer(('127.0.0.1', host_port), FakeHTTPHandler)
+            except OSError as e:
+                print('fake: cannot listen on %d: %s' % (host_port, e))
+                continue
+            srv.daemon_threads = True
+            c['servers'].append(srv)
+            threading.Thread(target=srv.serve_forever, args=(0.01,), daemon=True).start()
+
+    def start_attach(self, cid, stdin=b'', verbose=True):
+        self.start(cid, verbose=verbose)
+        return self.wait(cid), b'hello\n'
+
+    def wait(self, cid):
+        time.sleep(max(0.0, self.ctrs[cid]['ready_at'] - time.monotonic()))
+        return 0
+
+    def follow_logs(self, cid):
+        c = self.ctrs[cid]
+        return FakeLogFollower(c['lines'], c['ready_at'])
+
+    def logs(self, cid, since=None):
+        c = self.ctrs[cid]
+        return ''.join(l + '\n' for l in c['lines']) if time.monotonic() >= c['ready_at'] else ''
+
+    def print_logs(self, cid):
+        sys.stdout.write(self.logs(cid))
+
+    def container_pid(self, cid):
+        return None  # fake containers have no processes to sample
+
+    def remove(self, cid, force=False, verbose=True):
+        self.delay('remove')
+        with self.lock:
+            c = self.ctrs.pop(cid)
+        for srv in c['servers']:
+            srv.shutdown()
+            srv.server_close()
+
+    def containers(self, labels):
+        def match(c, l):
+            k, _, v = l.partition('=')
+            return k in c['labels'] and (v == '' or c['labels'][k] == v)
+        with self.lock:
+            return [cid for cid, c in self.ctrs.items() if all(match(c, l) for l in labels)]
+
+    def images(self):
+        with self.lock:
+            return set('sha256:' + hashlib.sha256(ref.encode()).hexdigest() for ref in self.pulled)
+
+    def remove_image(self, ref, verbose=True):
+        with self.lock:
+            for r in list(self.pulled):
+                if ref in (r, 'sha256:' + hashlib.sha256(r.encode()).hexdigest()):
+                    self.pulled.discard(r)
+                    return 0
+        return 1
+
+    def data_root(self):
+        return TMP_DIR
+
+
+FAKE_RUNTIME = r'''#!/bin/sh
+# fake docker compatible runtime written by hello3.py; state lives next to it
+S=${0%/*}
+. "$S/config"
+
+delay() {
+    # sleeps the latency of $1 and logs it as injected
+    eval "l=\$lat_$1"
+    [ "$l" = 0.000000000 ] && return 0
+    echo "$1 $l" >> "$S/injected"
+    sleep "$l"
+}
+
+container() {
+    C=$S/containers/$1
+    [ -d "$C" ] || { echo "Error: No such container: $1" >&2; exit 1; }
+}
+
+image() {
+    [ -f "$S/images/$1/id" ] || { echo "Error: No such image: $1" >&2; exit 1; }
+}
+
+until_ready() {
+    read r < "$C/ready_at"
+    [ "$r" -gt 0 ] || return 0
+    d=$((r - $(date +%s%N)))
+    [ "$d" -gt 0 ] && sleep $((d / 1000000000)).$(printf %09d $((d % 1000000000))) || true
+}
+
+eval "last=\${$#}"
+case $1 in
+image)
+    # image inspect [--format F] REF
+    image "$last"
+    case "$*" in
+    *Size*) echo 0 ;;
+    *RepoDigests*) echo ;;
+    esac
+    ;;
+history)
+    image "$last"
+    ;;
+pull)
+    id=$(printf %s "$2" | sha256sum)
+    id=${id%% *}
+    layer=${id%"${id#????????????}"}
+    echo "latest: Pulling from ${2#*/}"
+    echo "$layer: Pulling fs layer"
+    delay pull
+    echo "$layer: Download complete"
+    echo "$layer: Pull complete"
+    echo "Digest: sha256:$id"
+    mkdir -p "$S/images/$2"
+    echo "sha256:$id" > "$S/images/$2/id"
+    ;;
+push)
+    image "$2"
+    delay push
+    ;;
+tag)
+    image "$2"
+    delay tag
+    mkdir -p "$S/images/$3"
+    cp "$S/images/$2/id" "$S/images/$3/id"
+    ;;
+create)
+    shift
+    labels= ports=
+    while [ $# -gt 0 ]; do
+        case $1 in
+        --name=*) name=${1#--name=} ;;
+        --label) shift; labels="$labels$1
+" ;;
+        -p) shift; ports="$ports ${1%%:*}" ;;
+        -e|-v) shift ;;
+        -i) ;;
+        *) break ;;
+        esac
+        shift
+    done
+    image "$1"
+    delay create
+    cid=$(printf %s "$name" | sha256sum)
+    cid=${cid%% *}
+    C=$S/containers/$cid
+    mkdir -p "$C"
+    printf %s "$labels" > "$C/labels"
+    repo=${1##*/}
+    cat "$S/lines/${repo%%:*}" > "$C/log" 2>/dev/null || echo hello > "$C/log"
+    echo 0 > "$C/ready_at"
+    for p in $ports; do
+        # binds now and listens once ready, so the listener's startup overlaps create and start
+        "$PYTHON" -S -E "$S/listen.py" "$p" "$C" < /dev/null > /dev/null 2>&1 &
+        echo $! >> "$C/pids"
+    done
+    echo "$cid"
+    ;;
+start)
+    container "$last"
+    delay start
+    if [ "$lat_ready" = 0.000000000 ]; then
+        echo 1 > "$C/ready_at"
+    else
+        echo $(($(date +%s%N) + ns_ready)) > "$C/ready_at"
+        echo "ready $lat_ready" >> "$S/injected"
+    fi
+    if [ "$2" = -a ]; then
+        cat > /dev/null
+        until_ready
+        cat "$C/log"
+    fi
+    ;;
+wait)
+    container "$2"
+    until_ready
+    echo 0
+    ;;
+logs)
+    container "$last"
+    if [ "$2" = -f ]; then
+        until_ready
+    else
+        read r < "$C/ready_at"
+        [ "$r" -le "$(date +%s%N)" ] || exit 0
+    fi
+    cat "$C/log"
+    ;;
+inspect)
+    case "$*" in
+    *State.Pid*) echo 0 ;;  # no processes to sample
+    *)
+        echo "Error: the fake runtime has no container networks" >&2
+        exit 1
+        ;;
+    esac
+    ;;
+rm)
+    [ -d "$S/containers/$last" ] || exit 0
+    container "$last"
+    delay remove
+    [ -f "$C/pids" ] && kill $(cat "$C/pids") 2>/dev/null
+    rm -rf "$C"
+    ;;
+ps)
+    # ps -aq --no-trunc [--filter label=K[=V]]...
+    for c in "$S"/containers/*; do
+        [ -d "$c" ] || continue
+        for a; do
+            case $a in
+            label=*=*) grep -qxF "${a#label=}" "$c/labels" || continue 2 ;;
+            label=*) grep -q "^${a#label=}=" "$c/labels" || continue 2 ;;
+            esac
+        done
+        echo "${c##*/}"
+    done
+    ;;
+images)
+    find "$S/images" -name id -exec cat {} +
+    ;;
+rmi)
+    for f in $(find "$S/images" -name id); do
+        read i < "$f"
+        if [ "$i" = "$last" ] || [ "$f" = "$S/images/$last/id" ]; then
+            rm -rf "${f%/id}"
+            exit 0
+        fi
+    done
+    echo "Error: No such image: $last" >&2
+    exit 1
+    ;;
+info)
+    echo "$S"
+    ;;
+*)
+    echo "fake runtime: unsupported command: $*" >&2
+    exit 1
+    ;;
+esac
+'''
+
+FAKE_LISTENER = r'''import os, socket, sys, time
+# the published port of a fake container: bound at create, listening from the ready time on
+s = socket.socket()
+s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+s.bind(('127.0.0.1', int(sys.argv[1])))
+path = os.path.join(sys.argv[2], 'ready_at')
+while True:
+    with open(path) as f:
+        r = f.read()
+    if r.endswith('\n') and r != '0\n':
+        break
+    time.sleep(0.0005)
+time.sleep(max(0.0, int(r) / 1e9 - time.time()))
+s.listen(64)
+while True:
+    c, _ = s.accept()
+    c.recv(4096)
+    c.sendall(b'HTTP/1.0 200 OK\r\nContent-Length: 6\r\n\r\nhello\n')
+    c.close()
+'''
+
+
+class FakeCli(DockerCli):
+    # The cli backend driving a fake runtime binary: a sh script implementing the
+    # commands DockerCli runs, which sleeps the configured latencies and logs each
+    # of them to <root>/injected. Server benches get a listener on their published
+    # port once ready and wait-line benches print their line. Unlike FakeBackend,
+    # the fork/exec and output parsing of every cli call stay in the measurement,
+    # which is what --op calibrate is after.
+    def __init__(self, latency={}, dist='const', root=None):
+        if dist != 'const':
+            raise ValueError('the fake runtime binary only has constant latencies')
+        self.latency = dict(FakeBackend.LATENCY)
+        self.latency.update(latency)
+        self.dist = dist
+        self.root = root or tempfile.mkdtemp(dir=TMP_DIR)
+        for d in ('containers', 'images', 'lines'):
+            os.makedirs(os.path.join(self.root, d), exist_ok=True)
+        with open(os.path.join(self.root, 'config'), 'w') as f:
+            f.write('PYTHON=%s\n' % shlex.quote(sys.executable))
+            for kind, v in self.latency.items():
+                f.write('lat_%s=%.9f\n' % (kind, v))
+            f.write('ns_ready=%d\n' % round(self.latency['ready'] * 1e9))
+        for repo, runargs in BenchRunner.CMD_ARG_WAIT.items():
+            waitline = runargs.waitline if isinstance(runargs.waitline, list) else [runargs.waitline]
+            with open(os.path.join(self.root, 'lines', repo), 'w') as f:
+                f.write(''.join(l + '\n' for l in ['hello'] + waitline))
+        with open(os.path.join(self.root, 'listen.py'), 'w') as f:
+            f.write(FAKE_LISTENER)
+        docker = os.path.join(self.root, 'docker')
+        with open(docker, 'w') as f:
+            f.write(FAKE_RUNTIME)
+        os.chmod(docker, 0o755)
+        self.reset_injected()
+        DockerCli.__init__(self, docker)
+
+    def injected(self):
+        # seconds slept per latency kind since reset_injected()
+        st = collections.Counter()
+        with open(os.path.join(self.root, 'injected')) as f:
+            for l in f:
+                kind, d = l.split()
+                st[kind] += float(d)
+        return st
+
+    def reset_injected(self):
+        open(os.path.join(self.root, 'injected'), 'w').close()
+
+
+BACKENDS = {'cli': lambda docker, sock, opts: DockerCli(docker),
+            'engine': lambda docker, sock, opts: DockerEngine(sock),
+            'fake': lambda docker, sock, opts: FakeBackend(**opts),
+            'fake-cli': lambda docker, sock, opts: FakeCli(**opts)}
+
+
+class PullTracker:
+    # Collects per-layer download and extract timings from pull progress events.
+    # Without a tty the cli prints no Downloading/Extracting progress, only
+    # 'Pulling fs layer', 'Waiting', 'Verifying Checksum', 'Download complete' and
+    # 'Pull complete', so the phases are bounded by those markers: a layer downloads
+    # from 'Pulling fs layer' or, if it was 'Waiting' for a download slot, from the
+    # next 'Download complete' of another layer, and layers extract one after the
+    # other, each once it is downloaded and its predecessor is extracted.
+    def __init__(self, ref):
+        self.ref = ref
+        self.start = time.monotonic()
+        self.layers = collections.OrderedDict()
+        self.waiting = []  # layers queued for a download slot, in order
+
+    def event(self, t, layer, status, current=None, total=None):
+        if not re.match(r'^[0-9a-f]{12,64}$', layer):
+            return  # e.g. the tag the pull status refers to
+        l = self.layers.setdefault(layer, {'id': layer})
+        t -= self.start
+        if status == 'Pulling fs layer':
+            l.setdefault('download_start', t)
+        elif status == 'Waiting':
+            l.pop('download_start', None)
+            self.waiting.append(layer)
+        elif status.startswith('Downloading'):
+            if layer in self.waiting:
+                self.waiting.remove(layer)
+            l.setdefault('download_start', t)
+            if total:
+                l['compressed'] = total
+        elif status == 'Verifying Checksum':
+            l.setdefault('verify_start', t)
+        elif status == 'Download complete':
+            l['download_end'] = t
+            if len(self.waiting) > 0:
+                # the freed slot goes to the first waiting layer
+                self.layers[self.waiting.pop(0)].setdefault('download_start', t)
+        elif status.startswith('Extracting'):
+            l.setdefault('extract_start', t)
+        elif status == 'Pull complete':
+            if 'extract_start' not in l:
+                done = [x['extract_end'] for x in self.layers.values() if 'extract_end' in x]
+                l['extract_start'] = max([l.get('download_end', t)] + done)
+            l['extract_end'] = t
+        elif status == 'Already exists':
+            l['cached'] = True
+
+    def describe(self, m, history):
+        # history: sizes of the non-empty layers, oldest first (the manifest order)
+        layers = list(self.layers.values())
+        if len(history) != len(layers):
+            history = [None] * len(layers)
+        total = 0
+        for l, size in zip(layers, history):
+            if size is not None:
+                l['uncompressed'] = size
+            if 'download_start' in l and 'download_end' in l:
+                l['download'] = l['download_end'] - l['download_start']
+                if 'compressed' in l and l['download'] > 0:
+                    l['throughput'] = l['compressed'] / l['download']
+                total += l.get('compressed', 0)
+            if 'extract_start' in l and 'extract_end' in l:
+                l['extract'] = l['extract_end'] - l['extract_start']
+        m.extra.setdefault('layers', []).extend(layers)
+        if total > 0:
+            m.metrics['pull_bytes'] = m.metrics.get('pull_bytes', 0) + total
+            if m.phases.get('pull', 0) > 0:
+                m.metrics['pull_throughput'] = m.metrics['pull_bytes'] / m.phases['pull']
+
+
+class CgroupSampler:
+    # Polls the cgroup v2 files of a container from a background thread. The
+    # cgroup is the one of the container's init process, so the layout of the
+    # runtime (docker-<id>.scope, machine.slice/libpod-<id>.scope, nerdctl, plain
+    # cgroupfs) does not matter. The series is stored column-wise to keep rows
+    # small; counters (cpu, io) are cumulative since the cgroup was created, memory
+    # is the current usage. Columns of a controller that is not enabled are None.
+    COLUMNS = ['cpu_usec', 'user_usec', 'system_usec', 'memory', 'io_rbytes', 'io_wbytes', 'io_rios', 'io_wios']
+
+    def __init__(self, cid, interval, t0=None, pid=lambda: None, root='/sys/fs/cgroup', proc='/proc'):
+        self.cid = cid
+        self.interval = interval
+        self.t0 = time.monotonic() if t0 is None else t0
+        self.pid = pid  # returns the host pid of the container's init, None until it runs
+        self.root = root
+        self.proc = proc
+        self.path = None
+        self.series = collections.OrderedDict((k, []) for k in ['t'] + CgroupSampler.COLUMNS)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def find(self):
+        pid = self.pid()
+        if pid is None:
+            return None
+        try:
+            with open(os.path.join(self.proc, str(pid), 'cgroup')) as f:
+                for l in f:
+                    hid, _, path = l.rstrip('\n').split(':', 2)
+                    if hid == '0':  # the unified hierarchy
+                        path = os.path.join(self.root, path.lstrip('/'))
+                        return path if os.path.isdir(path) else None
+        except OSError:
+            pass  # exited already
+        return None
+
+    def read_file(self, name):
+        try:
+            with open(os.path.join(self.path, name)) as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def read(self):
+        t = time.monotonic()
+        sample = [round(t - self.t0, 6)]
+        cpu = self.read_file('cpu.stat')
+        if cpu is not None:
+            cpu = dict((k, int(v)) for k, v in (l.split() for l in cpu.splitlines()))
+            sample += [cpu['usage_usec'], cpu['user_usec'], cpu['system_usec']]
+        else:
+            sample += [None] * 3
+        memory = self.read_file('memory.current')
+        sample.append(int(memory) if memory is not None else None)
+        io = self.read_file('io.stat')
+        if io is not None:
+            st = collections.Counter()
+            for l in io.splitlines():
+                for kv in l.split()[1:]:
+                    k, v = kv.split('=')
+                    st[k] += int(v)
+            sample += [st['rbytes'], st['wbytes'], st['rios'], st['wios']]
+        else:
+            sample += [None] * 4
+        return sample
+
+    def loop(self):
+        # the cgroup shows up when the container starts and is gone once it exits
+        while not self.stopped.is_set():
+            if self.path is None:
+                self.path = self.find()
+            if self.path is not None:
+                if not os.path.isdir(self.path):
+                    return
+                try:
+                    sample = self.read()
+                except (KeyError, ValueError):
+                    pass
+                else:
+                    if any(v is not None for v in sample[1:]):
+                        for k, v in zip(self.series, sample):
+                            self.series[k].append(v)
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        s = self.series
+        summary = {'path': self.path, 'interval': self.interval, 'samples': len(s['t'])}
+        if len(s['t']) > 0:
+            span = s['t'][-1] - s['t'][0]
+            summary.update(dict((k, s[k][-1]) for k in CgroupSampler.COLUMNS if k != 'memory'))
+            summary['memory_peak'] = max(s['memory']) if s['memory'][-1] is not None else None
+            if span > 0 and s['cpu_usec'][-1] is not None:
+                summary['cpu_util'] = (s['cpu_usec'][-1] - s['cpu_usec'][0]) / 1e6 / span
+            else:
+                summary['cpu_util'] = None
+            summary['series'] = s
+        return summary
+
+
+class RegistryCache:
+    # A local pull-through cache (registry:2 in proxy mode) in front of the
+    # upstream registry. Its storage lives in a host directory, so the blobs it
+    # already holds tell hits from misses, and its access log the bytes served.
+    ACCESS_LOG = re.compile(r'"GET /v2/(\S+)/blobs/(sha256:[0-9a-f]{64}) HTTP/[\d.]+" (\d{3}) (\d+)')
+
+    def __init__(self, engine, upstream, port=CACHE_PORT, storage='registry-cache', image='registry:2'):
+        self.engine = engine
+        self.upstream = upstream
+        self.port = port
+        self.storage = os.path.abspath(storage)
+        self.image = image
+        self.cid = None
+
+    def start(self, verbose=True):
+        os.makedirs(self.storage, exist_ok=True)
+        if not self.engine.image_exists(self.image):
+            assert(self.engine.pull(self.image, verbose=verbose) == 0)
+        self.cid = self.engine.create(self.image, name=container_name('registry_cache'),
+                                      env={'REGISTRY_PROXY_REMOTEURL': self.upstream},
+                                      ports=[(self.port, 5000)],
+                                      mounts=[(self.storage, '/var/lib/registry')], verbose=verbose)
+        self.engine.start(self.cid, verbose=verbose)
+        probe = HTTPProbe('127.0.0.1', self.port, path='/v2/', timeout=60)
+        try:
+            probe.wait()
+        finally:
+            probe.close()
+
+    def stop(self, verbose=True):
+        if self.cid is not None:
+            self.engine.remove(self.cid, force=True, verbose=verbose)
+            self.cid = None
+
+    def blobs(self):
+        root = os.path.join(self.storage, 'docker/registry/v2/blobs/sha256')
+        if not os.path.isdir(root):
+            return set()
+        return set('sha256:' + d for prefix in os.listdir(root) for d in os.listdir(os.path.join(root, prefix)))
+
+    def stats(self, repo, since, blobs_before):
+        # blob requests of repo served since the given unix time
+        st = {'hits': 0, 'misses': 0, 'bytes_hit': 0, 'bytes_miss': 0}
+        for l in self.engine.logs(self.cid, since=since).splitlines():
+            mm = RegistryCache.ACCESS_LOG.search(l)
+            if mm is None or mm.group(1).split('/')[-1] != repo or mm.group(3) != '200':
+                continue
+            if mm.group(2) in blobs_before:
+                st['hits'] += 1
+                st['bytes_hit'] += int(mm.group(4))
+            else:
+                st['misses'] += 1
+                st['bytes_miss'] += int(mm.group(4))
+        st['bytes_served'] = st['bytes_hit'] + st['bytes_miss']
+        return st
+
+
+def upstream_url(registry):
+    if registry in ('', 'docker.io'):
+        return 'https://registry-1.docker.io'
+    if registry.startswith('http://') or registry.startswith('https://'):
+        return registry
+    return 'https://' + registry
+
+
+class RegistryError(Exception):
+    pass
+
+
+class RegistryClient:
+    # Minimal registry v2 HTTP API client: anonymous bearer tokens and one
+    # keep-alive connection per thread.
+    MANIFEST_TYPES = ['application/vnd.docker.distribution.manifest.list.v2+json',
+                      'application/vnd.oci.image.index.v1+json',
+                      'application/vnd.docker.distribution.manifest.v2+json',
+                      'application/vnd.oci.image.manifest.v1+json']
+    INDEX_TYPES = MANIFEST_TYPES[:2]
+    CHUNK = 1 << 20
+
+    def __init__(self, registry):
+        registry = registry.rstrip('/')
+        if registry in ('', 'docker.io'):
+            registry = 'https://registry-1.docker.io'
+        elif not re.match(r'^https?://', registry):
+            host = registry.split(':')[0]
+            local = host == 'localhost' or host.startswith('127.')
+            registry = ('http://' if local else 'https://') + registry
+        self.base = registry
+        u = urllib.parse.urlparse(registry)
+        self.scheme = u.scheme
+        self.netloc = u.netloc
+        self.hub = self.netloc == 'registry-1.docker.io'
+        self.tokens = {}
+        self.local = threading.local()
+
+    def repo(self, name):
+        # official images live in the library/ namespace of docker hub
+        if self.hub and '/' not in name:
+            return 'library/' + name
+        return name
+
+    def conn(self):
+        c = getattr(self.local, 'conn', None)
+        if c is None:
+            cls = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+            c = self.local.conn = cls(self.netloc)
+        return c
+
+    def authenticate(self, repo, challenge):
+        params = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+        if not challenge.startswith('Bearer') or 'realm' not in params:
+            raise RegistryError('unsupported auth challenge: %s' % challenge)
+        query = dict((k, v) for k, v in params.items() if k in ('service', 'scope'))
+        with urlreq.urlopen(params['realm'] + '?' + urllib.parse.urlencode(query)) as resp:
+            js = json.loads(resp.read())
+        self.tokens[repo] = js.get('token') or js.get('access_token')
+
+    def request(self, method, repo, path, body=None, headers={}, ok=(200,), stream=False):
+        # path is relative to /v2/<repo>/ unless it is absolute (upload locations)
+        if not path.startswith('/') and not path.startswith('http'):
+            path = '/v2/%s/%s' % (repo, path)
+        if path.startswith('http'):
+            path = urllib.parse.urlsplit(path)._replace(scheme='', netloc='').geturl()
+        for attempt in range(3):
+            hdrs = dict(headers)
+            if repo in self.tokens:
+                hdrs['Authorization'] = 'Bearer ' + self.tokens[repo]
+            c = self.conn()
+            try:
+                c.request(method, path, body=body, headers=hdrs,
+                          encode_chunked=body is not None and not isinstance(body, bytes))
+                resp = c.getresponse()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                c.close()
+                self.local.conn = None
+                continue
+            if resp.status == 401 and attempt == 0 and not isinstance(body, collections.abc.Iterator):
+                resp.read()
+                self.authenticate(repo, resp.getheader('WWW-Authenticate', ''))
+                continue
+            if resp.status not in ok:
+                raise RegistryError('%s %s%s: %d %s' % (method, self.base, path, resp.status, resp.read()[:200]))
+            if not stream:
+                resp.data = resp.read()
+            return resp
+        raise RegistryError('%s %s%s: giving up' % (method, self.base, path))
+
+    def get_manifest(self, repo, ref):
+        resp = self.request('GET', repo, 'manifests/%s' % ref,
+                            headers={'Accept': ', '.join(RegistryClient.MANIFEST_TYPES)})
+        return resp.data, resp.getheader('Content-Type').split(';')[0]
+
+    def put_manifest(self, repo, ref, data, mtype):
+        self.request('PUT', repo, 'manifests/%s' % ref, body=data,
+                     headers={'Content-Type': mtype}, ok=(201,))
+
+    def has_blob(self, repo, digest):
+        resp = self.request('HEAD', repo, 'blobs/%s' % digest, ok=(200, 404))
+        return resp.status == 200
+
+    def open_blob(self, repo, digest):
+        resp = self.request('GET', repo, 'blobs/%s' % digest, ok=(200, 307, 302), stream=True)
+        if resp.status != 200:
+            # blob storage behind a redirect (e.g. a CDN); it carries its own credentials
+            location = resp.getheader('Location')
+            resp.read()
+            return urlreq.urlopen(location)
+        return resp
+
+    def mount_blob(self, repo, digest, from_repo):
+        resp = self.request('POST', repo, 'blobs/uploads/?' + urllib.parse.urlencode(
+            {'mount': digest, 'from': from_repo}), body=b'', ok=(201, 202))
+        if resp.status == 202:
+            # mount refused; cancel the upload session it opened instead
+            self.request('DELETE', repo, resp.getheader('Location'), ok=(204, 404))
+            return False
+        return True
+
+    def upload_blob(self, repo, digest, src):
+        # stream src into a chunked PATCH and commit it with the digest
+        resp = self.request('POST', repo, 'blobs/uploads/', body=b'', ok=(202,))
+        location = urllib.parse.urljoin(self.base, resp.getheader('Location'))
+
+        def chunks():
+            while True:
+                buf = src.read(RegistryClient.CHUNK)
+                if len(buf) == 0:
+                    return
+                yield buf
+        resp = self.request('PATCH', repo, location, body=chunks(),
+                            headers={'Content-Type': 'application/octet-stream'}, ok=(202,))
+        location = urllib.parse.urljoin(self.base, resp.getheader('Location'))
+        sep = '&' if '?' in location else '?'
+        self.request('PUT', repo, location + sep + urllib.parse.urlencode({'digest': digest}),
+                     body=b'', ok=(201,))
+
+
+class RegistryMover:
+    # Copies images between two registries over the v2 API without a daemon:
+    # blobs are streamed registry to registry, several at a time, skipped when the
+    # destination has them and cross-repo mounted when another repository has.
+    def __init__(self, src, dst, jobs=4):
+        self.src = RegistryClient(src)
+        self.dst = RegistryClient(dst)
+        self.same = self.src.base == self.dst.base
+        self.jobs = jobs
+        self.lock = threading.Lock()
+        self.known = {}  # digest -> destination repository that holds it
+
+    def copy_blob(self, src_repo, dst_repo, desc, st):
+        digest = desc['digest']
+        with self.lock:
+            other = self.known.get(digest)
+        if self.dst.has_blob(dst_repo, digest):
+            kind = 'skipped'
+        elif other is not None and other != dst_repo and self.dst.mount_blob(dst_repo, digest, other):
+            kind = 'mounted'
+        elif self.same and self.dst.mount_blob(dst_repo, digest, src_repo):
+            kind = 'mounted'
+        else:
+            src = self.src.open_blob(src_repo, digest)
+            try:
+                self.dst.upload_blob(dst_repo, digest, src)
+            finally:
+                src.close()
+            kind = 'copied'
+        with self.lock:
+            self.known[digest] = dst_repo
+            st['blobs_' + kind] += 1
+            st['bytes_' + kind] += desc.get('size', 0)
+
+    def copy_manifest(self, src_repo, dst_repo, ref, st, pool):
+        data, mtype = self.src.get_manifest(src_repo, ref)
+        manifest = json.loads(data)
+        if mtype in RegistryClient.INDEX_TYPES:
+            for child in manifest['manifests']:
+                self.copy_manifest(src_repo, dst_repo, child['digest'], st, pool)
+        else:
+            blobs = [manifest['config']] + manifest['layers']
+            futures = [pool.submit(self.copy_blob, src_repo, dst_repo, b, st) for b in blobs]
+            for fut in futures:
+                fut.result()
+        # children are pushed by digest, the top level manifest by tag
+        self.dst.put_manifest(dst_repo, ref, data, mtype)
+
+    def move(self, name, tag='latest'):
+        st = dict((k, 0) for k in ['blobs_copied', 'blobs_mounted', 'blobs_skipped',
+                                   'bytes_copied', 'bytes_mounted', 'bytes_skipped'])
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            self.copy_manifest(self.src.repo(name), self.dst.repo(name), tag, st, pool)
+        return st
+
+
+class ImageIndex:
+    # Image metadata cached on disk as <root>/<digest>.json, so an image is only
+    # described once however often it is benchmarked. <root>/refs.json maps image
+    # names to the digest they were last seen with.
+    ARCH = {'x86_64': 'amd64', 'aarch64': 'arm64'}
+
+    def __init__(self, root, registry=None, engine=None):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.client = RegistryClient(registry) if registry is not None else None
+        self.engine = engine
+        self.lock = threading.Lock()
+        self.refs = self.read('refs.json') or {}
+
+    def read(self, name):
+        path = os.path.join(self.root, name)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def write(self, name, obj):
+        # write and rename so readers never see a partial file; the temp file is
+        # unique so concurrent jobs and runs sharing the index don't clobber it
+        f = tempfile.NamedTemporaryFile('w', dir=self.root, prefix=name + '.', suffix='.tmp', delete=False)
+        try:
+            with f:
+                json.dump(obj, f)
+            os.replace(f.name, os.path.join(self.root, name))
+        except BaseException:
+            os.unlink(f.name)
+            raise
+
+    def entry_name(self, digest):
+        return digest.replace(':', '_') + '.json'
+
+    def entries(self):
+        return [self.read(n) for n in sorted(os.listdir(self.root)) if n.startswith('sha256_') and n.endswith('.json')]
+
+    def lookup(self, name, digest=None):
+        digest = digest or self.refs.get(name)
+        return self.read(self.entry_name(digest)) if digest else None
+
+    def resolve(self, name, tag='latest'):
+        resp = self.client.request('HEAD', self.client.repo(name), 'manifests/%s' % tag,
+                                   headers={'Accept': ', '.join(RegistryClient.MANIFEST_TYPES)})
+        return resp.getheader('Docker-Content-Digest')
+
+    def describe(self, name, ref=None, digest=None):
+        # ref is the local image the uncompressed sizes are read from
+        if digest is None:
+            digest = self.resolve(name)
+        entry = self.lookup(name, digest)
+        if entry is None:
+            entry = self.fetch(name, digest, ref)
+            self.write(self.entry_name(digest), entry)
+        with self.lock:
+            if self.refs.get(name) != digest:
+                self.refs[name] = digest
+                self.write('refs.json', self.refs)
+        return entry
+
+    def fetch(self, name, digest, ref):
+        repo = self.client.repo(name)
+        data, mtype = self.client.get_manifest(repo, digest)
+        manifest = json.loads(data)
+        mdigest = digest
+        if mtype in RegistryClient.INDEX_TYPES:
+            # the platform a pull on this host resolves to
+            arch = ImageIndex.ARCH.get(os.uname().machine, os.uname().machine)
+            children = manifest['manifests']
+            child = next((m for m in children if m.get('platform', {}).get('os') == 'linux' and
+                          m['platform'].get('architecture') == arch), children[0])
+            mdigest = child['digest']
+            manifest = json.loads(self.client.get_manifest(repo, mdigest)[0])
+        blob = self.client.open_blob(repo, manifest['config']['digest'])
+        try:
+            config = json.loads(blob.read())
+        finally:
+            blob.close()
+        layers = [l['size'] for l in manifest['layers']]
+        entry = {'name': name, 'digest': digest, 'manifest': mdigest,
+                 'architecture': config.get('architecture'), 'created': config.get('created'),
+                 'compressed_size': sum(layers), 'layers': len(layers), 'layer_sizes': layers,
+                 'diff_ids': config['rootfs']['diff_ids'],
+                 'uncompressed_size': None, 'uncompressed_layer_sizes': None}
+        if self.engine is not None and ref is not None and self.engine.image_exists(ref):
+            entry['uncompressed_size'] = self.engine.image_size(ref)
+            entry['uncompressed_layer_sizes'] = self.engine.image_history(ref)
+        return entry
+
+    def lineage(self):
+        # the base of an image is the indexed image whose layers are the longest
+        # proper prefix of its own
+        entries = self.entries()
+        bases = {}
+        for e in entries:
+            best = None
+            for o in entries:
+                n = len(o['diff_ids'])
+                if n < len(e['diff_ids']) and e['diff_ids'][:n] == o['diff_ids'] and \
+                        (best is None or n > len(best['diff_ids'])):
+                    best = o
+            bases[e['digest']] = best['name'] if best else None
+        return bases
+
+
+class ParallelGzipWriter:
+    # Multi-member gzip: the stream is cut into chunks that are compressed on a
+    # thread pool (zlib releases the GIL) and written in order. gunzip, pigz and
+    # Python's gzip module read the concatenated members as one stream.
+    def __init__(self, f, jobs=4, chunk=4 << 20, level=6):
+        self.f = f
+        self.chunk = chunk
+        self.level = level
+        self.jobs = jobs
+        self.buf = bytearray()
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+        self.pending = collections.deque()
+
+    def write(self, data):
+        self.buf += data
+        while len(self.buf) >= self.chunk:
+            self.submit(bytes(self.buf[:self.chunk]))
+            del self.buf[:self.chunk]
+        return len(data)
+
+    def submit(self, data):
+        self.pending.append(self.pool.submit(gzip.compress, data, self.level))
+        # bound the memory held by compressed chunks waiting for their turn
+        while len(self.pending) > 2 * self.jobs:
+            self.f.write(self.pending.popleft().result())
+
+    def close(self):
+        if len(self.buf) > 0:
+            self.submit(bytes(self.buf))
+            self.buf = bytearray()
+        while len(self.pending) > 0:
+            self.f.write(self.pending.popleft().result())
+        self.pool.shutdown()
+
+
+class OCISnapshot:
+    # Images of the benches as one OCI image layout (oci-layout, index.json,
+    # blobs/sha256/<hex>); layers shared by several images are stored once. The
+    # layout is a directory, or a tar stream packed with zstd -T0 (.tar.zst) or
+    # parallel gzip (.tar.gz). Tar members are ordered so that manifests precede
+    # the blobs they reference, which lets an import consume the stream in one pass.
+    def __init__(self, path, jobs=4):
+        self.path = path
+        self.jobs = jobs
+
+    def compression(self):
+        for ext, kind in (('.tar.zst', 'zstd'), ('.tar.gz', 'gzip'), ('.tgz', 'gzip'), ('.tar', 'none')):
+            if self.path.endswith(ext):
+                return kind
+        return None  # a directory
+
+    def fetch_blob(self, client, repo, digest, root):
+        # returns the stats of this blob; the caller sums them, so the pool
+        # threads share no state
+        path = os.path.join(root, 'blobs', 'sha256', digest.split(':')[1])
+        if os.path.exists(path):
+            return collections.Counter(skipped=1)
+        h = hashlib.sha256()
+        src = client.open_blob(repo, digest)
+        try:
+            with open(path + '.tmp', 'wb') as f:
+                while True:
+                    buf = src.read(RegistryClient.CHUNK)
+                    if len(buf) == 0:
+                        break
+                    h.update(buf)
+                    f.write(buf)
+            if 'sha256:' + h.hexdigest() != digest:
+                raise RegistryError('%s: digest mismatch for %s' % (repo, digest))
+            os.rename(path + '.tmp', path)
+        except BaseException:
+            if os.path.exists(path + '.tmp'):
+                os.unlink(path + '.tmp')
+            raise
+        finally:
+            src.close()
+        return collections.Counter(fetched=1, bytes=os.path.getsize(path))
+
+    def export(self, registry, names, verbose=True):
+        client = RegistryClient(registry)
+        kind = self.compression()
+        root = self.path if kind is None else tmp_dir()
+        os.makedirs(os.path.join(root, 'blobs', 'sha256'), exist_ok=True)
+        with open(os.path.join(root, 'oci-layout'), 'w') as f:
+            json.dump({'imageLayoutVersion': '1.0.0'}, f)
+        st = collections.Counter()
+        manifests = []
+        blobs = {}
+        arch = ImageIndex.ARCH.get(os.uname().machine, os.uname().machine)
+        for name in names:
+            repo = client.repo(name)
+            data, mtype = client.get_manifest(repo, 'latest')
+            if mtype in RegistryClient.INDEX_TYPES:
+                # only the platform of this host is kept
+                children = json.loads(data)['manifests']
+                child = next((m for m in children if m.get('platform', {}).get('os') == 'linux' and
+                              m['platform'].get('architecture') == arch), children[0])
+                data, mtype = client.get_manifest(repo, child['digest'])
+            digest = 'sha256:' + hashlib.sha256(data).hexdigest()
+            with open(os.path.join(root, 'blobs', 'sha256', digest.split(':')[1]), 'wb') as f:
+                f.write(data)
+            manifests.append({'mediaType': mtype, 'digest': digest, 'size': len(data),
+                              'annotations': {'org.opencontainers.image.ref.name': name + ':latest'}})
+            manifest = json.loads(data)
+            for desc in [manifest['config']] + manifest['layers']:
+                blobs.setdefault(desc['digest'], repo)
+            if verbose:
+                print('%s: %s, %d layers' % (name, digest, len(manifest['layers'])))
+        with open(os.path.join(root, 'index.json'), 'w') as f:
+            json.dump({'schemaVersion': 2, 'manifests': manifests}, f)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            futures = [pool.submit(self.fetch_blob, client, repo, d, root) for d, repo in blobs.items()]
+            for fut in futures:
+                st.update(fut.result())
+        st['images'] = len(manifests)
+        st['blobs'] = len(blobs)
+        if kind is not None:
+            order = [m['digest'] for m in manifests] + list(blobs)
+            self.pack(root, order, kind)
+            shutil.rmtree(root)
+        return st
+
+    def pack(self, root, order, kind):
+        names = ['oci-layout', 'index.json'] + ['blobs/sha256/' + d.split(':')[1] for d in order]
+        p = None
+        if kind == 'zstd':
+            out = open(self.path, 'wb')
+            p = subprocess.Popen(['zstd', '-T0', '-q', '-c'], stdin=subprocess.PIPE, stdout=out)
+            f = p.stdin
+        elif kind == 'gzip':
+            out = open(self.path, 'wb')
+            f = ParallelGzipWriter(out, jobs=self.jobs)
+        else:
+            out = f = open(self.path, 'wb')
+        try:
+            with tarfile.open(fileobj=f, mode='w|') as tar:
+                for n in names:
+                    tar.add(os.path.join(root, n), arcname=n)
+        finally:
+            f.close()
+            if p is not None:
+                assert(p.wait() == 0), 'zstd failed'
+            out.close()
+
+    def members(self):
+        # (name, file object) of the layout in stream order
+        kind = self.compression()
+        if kind is None:
+            with open(os.path.join(self.path, 'index.json'), 'rb') as f:
+                yield 'index.json', f
+            blobs = os.path.join(self.path, 'blobs', 'sha256')
+            for n in os.listdir(blobs):
+                with open(os.path.join(blobs, n), 'rb') as f:
+                    yield 'blobs/sha256/' + n, f
+            return
+        p = None
+        if kind == 'zstd':
+            p = subprocess.Popen(['zstd', '-d', '-q', '-c', self.path], stdout=subprocess.PIPE)
+            src = p.stdout
+        elif kind == 'gzip':
+            src = gzip.open(self.path, 'rb')
+        else:
+            src = open(self.path, 'rb')
+        try:
+            with tarfile.open(fileobj=src, mode='r|') as tar:
+                for m in tar:
+                    if m.isfile():
+                        yield m.name, tar.extractfile(m)
+        finally:
+            src.close()
+            if p is not None:
+                p.wait()
+
+    def import_into(self, storage, verbose=True):
+        # writes the layout into the filesystem storage of a registry:2 (its
+        # /var/lib/registry); blobs are verified while they are copied
+        v2 = os.path.join(storage, 'docker', 'registry', 'v2')
+        st = collections.Counter()
+        index = None
+        for name, f in self.members():
+            if name == 'index.json':
+                index = json.load(f)
+                continue
+            if not name.startswith('blobs/sha256/'):
+                continue
+            hexd = name.split('/')[-1]
+            d = os.path.join(v2, 'blobs', 'sha256', hexd[:2], hexd)
+            path = os.path.join(d, 'data')
+            if os.path.exists(path):
+                st['skipped'] += 1
+                continue
+            os.makedirs(d, exist_ok=True)
+            h = hashlib.sha256()
+            try:
+                with open(path + '.tmp', 'wb') as out:
+                    while True:
+                        buf = f.read(RegistryClient.CHUNK)
+                        if len(buf) == 0:
+                            break
+                        h.update(buf)
+                        out.write(buf)
+                if h.hexdigest() != hexd:
+                    raise RegistryError('%s: digest mismatch for sha256:%s' % (self.path, hexd))
+                os.rename(path + '.tmp', path)
+            except BaseException:
+                if os.path.exists(path + '.tmp'):
+                    os.unlink(path + '.tmp')
+                raise
+            st['blobs'] += 1
+            st['bytes'] += os.path.getsize(path)
+        if index is None:
+            raise RegistryError('no index.json in %s' % self.path)
+
+        def link(path, digest):
+            os.makedirs(path, exist_ok=True)
+            with open(os.path.join(path, 'link'), 'w') as f:
+                f.write(digest)
+
+        for m in index['manifests']:
+            name, tag = m['annotations']['org.opencontainers.image.ref.name'].rsplit(':', 1)
+            repo = os.path.join(v2, 'repositories', name)
+            hexd = m['digest'].split(':')[1]
+            with open(os.path.join(v2, 'blobs', 'sha256', hexd[:2], hexd, 'data')) as f:
+                manifest = json.load(f)
+            for desc in [manifest['config']] + manifest['layers']:
+                link(os.path.join(repo, '_layers', 'sha256', desc['digest'].split(':')[1]), desc['digest'])
+            link(os.path.join(repo, '_manifests', 'revisions', 'sha256', hexd), m['digest'])
+            link(os.path.join(repo, '_manifests', 'tags', tag, 'current'), m['digest'])
+            link(os.path.join(repo, '_manifests', 'tags', tag, 'index', 'sha256', hexd), m['digest'])
+            st['images'] += 1
+            if verbose:
+                print('%s:%s -> %s' % (name, tag, m['digest']))
+        return st
+
+
+class TraceIndex:
+    # Byte ranges of the files read while a bench started, in order of first access.
+    # Traces are text files with one access per line, either
+    #   {"path": "/usr/bin/x", "offset": 0, "size": 4096}      (json, "len"/"length" also accepted)
+    #   [<op>] <path> <offset> <size>                           (whitespace separated)
+    #   pread64(3</usr/bin/x>, ""..., 4096, 0) = 4096           (strace -y output)
+    STRACE = re.compile(r'\b(p?read(?:64)?)\(\d+<([^>]+)>, .*?, (\d+)(?:, (\d+))?\)\s+=\s+(\d+)')
+
+    def __init__(self):
+        self.files = collections.OrderedDict()
+        self.cursor = {}  # path -> offset of the next plain read()
+
+    def add(self, path, offset, size):
+        if size > 0:
+            self.files.setdefault(path, []).append((offset, offset + size))
+
+    def parse_line(self, l):
+        l = l.strip()
+        if l == '' or l.startswith('#'):
+            return
+        if l.startswith('{'):
+            js = json.loads(l)
+            path = js.get('path', js.get('file'))
+            size = js.get('size', js.get('len', js.get('length', 0)))
+            self.add(path, int(js.get('offset', 0)), int(size))
+            return
+        mm = TraceIndex.STRACE.search(l)
+        if mm is not None:
+            path, ret = mm.group(2), int(mm.group(5))
+            if mm.group(4) is not None:
+                offset = int(mm.group(4))
+            else:
+                offset = self.cursor.get(path, 0)
+                self.cursor[path] = offset + ret
+            self.add(path, offset, ret)
+            return
+        tokens = l.split()
+        if len(tokens) >= 3 and tokens[-1].isdigit() and tokens[-2].isdigit():
+            self.add(tokens[-3], int(tokens[-2]), int(tokens[-1]))
+
+    def load(self, path):
+        with open(path, errors='replace') as f:
+            for l in f:
+                self.parse_line(l)
+        return self
+
+    def ranges(self, path):
+        merged = []
+        for start, end in sorted(self.files[path]):
+            if len(merged) > 0 and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return merged
+
+    def bytes(self):
+        return sum(end - start for p in self.files for start, end in self.ranges(p))
+
+    def save(self, index_path, prefetch_path):
+        with open(index_path, 'w') as f:
+            json.dump(collections.OrderedDict((p, self.ranges(p)) for p in self.files), f)
+        # the prefetch list keeps the startup order so it can be fed to a lazy-pulling snapshotter
+        with open(prefetch_path, 'w') as f:
+            for p in self.files:
+                for start, end in self.ranges(p):
+                    print('%s %d %d' % (p, start, end - start), file=f)
+
+
+def disk_counters():
+    # bytes and requests of the physical disks: partitions and stacked devices
+    # (device-mapper, md, ...) would count the same io twice
+    disks = set(d for d in os.listdir('/sys/block') if not os.listdir(os.path.join('/sys/block', d, 'slaves')))
+    c = collections.Counter()
+    with open('/proc/diskstats') as f:
+        for l in f:
+            xs = l.split()
+            if xs[2] in disks:
+                c['disk_reads'] += int(xs[3])
+                c['disk_read_bytes'] += int(xs[5]) * 512
+                c['disk_writes'] += int(xs[7])
+                c['disk_write_bytes'] += int(xs[9]) * 512
+    return c
+
+
+def net_counters():
+    c = collections.Counter()
+    with open('/proc/net/dev') as f:
+        for l in f.readlines()[2:]:
+            name, xs = l.split(':', 1)
+            if name.strip() == 'lo':
+                continue
+            xs = xs.split()
+            c['net_rx_bytes'] += int(xs[0])
+            c['net_rx_packets'] += int(xs[1])
+            c['net_tx_bytes'] += int(xs[8])
+            c['net_tx_packets'] += int(xs[9])
+    return c
+
+
+def host_counters(data_root=None):
+    c = disk_counters()
+    c.update(net_counters())
+    if data_root is not None:
+        st = os.statvfs(data_root)
+        c['data_root_bytes'] = (st.f_blocks - st.f_bfree) * st.f_frsize
+    return c
+
+
+def host_delta(before, after, m):
+    # host-wide counters, so operations running at the same time share them
+    # hosts without a non-lo interface or a physical disk have no such counters
+    d = dict((k, after[k] - before.get(k, 0)) for k in after)
+    rx = d.get('net_rx_bytes', 0)
+    pull = m.phases.get('pull', 0.0)
+    if pull > 0 and rx > 0:
+        d['pull_throughput'] = rx / pull
+    if rx > 0:
+        d['write_amplification'] = d.get('disk_write_bytes', 0) / rx
+    return d
+
+
+def analyze_trace(trace, image_bytes=None):
+    # writes <trace>.index.json and <trace>.prefetch next to the trace
+    base = os.path.splitext(trace)[0]
+    index = TraceIndex().load(trace)
+    index.save(base + '.index.json', base + '.prefetch')
+    accessed = index.bytes()
+    summary = {'files': len(index.files),
+               'bytes': accessed,
+               'image_bytes': image_bytes,
+               'fraction': accessed / image_bytes if image_bytes else None,
+               'prefetch': base + '.prefetch'}
+    return summary
+
+
+class ResultStore:
+    # Indexed SQLite copy of the result rows. The key columns and the phase
+    # durations are stored as columns, the full row as JSON next to them.
+    # Rows are unique by uid, so ingesting a file twice adds nothing.
+    KEYS = ['bench', 'category', 'op', 'runtime', 'clean_policy', 'start_time']
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS results (
+                id INTEGER PRIMARY KEY,
+                type TEXT, bench TEXT, category TEXT, op TEXT, runtime TEXT,
+                clean_policy TEXT, start_time TEXT, trial INTEGER, elapsed REAL, row TEXT,
+                run_id TEXT, uid TEXT);
+            CREATE INDEX IF NOT EXISTS results_key
+                ON results (bench, category, op, runtime, clean_policy, start_time);
+            CREATE INDEX IF NOT EXISTS results_time ON results (start_time);
+            CREATE TABLE IF NOT EXISTS phases (
+                result INTEGER REFERENCES results(id), phase TEXT, duration REAL);
+            CREATE INDEX IF NOT EXISTS phases_result ON phases (result, phase);
+        ''')
+        # stores written before rows had a uid
+        cols = [c[1] for c in self.db.execute('PRAGMA table_info(results)')]
+        for c in ('run_id', 'uid'):
+            if c not in cols:
+                self.db.execute('ALTER TABLE results ADD COLUMN %s TEXT' % c)
+        self.db.execute('CREATE UNIQUE INDEX IF NOT EXISTS results_uid ON results (uid)')
+
+    @staticmethod
+    def uid(row):
+        # measurements are identified by (run_id, bench, trial, op, runtime), plus the instance
+        # of a burst; rows written before run_id existed fall back to the run's start time.
+        # Summary rows (the ones with a type) are identified by their content.
+        if row.get('type') is None:
+            return json.dumps([row.get('run_id') or row.get('start_time'), row.get('bench'), row.get('trial'),
+                               row.get('op'), row.get('runtime'), row.get('instance')])
+        return hashlib.sha256(json.dumps(row, sort_keys=True).encode()).hexdigest()
 
+    def insert(self, rows):
+        with self.lock, self.db:
+            for row in rows:
+                cur = self.db.execute(
+                    'INSERT OR IGNORE INTO results (type, %s, trial, elapsed, row, run_id, uid) '
+                    'VALUES (?, %s, ?, ?, ?, ?, ?)' %
+                    (', '.join(ResultStore.KEYS), ', '.join(['?'] * len(ResultStore.KEYS))),
+                    [row.get('type')] + [row.get(k) for k in ResultStore.KEYS] +
+                    [row.get('trial'), row.get('elapsed'), json.dumps(row), row.get('run_id'),
+                     ResultStore.uid(row)])
+                if cur.rowcount == 0:
+                    continue  # already stored
+                phases = row.get('phases') or {}
+                self.db.executemany('INSERT INTO phases (result, phase, duration) VALUES (?, ?, ?)',
+                                    [(cur.lastrowid, k, v) for k, v in phases.items()])
 
-tmp_dir.nxt = 0
+    def ingest(self, path, batch=10000):
+        # returns the number of rows read, including the ones already stored
+        n = 0
+        rows = []
+        with open(path) as f:
+            for l in f:
+                if l.startswith('#') or l.strip() == '':
+                    continue
+                rows.append(json.loads(l))
+                if len(rows) >= batch:
+                    self.insert(rows)
+                    n += len(rows)
+                    rows = []
+        self.insert(rows)
+        return n + len(rows)
 
+    def query(self, group_by=['bench'], where={}, benches=None, since=None, until=None, phase=None):
+        # aggregates of plain result rows (summary/total rows are left out)
+        for k in group_by + list(where.keys()):
+            assert(k in ResultStore.KEYS), 'unknown column: %s' % k
+        cols = ', '.join(['r.%s' % k for k in group_by])
+        value = 'r.elapsed' if phase is None else 'p.duration'
+        sql = 'SELECT %s, COUNT(*), MIN(%s), AVG(%s), MAX(%s), AVG(%s * %s) FROM results r' % (
+            cols, value, value, value, value, value)
+        conds = ['r.type IS NULL']
+        params = []
+        if phase is not None:
+            sql += ' JOIN phases p ON p.result = r.id'
+            conds.append('p.phase = ?')
+            params.append(phase)
+        for k, v in where.items():
+            conds.append('r.%s = ?' % k)
+            params.append(v)
+        if benches is not None:
+            conds.append('r.bench IN (%s)' % ', '.join(['?'] * len(benches)))
+            params.extend(benches)
+        if since is not None:
+            conds.append('r.start_time >= ?')
+            params.append(since)
+        if until is not None:
+            conds.append('r.start_time <= ?')
+            params.append(until)
+        sql += ' WHERE ' + ' AND '.join(conds) + ' GROUP BY ' + cols + ' ORDER BY ' + cols
+        out = []
+        for rec in self.db.execute(sql, params):
+            n = len(group_by)
+            cnt, lo, mean, hi, sq = rec[n:]
+            out.append({'key': dict(zip(group_by, rec[:n])), 'n': cnt, 'min': lo, 'mean': mean, 'max': hi,
+                        'stddev': math.sqrt(max(0.0, sq - mean * mean) * cnt / (cnt - 1)) if cnt > 1 else 0.0})
+        return out
 
-def tmp_copy(src):
-    dst = tmp_dir()
-    shutil.copytree(src, dst)
-    return dst
+    def close(self):
+        self.db.close()
 
 
-def system_like_exec(cmd, verbose=True):
-    if verbose:
-        p_stdout = None
-        p_stderr = None
-    else:
-        p_stdout = subprocess.DEVNULL
-        p_stderr = subprocess.PIPE
-    p = subprocess.run(cmd, shell=True, stderr=p_stderr, stdout=p_stdout)
-    if (p.returncode != 0):
-        print(p.stderr)
-    return p.returncode
+class ResultFile:
+    # the --out file, with every row mirrored into the results store if there is one
+    def __init__(self, f, store=None):
+        self.f = f
+        self.store = store
+
+    def write(self, s):
+        self.f.write(s)
+
+    def flush(self):
+        self.f.flush()
+
+    def record(self, row):
+        if self.store is not None:
+            self.store.insert([row])
+
+
+class Monitor:
+    # Live view of a campaign: OpenMetrics counters, latency histograms and
+    # in-progress gauges served over HTTP, and progress events as JSON lines.
+    BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0]
+    CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+    def __init__(self, progress=None):
+        self.lock = threading.Lock()
+        self.progress = None
+        if progress == '-':
+            self.progress = sys.stdout
+        elif progress is not None:
+            self.progress = open(progress, 'a')
+        self.runs = collections.Counter()
+        self.elapsed = {}
+        self.phases = {}
+        self.running = {}  # label tuple -> start times of the operations in progress
+
+    def event(self, kind, **fields):
+        if self.progress is None:
+            return
+        fields.update({'event': kind, 'time': time.time()})
+        with self.lock:
+            print(json.dumps(fields), file=self.progress)
+            self.progress.flush()
+
+    @contextlib.contextmanager
+    def track(self, bench, op, runtime):
+        key = (bench.name, bench.category, op, runtime)
+        t = time.time()
+        with self.lock:
+            self.running.setdefault(key, []).append(t)
+        self.event('start', bench=bench.name, category=bench.category, op=op, runtime=runtime)
+        try:
+            yield
+        except BaseException as e:
+            with self.lock:
+                self.runs[key + ('error',)] += 1
+            self.event('error', bench=bench.name, category=bench.category, op=op, runtime=runtime,
+                       error=repr(e), seconds=time.time() - t)
+            raise
+        finally:
+            with self.lock:
+                self.running[key].remove(t)
+
+    def observe(self, row):
+        key = (row['bench'], row['category'], row['op'], row['runtime'])
+        with self.lock:
+            self.runs[key + ('ok',)] += 1
+            self.histogram(self.elapsed, key, row['elapsed'])
+            for phase, d in row['phases'].items():
+                self.histogram(self.phases, key + (phase,), d)
+        self.event('finish', bench=row['bench'], category=row['category'], op=row['op'],
+                   runtime=row['runtime'], elapsed=row['elapsed'], phases=row['phases'])
+
+    def histogram(self, hists, key, v):
+        h = hists.setdefault(key, {'buckets': [0] * len(Monitor.BUCKETS), 'count': 0, 'sum': 0.0})
+        for i, le in enumerate(Monitor.BUCKETS):
+            if v <= le:
+                h['buckets'][i] += 1
+        h['count'] += 1
+        h['sum'] += v
+
+    def labels(self, names, values):
+        def esc(v):
+            return str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return '{%s}' % ','.join('%s="%s"' % (k, esc(v)) for k, v in zip(names, values))
+
+    def render_histogram(self, out, name, names, hists):
+        for key, h in sorted(hists.items()):
+            for le, n in zip(Monitor.BUCKETS, h['buckets']):
+                out.append('%s_bucket%s %d' % (name, self.labels(names + ['le'], key + (le,)), n))
+            out.append('%s_bucket%s %d' % (name, self.labels(names + ['le'], key + ('+Inf',)), h['count']))
+            out.append('%s_count%s %d' % (name, self.labels(names, key), h['count']))
+            out.append('%s_sum%s %f' % (name, self.labels(names, key), h['sum']))
+
+    def render(self):
+        names = ['bench', 'category', 'op', 'runtime']
+        out = []
+        with self.lock:
+            out.append('# TYPE hello_bench_runs counter')
+            out.append('# HELP hello_bench_runs Finished operations by outcome.')
+            for key, n in sorted(self.runs.items()):
+                out.append('hello_bench_runs_total%s %d' % (self.labels(names + ['status'], key), n))
+            out.append('# TYPE hello_bench_elapsed_seconds histogram')
+            out.append('# UNIT hello_bench_elapsed_seconds seconds')
+            out.append('# HELP hello_bench_elapsed_seconds Duration of an operation.')
+            self.render_histogram(out, 'hello_bench_elapsed_seconds', names, self.elapsed)
+            out.append('# TYPE hello_bench_phase_seconds histogram')
+            out.append('# UNIT hello_bench_phase_seconds seconds')
+            out.append('# HELP hello_bench_phase_seconds Duration of a phase of an operation.')
+            self.render_histogram(out, 'hello_bench_phase_seconds', names + ['phase'], self.phases)
+            out.append('# TYPE hello_bench_in_progress gauge')
+            out.append('# HELP hello_bench_in_progress Operations currently running.')
+            for key, ts in sorted(self.running.items()):
+                out.append('hello_bench_in_progress%s %d' % (self.labels(names, key), len(ts)))
+            # a stuck bench shows up as an old start time
+            out.append('# TYPE hello_bench_in_progress_started_seconds gauge')
+            out.append('# UNIT hello_bench_in_progress_started_seconds seconds')
+            out.append('# HELP hello_bench_in_progress_started_seconds Unix time the oldest running operation started.')
+            for key, ts in sorted(self.running.items()):
+                if len(ts) > 0:
+                    out.append('hello_bench_in_progress_started_seconds%s %f' % (self.labels(names, key), min(ts)))
+        out.append('# EOF')
+        return '\n'.join(out) + '\n'
+
+    def serve(self, port, host='127.0.0.1'):
+        monitor = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                data = monitor.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', Monitor.CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        srv = http.server.ThreadingHTTPServer((host, port), Handler)
+        srv.daemon_threads = True
+        threading.Thread(target=srv.serve_forever, daemon=True).start()
+        print('metrics on http://%s:%d/metrics' % (host, srv.server_address[1]))
+        return srv
+
+
+def query_store(args, benches):
+    store = ResultStore(args.db)
+    group_by = args.group_by.split(',')
+    where = dict(kv.split('=', 1) for kv in args.where)
+    names = None if args.benchmarks == 'all' else [b.name for b in benches]
+    res = store.query(group_by=group_by, where=where, benches=names,
+                      since=args.since, until=args.until, phase=args.phase)
+    template = '%-40s %8s %9s %9s %9s %9s'
+    print(template % (','.join([k.upper() for k in group_by]), 'N', 'MIN', 'MEAN', 'MAX', 'STDDEV'))
+    for r in res:
+        print(template % (','.join([str(r['key'][k]) for k in group_by]), r['n'], '%.3f' % r['min'],
+                          '%.3f' % r['mean'], '%.3f' % r['max'], '%.3f' % r['stddev']))
+    store.close()
+
+
+class MountStager:
+    # Bind-mount sources are copied once into a staging area; every run gets its
+    # own view of the staged tree, prepared before the timed region starts.
+    # 'link' views are hardlink farms: cheap to create, and the benches only add
+    # new files (a.out, Main.class, ...) so the staged files are never modified.
+    def __init__(self, root, mode='link'):
+        self.root = root
+        self.mode = mode
+        self.staged = {}
+        self.pool = {}
+        self.used = []
+        self.lock = threading.Lock()
+
+    def stage(self, src):
+        with self.lock:
+            if src not in self.staged:
+                dst = os.path.join(self.root, 'staged', os.path.basename(src))
+                shutil.copytree(src, dst)
+                self.staged[src] = dst
+            return self.staged[src]
+
+    def view(self, src):
+        staged = self.stage(src)
+        dst = tmp_dir()
+        if self.mode == 'link':
+            shutil.copytree(staged, dst, copy_function=os.link)
+        else:
+            shutil.copytree(staged, dst)
+        return dst
+
+    def prepare(self, src, n=1):
+        views = [self.view(src) for _ in range(n)]
+        with self.lock:
+            self.pool.setdefault(src, []).extend(views)
+
+    def acquire(self, src):
+        with self.lock:
+            views = self.pool.get(src, [])
+            view = views.pop() if len(views) > 0 else None
+        if view is None:
+            view = self.view(src)  # not prepared: pays the copy inside the run
+        with self.lock:
+            self.used.append(view)
+        return view
+
+    def release(self):
+        with self.lock:
+            used, self.used = self.used, []
+        for view in used:
+            shutil.rmtree(view, ignore_errors=True)
+
+
+class PortAllocator:
+    # Hands out free ephemeral host ports. A port stays reserved until it is
+    # released, so concurrent containers never get the same one.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reserved = set()
+
+    def allocate(self):
+        with self.lock:
+            while True:
+                s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                s.bind(('', 0))
+                port = s.getsockname()[1]
+                s.close()
+                if port not in self.reserved:
+                    self.reserved.add(port)
+                    return port
+
+    def release(self, port):
+        with self.lock:
+            self.reserved.discard(port)
+
+
+class Cleaner:
+    # Removes only what the benches left behind: containers carrying the run label
+    # and images that appeared since a snapshot, plus the images the benches use,
+    # instead of pruning the whole host. Removals run concurrently.
+    def __init__(self, engine, run_id, jobs=4):
+        self.engine = engine
+        self.run_id = run_id
+        self.jobs = jobs
+
+    def labels(self, repo):
+        return {'hello-bench.run': self.run_id, 'hello-bench.bench': repo}
+
+    def snapshot(self):
+        return self.engine.images()
+
+    def clean(self, refs=[], since=None, filters=None, verbose=False):
+        # filters default to this run's containers, never those of other runs on the host
+        t = time.monotonic()
+        if filters is None:
+            filters = ['hello-bench.run=%s' % self.run_id]
+        ctrs = self.engine.containers(filters)
+        images = list(refs)
+        if since is not None:
+            images += sorted(self.engine.images() - since)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            list(pool.map(lambda cid: self.engine.remove(cid, force=True, verbose=verbose), ctrs))
+            removed = sum(rc == 0 for rc in pool.map(lambda ref: self.engine.remove_image(ref, verbose=verbose), images))
+        return {'scope': 'targeted', 'elapsed': time.monotonic() - t,
+                'containers': len(ctrs), 'images': removed}
 
 
 class RunArgs:
-    def __init__(self, env={}, arg='', stdin='', stdin_sh='sh', waitline='', mount=[]):
+    # waitline may be a string, a compiled regex or a list of them;
+    # with wait_all every one of them has to show up before the bench is ready
+    def __init__(self, env={}, arg='', stdin='', stdin_sh='sh', waitline='', wait_all=False, mount=[]):
         self.env = env
         self.arg = arg
         self.stdin = stdin
         self.stdin_sh = stdin_sh
         self.waitline = waitline
+        self.wait_all = wait_all
         self.mount = mount
 
 
@@ -185,6 +2774,10 @@ class BenchRunner:
                'python': RunArgs(arg='python -c \'print("hello")\''),
                'hello-world': RunArgs()}
 
+    # source dirs the custom benches bind-mount
+    CUSTOM_MOUNTS = {'iojs': ['iojs'],
+                     'node': ['node']}
+
     # values are function names
     CUSTOM = {'nginx': 'run_nginx',
               'iojs': 'run_iojs',
@@ -251,262 +2844,308 @@ class BenchRunner:
                  Bench('iojs', 'web-framework'),
                  ]])
 
-    def __init__(self, docker='docker', registry='localhost:5000', registry2='localhost:5000'):
+    def __init__(self, docker='docker', registry='localhost:5000', registry2='localhost:5000',
+                 ready_probe='http', probe_opts={}, backend='cli', docker_sock='/var/run/docker.sock',
+                 move_engine='daemon', move_jobs=4, mount_mode='link', probe_container_ip=False,
+                 run_id=None, clean_jobs=4, sample_interval=None, ports=None, monitor=None,
+                 backend_opts={}, calibration=None):
         self.docker = docker
+        self.data_root = None
+        self.sample_interval = sample_interval
+        # runners of several runtimes share one allocator and one monitor
+        self.ports = ports or PortAllocator()
+        self.monitor = monitor or Monitor()
+        self.probe_container_ip = probe_container_ip
+        self.stager = MountStager(TMP_DIR, mode=mount_mode)
+        self.move_engine = move_engine
+        self.move_jobs = move_jobs
+        self.mover = None
+        self.ready_probe = ready_probe
+        self.probe_opts = probe_opts
+        self.engine = BACKENDS[backend](docker, docker_sock, backend_opts)
+        self.calibration = calibration  # the --calibration file written by --op calibrate
+        self.cleaner = Cleaner(self.engine, run_id or str(os.getpid()), jobs=clean_jobs)
         self.registry = registry
         if self.registry != '':
             self.registry += '/'
         self.registry2 = registry2
         if self.registry2 != '':
             self.registry2 += '/'
+        self.namespace = ''
+        self.cache = None
+        self.index = None
 
-    def run_echo_hello(self, repo, verbose=True):
-        cmd = '%s run %s%s echo hello' % (self.docker, self.registry, repo)
-#         rc = os.system(cmd)
-        rc = system_like_exec(cmd, verbose=verbose)
-        assert(rc == 0)
+    def image(self, repo, to2=False):
+        if to2:
+            return '%s%s' % (self.registry2, repo)
+        return '%s%s%s' % (self.registry, self.namespace, repo)
 
-    def run_cmd_arg(self, repo, runargs, verbose=True):
-        assert(len(runargs.mount) == 0)
-        cmd = '%s run ' % self.docker
-        cmd += '%s%s ' % (self.registry, repo)
-        cmd += runargs.arg
-        if verbose:
-            print(cmd)
-#         rc = os.system(cmd)
-        rc = system_like_exec(cmd, verbose=verbose)
+    def refs(self, benches):
+        # every image name the benches may leave behind
+        return [self.image(b.repo, to2=to2) for b in benches for to2 in (False, True)]
+
+    def use_cache(self, cache):
+        # pull everything through the cache; docker.io images need their namespace spelled out
+        self.cache = cache
+        self.registry = 'localhost:%d/' % cache.port
+        if cache.upstream == upstream_url('docker.io'):
+            self.namespace = 'library/'
+
+    def ensure_image(self, repo, m, verbose=True):
+        # make image pulling an explicit phase instead of an implicit part of `run`
+        ref = self.image(repo)
+        with m.untimed():
+            exists = self.engine.image_exists(ref)
+        with m.phase('pull'):
+            if not exists:
+                self.pull_image(ref, m, verbose=verbose)
+
+    def pull_image(self, ref, m, verbose=True):
+        tracker = PullTracker(ref)
+        rc = self.engine.pull(ref, verbose=verbose, progress=tracker.event)
         assert(rc == 0)
+        m.pulls.append(tracker)
 
-    def run_cmd_arg_wait(self, repo, runargs, verbose=True):
-        name = '%s_bench_%d' % (repo, random.randint(1, 1000000))
-        env = ' '.join(['-e %s=%s' % (k, v)
-                        for k, v in list(runargs.env.items())])
-        cmd = ('%s run --name=%s %s %s%s %s' %
-               (self.docker, name, env, self.registry, repo, runargs.arg))
-        stderr = None
-        if verbose:
-            print(cmd)
+    def host_counters(self):
+        if self.data_root is None:
+            self.data_root = self.engine.data_root()
+        # the data root of a remote or rootless daemon may not be visible here
+        return host_counters(self.data_root if os.path.isdir(self.data_root) else None)
 
-        p = subprocess.Popen(cmd, shell=True, bufsize=1,
-                             stderr=subprocess.STDOUT,
-                             stdout=subprocess.PIPE)
-        while True:
-            l = p.stdout.readline()
-            if l == '':
-                continue
+    def sample(self, cid, m):
+        # resource usage of the container from create until stop_sampling()
+        if self.sample_interval is not None:
+            m.sampler = CgroupSampler(cid, self.sample_interval, t0=m.begins['create'],
+                                      pid=lambda: self.engine.container_pid(cid))
+            m.sampler.start()
+
+    def stop_sampling(self, m):
+        if m.sampler is not None:
+            with m.untimed():
+                m.extra['cgroup'] = m.sampler.stop()
+            m.sampler = None
+
+    def describe_pulls(self, m):
+        # layer sizes are looked up after the operation so they stay out of elapsed
+        for tracker in m.pulls:
+            tracker.describe(m, self.engine.image_history(tracker.ref))
+
+    @contextlib.contextmanager
+    def teardown(self, cid, m, verbose=True):
+        # removes the container after the block, also when the bench failed in it
+        try:
+            yield
+        finally:
+            self.stop_sampling(m)
+            with m.phase('teardown', timed=False):
+                self.engine.remove(cid, force=True, verbose=verbose)
+
+    def run_to_exit(self, repo, arg='', verbose=True, m=None):
+        self.ensure_image(repo, m, verbose=verbose)
+        with m.phase('create'):
+            cid = self.engine.create(self.image(repo), name=container_name(repo),
+                                     cmd=arg, labels=self.cleaner.labels(repo), verbose=verbose)
+        with self.teardown(cid, m, verbose=verbose):
+            self.sample(cid, m)
+            with m.phase('start'):
+                self.engine.start(cid, verbose=verbose)
+            with m.phase('ready'):
+                rc = self.engine.wait(cid)
+            self.stop_sampling(m)
             if verbose:
-                print(('out: ' + l.decode().strip()))
-            # are we done?
-            if l.find(runargs.waitline.encode()) >= 0:
-                # cleanup
-                if verbose:
-                    print('DONE')
-                cmd = '%s kill %s' % (self.docker, name)
-#                 rc = os.system(cmd)
-                rc = system_like_exec(cmd, verbose=verbose)
-                assert(rc == 0)
-                break
-        p.wait()
+                self.engine.print_logs(cid)
+        assert(rc == 0)
 
-    def run_cmd_stdin(self, repo, runargs, verbose=True):
-        cmd = '%s run ' % self.docker
-        for a, b in runargs.mount:
-            a = os.path.join(os.path.dirname(os.path.abspath(__file__)), a)
-            a = tmp_copy(a)
-            cmd += '-v %s:%s ' % (a, b)
-        cmd += '-i %s%s ' % (self.registry, repo)
-        if runargs.stdin_sh:
-            cmd += runargs.stdin_sh  # e.g., sh -c
-        if verbose:
-            stderr = subprocess.STDOUT
-            print(cmd)
-        else:
-            stderr = subprocess.DEVNULL
-        p = subprocess.Popen(
-            cmd, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=stderr)
-        if verbose:
-            print((runargs.stdin))
-        out, _ = p.communicate(runargs.stdin.encode())
-        if verbose:
-            print(out)
-        p.wait()
-        assert(p.returncode == 0)
+    def run_echo_hello(self, repo, verbose=True, m=None):
+        self.run_to_exit(repo, arg='echo hello', verbose=verbose, m=m)
 
-    def run_nginx(self, verbose=True):
-        name = 'nginx_bench_%d' % (random.randint(1, 1000000))
-        cmd = '%s run --name=%s -p %d:%d %snginx' % (
-            self.docker, name, NGINX_PORT, 80, self.registry)
-        if verbose:
-            print(cmd)
-            p_stdout = None
-        else:
-            p_stdout = subprocess.DEVNULL
-        p = subprocess.Popen(cmd, shell=True, stderr=subprocess.STDOUT,
-                             stdout=p_stdout)
-        while True:
+    def run_cmd_arg(self, repo, runargs, verbose=True, m=None):
+        assert(len(runargs.mount) == 0)
+        self.run_to_exit(repo, arg=runargs.arg, verbose=verbose, m=m)
+
+    def run_cmd_arg_wait(self, repo, runargs, verbose=True, m=None):
+        self.ensure_image(repo, m, verbose=verbose)
+        with m.phase('create'):
+            cid = self.engine.create(self.image(repo), name=container_name(repo),
+                                     cmd=runargs.arg, env=runargs.env,
+                                     labels=self.cleaner.labels(repo), verbose=verbose)
+        with self.teardown(cid, m, verbose=verbose):
+            self.sample(cid, m)
+            with m.phase('start'):
+                self.engine.start(cid, verbose=verbose)
+            p = self.engine.follow_logs(cid)
             try:
-                #                 req = urlreq.urlopen('http://localhost:%d' % NGINX_PORT)
-                req = urlreq.urlopen('http://localhost:%d' % NGINX_PORT)
-                req.close()
-                break
-            except:
-                time.sleep(0.01)  # wait 10ms
-                pass  # retry
-        cmd = '%s kill %s' % (self.docker, name)
-#         rc = os.system(cmd)
-        rc = system_like_exec(cmd, verbose=verbose)
-        assert(rc == 0)
+                probe = LogLineProbe(p.stdout, runargs.waitline, match_all=runargs.wait_all,
+                                     verbose=verbose, **self.probe_opts)
+                m.wait_ready(probe)
+            finally:
+                p.kill()
+            self.stop_sampling(m)
+            # both latencies count from the start request
+            t = m.begins['start']
+            m.metrics['first_log_line'] = probe.stream.first_line_at - t
+            m.metrics['waitline'] = probe.ready_at - t
+            if len(probe.matcher.patterns) > 1:
+                m.metrics['waitlines'] = dict((k, v - t) for k, v in probe.matcher.matched.items())
+            if verbose:
+                print('DONE')
         p.wait()
 
-    def run_iojs(self, verbose=True):
-        name = 'iojs_bench_%d' % (random.randint(1, 1000000))
-        cmd = '%s run --name=%s -p %d:%d ' % (self.docker, name, IOJS_PORT, 80)
-        a = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'iojs')
-        a = tmp_copy(a)
-        b = '/src'
-        cmd += '-v %s:%s ' % (a, b)
-        cmd += '%siojs iojs /src/index.js' % self.registry
-        if verbose:
-            print(cmd)
-            p_stdout = None
-        else:
-            p_stdout = subprocess.DEVNULL
-        p = subprocess.Popen(cmd, shell=True, stderr=subprocess.STDOUT,
-                             stdout=p_stdout)
-        while True:
-            try:
-                req = urlreq.urlopen('http://localhost:%d' % IOJS_PORT)
-                if verbose:
-                    print((req.read().strip()))
-                req.close()
-                break
-            except:
-                time.sleep(0.01)  # wait 10ms
-                pass  # retry
-        cmd = '%s kill %s' % (self.docker, name)
-#         rc = os.system(cmd)
-        rc = system_like_exec(cmd, verbose=verbose)
+    def run_cmd_stdin(self, repo, runargs, verbose=True, m=None):
+        mounts = []
+        for a, b in runargs.mount:
+            mounts.append((self.stager.acquire(source_dir(a)), b))
+        self.ensure_image(repo, m, verbose=verbose)
+        with m.phase('create'):
+            cid = self.engine.create(self.image(repo), name=container_name(repo),
+                                     cmd=runargs.stdin_sh or '', mounts=mounts, stdin=True,
+                                     labels=self.cleaner.labels(repo), verbose=verbose)
+        with self.teardown(cid, m, verbose=verbose):
+            self.sample(cid, m)
+            if verbose:
+                print((runargs.stdin))
+            # attached start runs until the container exits
+            with m.phase('start'):
+                rc, out = self.engine.start_attach(cid, stdin=runargs.stdin.encode(), verbose=verbose)
+            self.stop_sampling(m)
+            if verbose:
+                print(out)
         assert(rc == 0)
-        p.wait()
 
-    def run_node(self, verbose=True):
-        name = 'node_bench_%d' % (random.randint(1, 1000000))
-        cmd = '%s run --name=%s -p %d:%d ' % (self.docker, name, NODE_PORT, 80)
-        a = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'node')
-        a = tmp_copy(a)
-        b = '/src'
-        cmd += '-v %s:%s ' % (a, b)
-        cmd += '%snode node /src/index.js' % self.registry
-        if verbose:
-            print(cmd)
-            p_stdout = None
-        else:
-            p_stdout = subprocess.DEVNULL
-        p = subprocess.Popen(cmd, shell=True, stderr=subprocess.STDOUT,
-                             stdout=p_stdout)
-        while True:
-            try:
-                req = urlreq.urlopen('http://localhost:%d' % NODE_PORT)
+    def run_http(self, repo, cport, arg='', env={}, mounts=[], verbose=True, m=None):
+        self.ensure_image(repo, m, verbose=verbose)
+        port = None if self.probe_container_ip else self.ports.allocate()
+        try:
+            with m.phase('create'):
+                cid = self.engine.create(self.image(repo), name=container_name(repo), cmd=arg, env=env,
+                                         ports=[] if port is None else [(port, cport)],
+                                         mounts=mounts, labels=self.cleaner.labels(repo), verbose=verbose)
+            with self.teardown(cid, m, verbose=verbose):
+                self.sample(cid, m)
+                with m.phase('start'):
+                    self.engine.start(cid, verbose=verbose)
+                if port is None:
+                    with m.phase('inspect'):
+                        host, probe_port = self.engine.container_ip(cid), cport
+                else:
+                    host, probe_port = '127.0.0.1', port
+                probe = PROBES[self.ready_probe](host, probe_port, **self.probe_opts)
+                m.wait_ready(probe)
+                self.stop_sampling(m)
+                if verbose and self.ready_probe == 'http':
+                    print(probe.response.strip())
                 if verbose:
-                    print((req.read().strip()))
-                req.close()
-                break
-            except:
-                time.sleep(0.01)  # wait 10ms
-                pass  # retry
-        cmd = '%s kill %s' % (self.docker, name)
-#         rc = os.system(cmd)
-        rc = system_like_exec(cmd, verbose=verbose)
-        assert(rc == 0)
-        p.wait()
+                    self.engine.print_logs(cid)
+        finally:
+            # the host binding lasts until the container is gone
+            if port is not None:
+                self.ports.release(port)
 
-    def run_registry(self, verbose=True):
-        name = 'registry_bench_%d' % (random.randint(1, 1000000))
-        cmd = '%s run --name=%s -p %d:%d ' % (self.docker,
-                                              name, REGISTRY_PORT, 5000)
-        cmd += '-e GUNICORN_OPTS=["--preload"] '
-        cmd += '%sregistry' % self.registry
-        if verbose:
-            print(cmd)
-            p_stdout = None
+    def run_nginx(self, verbose=True, m=None):
+        self.run_http('nginx', 80, verbose=verbose, m=m)
+
+    def run_iojs(self, verbose=True, m=None):
+        a = self.stager.acquire(source_dir('iojs'))
+        self.run_http('iojs', 80, mounts=[(a, '/src')],
+                      arg='iojs /src/index.js', verbose=verbose, m=m)
+
+    def run_node(self, verbose=True, m=None):
+        a = self.stager.acquire(source_dir('node'))
+        self.run_http('node', 80, mounts=[(a, '/src')],
+                      arg='node /src/index.js', verbose=verbose, m=m)
+
+    def run_registry(self, verbose=True, m=None):
+        self.run_http('registry', 5000, env={'GUNICORN_OPTS': '["--preload"]'},
+                      verbose=verbose, m=m)
+
+    def kind(self, bench):
+        # the code path bench takes through run(); benches of a kind share the harness overhead
+        name = bench.name
+        for kind, table in (('echo_hello', BenchRunner.ECHO_HELLO), ('cmd_arg', BenchRunner.CMD_ARG),
+                            ('cmd_arg_wait', BenchRunner.CMD_ARG_WAIT), ('cmd_stdin', BenchRunner.CMD_STDIN),
+                            ('http', BenchRunner.CUSTOM)):
+            if name in table:
+                return kind
+        return 'unknown'
+
+    def prepare(self, bench, n=1):
+        # stage the bind-mount sources of bench and create n views, outside of any measurement
+        name = bench.name
+        if name in BenchRunner.CMD_STDIN:
+            srcs = [a for a, _ in BenchRunner.CMD_STDIN[name].mount]
         else:
-            p_stdout = subprocess.DEVNULL
-        p = subprocess.Popen(cmd, shell=True, stderr=subprocess.STDOUT,
-                             stdout=p_stdout)
-        while True:
-            try:
-                req = urlreq.urlopen('http://localhost:%d' % REGISTRY_PORT)
-                if verbose:
-                    print((req.read().strip()))
-                req.close()
-                break
-            except:
-                time.sleep(0.01)  # wait 10ms
-                pass  # retry
-        cmd = '%s kill %s' % (self.docker, name)
-#         rc = os.system(cmd)
-        rc = system_like_exec(cmd, verbose=verbose)
-        assert(rc == 0)
-        p.wait()
+            srcs = BenchRunner.CUSTOM_MOUNTS.get(name, [])
+        for a in srcs:
+            self.stager.prepare(source_dir(a), n)
 
-    def run(self, bench, verbose=True):
+    def release(self):
+        self.stager.release()
+
+    def run(self, bench, verbose=True, m=None):
         name = bench.name
         if name in BenchRunner.ECHO_HELLO:
-            self.run_echo_hello(repo=name, verbose=verbose)
+            self.run_echo_hello(repo=name, verbose=verbose, m=m)
         elif name in BenchRunner.CMD_ARG:
-            self.run_cmd_arg(repo=name, runargs=BenchRunner.CMD_ARG[name], verbose=verbose)
+            self.run_cmd_arg(repo=name, runargs=BenchRunner.CMD_ARG[name], verbose=verbose, m=m)
         elif name in BenchRunner.CMD_ARG_WAIT:
             self.run_cmd_arg_wait(
-                repo=name, runargs=BenchRunner.CMD_ARG_WAIT[name], verbose=verbose)
+                repo=name, runargs=BenchRunner.CMD_ARG_WAIT[name], verbose=verbose, m=m)
         elif name in BenchRunner.CMD_STDIN:
-            self.run_cmd_stdin(repo=name, runargs=BenchRunner.CMD_STDIN[name], verbose=verbose)
+            self.run_cmd_stdin(repo=name, runargs=BenchRunner.CMD_STDIN[name], verbose=verbose, m=m)
         elif name in BenchRunner.CUSTOM:
             fn = BenchRunner.__dict__[BenchRunner.CUSTOM[name]]
-            fn(self, verbose=verbose)
+            fn(self, verbose=verbose, m=m)
         else:
             print(('Unknown bench: ' + name))
             exit(1)
 
-    def pull(self, bench, verbose=True):
-        cmd = '%s pull %s%s' % (self.docker, self.registry, bench.name)
-#         rc = os.system(cmd)
-        rc = system_like_exec(cmd, verbose=verbose)
-        assert(rc == 0)
+    def pull(self, bench, verbose=True, m=None):
+        with m.phase('pull'):
+            self.pull_image(self.image(bench.name), m, verbose=verbose)
 
-    def push(self, bench, verbose=True, to2=False):
-        cmd = None
-        if to2:
-            cmd = '%s push %s%s' % (self.docker, self.registry2, bench.name)
-        else:
-            cmd = '%s push %s%s' % (self.docker, self.registry, bench.name)
-#         rc = os.system(cmd)
-        rc = system_like_exec(cmd, verbose=verbose)
+    def push(self, bench, verbose=True, to2=False, m=None):
+        with m.phase('push'):
+            rc = self.engine.push(self.image(bench.name, to2=to2), verbose=verbose)
         assert(rc == 0)
 
-    def tag(self, bench, verbose=True):
-        cmd = '%s tag %s%s %s%s' % (self.docker,
-                                    self.registry, bench.name,
-                                    self.registry2, bench.name)
-#         rc = os.system(cmd)
-        rc = system_like_exec(cmd, verbose=verbose)
+    def tag(self, bench, verbose=True, m=None):
+        with m.phase('tag'):
+            rc = self.engine.tag(self.image(bench.name), self.image(bench.name, to2=True), verbose=verbose)
         assert(rc == 0)
 
-    def operation(self, op, bench, verbose=True):
+    def move_registry(self, bench, verbose=True, m=None):
+        if self.mover is None:
+            self.mover = RegistryMover(self.registry, self.registry2, jobs=self.move_jobs)
+        with m.phase('move'):
+            name, tag = split_ref(bench.name)
+            st = self.mover.move(name, tag)
+        if verbose:
+            print(st)
+        m.metrics.update(st)
+
+    def operation(self, op, bench, verbose=True, m=None):
+        if m is None:
+            m = Measurement()
         if op == 'run':
-            self.run(bench, verbose=verbose)
+            self.run(bench, verbose=verbose, m=m)
         elif op == 'pull':
-            self.pull(bench, verbose=verbose)
+            self.pull(bench, verbose=verbose, m=m)
         elif op == 'push':
-            self.push(bench, verbose=verbose)
+            self.push(bench, verbose=verbose, m=m)
         elif op == 'tag':
-            self.tag(bench, verbose=verbose)
+            self.tag(bench, verbose=verbose, m=m)
+        elif op == 'move' and self.move_engine == 'registry':
+            self.move_registry(bench, verbose=verbose, m=m)
         elif op == 'move':
-            self.pull(bench, verbose=verbose)
-            self.tag(bench, verbose=verbose)
-            self.push(bench, verbose=verbose, to2=True)
+            self.pull(bench, verbose=verbose, m=m)
+            self.tag(bench, verbose=verbose, m=m)
+            self.push(bench, verbose=verbose, to2=True, m=m)
         else:
             print(('Unknown operation: ' + op))
             exit(1)
+        m.finish()
+        self.describe_pulls(m)
+        return m
 
 
 def list_bench(as_json=False):
@@ -548,12 +3187,955 @@ def clean_images(docker='docker', verbose=True):
     p.wait()
 
 
+def clean_global(runner, args):
+    t = time.monotonic()
+    clean_images(docker=runner.docker, verbose=args.verbose)
+    return {'scope': 'global', 'elapsed': time.monotonic() - t}
+
+
+def clean_each(runner, args, benches, fn):
+    # runs fn under --clean each and attaches the cleanup cost to the row it returns;
+    # a global prune runs before fn, a targeted cleanup after it
+    if args.clean != 'each':
+        return fn()
+    if args.clean_scope == 'global':
+        cleanup = clean_global(runner, args)
+        row = fn()
+    else:
+        since = runner.cleaner.snapshot()
+        row = fn()
+        cleanup = runner.cleaner.clean(refs=runner.refs(benches), since=since, verbose=args.verbose)
+    row['cleanup'] = cleanup
+    return row
+
+
+def bench_row(runner, args, bench, tstr):
+    if args.verbose:
+        print("start {}".format(bench.repo))
+    if runner.cache is not None:
+        blobs_before = runner.cache.blobs()
+        since = time.time()
+    if args.op == 'run':
+        runner.prepare(bench)
+    if args.host_stats:
+        counters = runner.host_counters()
+    with runner.monitor.track(bench, args.op, runner.docker):
+        m = runner.operation(args.op, bench, verbose=args.verbose)
+    elapsed = m.elapsed()
+    if args.host_stats:
+        m.extra['host'] = host_delta(counters, runner.host_counters(), m)
+    runner.release()
+    row = {'repo': bench.repo, 'category': bench.category, 'clean_policy': args.clean, 'bench': bench.name, 'op': args.op, 'elapsed': elapsed, 'runtime': runner.docker, 'start_time': tstr,
+           'run_id': runner.cleaner.run_id, 'backend': args.backend,
+           'phases': m.phases, 'metrics': m.metrics}
+    row.update(m.extra)
+    if runner.cache is not None:
+        row['cache'] = runner.cache.stats(bench.repo, since, blobs_before)
+    if runner.index is not None and args.op in ('run', 'pull'):
+        ref = runner.image(bench.repo)
+        try:
+            entry = runner.index.describe(bench.repo, ref=ref, digest=runner.engine.image_digest(ref))
+            row['image'] = dict((k, entry[k]) for k in ('digest', 'compressed_size', 'uncompressed_size', 'layers'))
+        except (RegistryError, OSError) as e:
+            print('image index %s: %s' % (bench.repo, e))
+    if args.trace_file is not None:
+        src = args.trace_file
+        dst = os.path.join(args.trace_dir, bench.repo + ".trace")
+        shutil.copy2(src, dst)
+        row['trace'] = dst
+        if args.analyze_traces:
+            row['trace_analysis'] = analyze_trace(dst, runner.engine.image_size(runner.image(bench.repo)))
+    if runner.calibration is not None and runner.calibration['backend'] == args.backend:
+        overhead = runner.calibration['overhead'].get('%s:%s' % (args.op, runner.kind(bench)))
+        if overhead is not None:
+            row['elapsed_corrected'] = elapsed - overhead['median']
+    runner.monitor.observe(row)
+    return row
+
+
+def calibrate(f, runner, args, benches, tstr):
+    # harness overhead of an operation: its elapsed time minus the latency the fake
+    # runtime binary injected, so the forks of the cli backend and the parsing of
+    # their output are part of it; summarized per op and bench kind into --calibration
+    assert(isinstance(runner.engine, FakeCli)), '--op calibrate needs --backend fake-cli'
+    samples = collections.OrderedDict()
+    for op in args.calibrate_ops.split(','):
+        a = argparse.Namespace(**vars(args))
+        a.op = op
+        for bench in benches:
+            bench_row(runner, a, bench, tstr)  # warm up: pulls the image on the first run
+            for trial in range(args.repeat):
+                runner.engine.reset_injected()
+                row = bench_row(runner, a, bench, tstr)
+                # removal happens in the teardown, which elapsed leaves out
+                injected = sum(d for kind, d in runner.engine.injected().items() if kind != 'remove')
+                row.update({'injected': injected, 'overhead': row['elapsed'] - injected, 'trial': trial})
+                write_row(f, row, echo=args.verbose)
+                samples.setdefault('%s:%s' % (op, runner.kind(bench)), []).append(row['overhead'])
+    overhead = collections.OrderedDict()
+    template = '%-24s %5s %9s %9s %9s %9s'
+    print(template % ('OP:KIND', 'N', 'MIN', 'MEDIAN', 'MEAN', 'P95'))
+    for key, xs in samples.items():
+        overhead[key] = {'n': len(xs), 'min': min(xs), 'median': statistics.median(xs),
+                         'mean': statistics.mean(xs), 'p95': percentile(xs, 95)}
+        print(template % (key, len(xs), '%.4f' % min(xs), '%.4f' % statistics.median(xs),
+                          '%.4f' % statistics.mean(xs), '%.4f' % percentile(xs, 95)))
+    path = args.calibration or 'calibration.json'
+    with open(path, 'w') as out:
+        # fake-cli runs the code of the cli backend, so the overhead applies to cli runs only
+        json.dump({'start_time': tstr, 'backend': 'cli', 'ops': args.calibrate_ops.split(','),
+                   'latency': runner.engine.latency, 'dist': runner.engine.dist, 'overhead': overhead},
+                  out, indent=1)
+    print('calibration written to %s' % path)
+
+
+def analyze_traces(f, runner, args, benches, tstr):
+    # (re)analyze the traces earlier runs left in --trace-dir
+    for bench in benches:
+        trace = os.path.join(args.trace_dir, bench.repo + '.trace')
+        if not os.path.exists(trace):
+            print('no trace for %s: %s' % (bench.name, trace))
+            continue
+        row = {'type': 'trace', 'repo': bench.repo, 'bench': bench.name, 'category': bench.category,
+               'trace': trace, 'start_time': tstr}
+        row['trace_analysis'] = analyze_trace(trace, runner.engine.image_size(runner.image(bench.repo)))
+        write_row(f, row)
+
+
+def run_churn(f, runner, args, bench, tstr):
+    # open loop: arrivals follow the schedule whether or not earlier containers are done,
+    # and latency counts from the scheduled arrival, so time spent queued behind a
+    # saturated runtime is part of it instead of silently slowing the arrivals down
+    assert(args.rate > 0 and args.duration > 0 and args.window > 0)
+    runner.operation('run', bench, verbose=args.verbose)  # pull the image outside the measurement
+    lock = threading.Lock()
+    windows = collections.defaultdict(lambda: {'latency': Histogram(), 'service': Histogram(), 'queue': Histogram(),
+                                               'teardown': Histogram(), 'arrivals': 0, 'errors': 0})
+    state = {'submitted': 0, 'started': 0, 'finished': 0}
+    samples = []  # (t, inflight, backlog) at every window boundary
+    t0 = time.monotonic() + 0.1
+
+    def arrival(at):
+        with lock:
+            state['started'] += 1
+        m = None
+        try:
+            with runner.monitor.track(bench, 'churn', runner.docker):
+                m = runner.operation('run', bench, verbose=False)
+        except Exception as e:
+            print('churn %s: %r' % (bench.name, e))
+        if m is not None:
+            # startup ends like elapsed does, when the container is ready; its removal is
+            # reported on its own
+            runner.monitor.observe({'bench': bench.name, 'category': bench.category, 'op': 'churn',
+                                    'runtime': runner.docker, 'elapsed': m.elapsed(), 'phases': m.phases})
+        with lock:
+            w = windows[int((at - t0) // args.window)]
+            state['finished'] += 1
+            if m is not None:
+                w['latency'].record(m.start - at + m.elapsed())
+                w['service'].record(m.elapsed())
+                w['queue'].record(m.start - at)
+                w['teardown'].record(m.phases.get('teardown', 0.0))
+            else:
+                w['errors'] += 1
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.max_inflight) as pool:
+        at = t0
+        boundary = t0
+        while at < t0 + args.duration:
+            while boundary <= at:
+                with lock:
+                    samples.append((boundary - t0, state['submitted'] - state['finished'],
+                                    state['submitted'] - state['started']))
+                boundary += args.window
+            delay = at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            with lock:
+                windows[int((at - t0) // args.window)]['arrivals'] += 1
+                state['submitted'] += 1
+            pool.submit(arrival, at)
+            at += random.expovariate(args.rate) if args.arrival == 'poisson' else 1.0 / args.rate
+        # arrivals are over; the backlog drains
+        while state['finished'] < state['submitted']:
+            while boundary <= time.monotonic():
+                with lock:
+                    samples.append((boundary - t0, state['submitted'] - state['finished'],
+                                    state['submitted'] - state['started']))
+                boundary += args.window
+            time.sleep(min(0.1, max(0.0, boundary - time.monotonic())))
+    wall = time.monotonic() - t0
+    runner.release()
+    rows = []
+    total = {'latency': Histogram(), 'service': Histogram(), 'queue': Histogram(), 'teardown': Histogram(),
+             'arrivals': 0, 'errors': 0}
+    template = '%-20s %7s %8s %7s %9s %9s %9s %9s %9s %8s %8s'
+    print(template % ('NAME', 'WINDOW', 'ARRIVALS', 'ERRORS', 'P50', 'P99', 'P999', 'MAX', 'QUEUE_P99',
+                      'INFLIGHT', 'BACKLOG'))
+    for i in sorted(windows):
+        w = windows[i]
+        for k in ('latency', 'service', 'queue', 'teardown'):
+            total[k].add(w[k])
+        total['arrivals'] += w['arrivals']
+        total['errors'] += w['errors']
+        # gauges sampled at the end of the window
+        end = [s for s in samples if s[0] <= (i + 1) * args.window + 1e-9]
+        inflight, backlog = end[-1][1:] if end else (0, 0)
+        row = {'type': 'churn', 'bench': bench.name, 'category': bench.category, 'op': 'churn',
+               'runtime': runner.docker, 'start_time': tstr, 'window': i, 't': i * args.window,
+               'arrivals': w['arrivals'], 'errors': w['errors'], 'inflight': inflight, 'backlog': backlog,
+               'latency': w['latency'].summary(), 'service': w['service'].summary(),
+               'queue': w['queue'].summary(), 'teardown': w['teardown'].summary()}
+        rows.append(row)
+        lat = row['latency']
+        print(template % (bench.name, i, w['arrivals'], w['errors'],
+                          *['-' if lat[k] is None else '%.3f' % lat[k] for k in ('p50', 'p99', 'p999', 'max')],
+                          '-' if row['queue']['p99'] is None else '%.3f' % row['queue']['p99'],
+                          inflight, backlog))
+        write_row(f, row, echo=False)
+    row = {'type': 'churn', 'bench': bench.name, 'category': bench.category, 'op': 'churn',
+           'runtime': runner.docker, 'start_time': tstr, 'window': None, 'rate': args.rate,
+           'duration': args.duration, 'arrival': args.arrival, 'wall': wall,
+           'arrivals': total['arrivals'], 'errors': total['errors'],
+           'throughput': (total['arrivals'] - total['errors']) / wall,
+           'max_inflight': max([s[1] for s in samples] + [0]), 'max_backlog': max([s[2] for s in samples] + [0]),
+           'latency': total['latency'].summary(), 'service': total['service'].summary(),
+           'queue': total['queue'].summary(), 'teardown': total['teardown'].summary()}
+    write_row(f, row)
+    return row
+
+
+def matrix(runners, benches, order, trial, rng=random):
+    # (runner, bench) cells of one trial
+    cells = [(r, b) for r in runners for b in benches]
+    if order == 'random':
+        rng.shuffle(cells)
+    elif order == 'balanced':
+        # the runtimes of a bench run back to back, and every runtime goes first equally often
+        n = len(runners)
+        cells = [(runners[(i + j + trial) % n], b) for i, b in enumerate(benches) for j in range(n)]
+    else:
+        assert(order == 'sequential'), 'unknown order: %s' % order
+    return cells
+
+
+def run_trial(f, args, cells, tstr, jobs, trial):
+    # cells are interleaved round-robin: every trial runs each runtime x bench once
+    rows = []
+
+    def record(row):
+        row['trial'] = trial
+        if f is not None:
+            write_row(f, row)
+        rows.append(row)
+
+    if jobs == 1:
+        for runner, bench in cells:
+            record(clean_each(runner, args, [bench], lambda: bench_row(runner, args, bench, tstr)))
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(bench_row, runner, args, bench, tstr) for runner, bench in cells]
+            for fut in concurrent.futures.as_completed(futures):
+                record(fut.result())
+    return rows
+
+
+def run_burst(f, runner, args, bench, tstr, concurrency, trial):
+    # start `concurrency` instances of bench at the same moment
+    barrier = threading.Barrier(concurrency)
+
+    def instance(i):
+        with runner.monitor.track(bench, 'burst', runner.docker):
+            barrier.wait()
+            m = runner.operation('run', bench, verbose=args.verbose)
+        return i, m
+
+    runner.prepare(bench, n=concurrency)
+    wall_start = time.monotonic()
+    rows = []
+    errors = []
+    try:
+        # every instance removes its own container, also when it failed, so one failure
+        # neither drops the rows of the others nor leaves containers behind
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = dict((pool.submit(instance, i), i) for i in range(concurrency))
+            for fut in concurrent.futures.as_completed(futures):
+                try:
+                    i, m = fut.result()
+                except Exception as e:
+                    print('burst %s instance %d: %r' % (bench.name, futures[fut], e))
+                    errors.append({'instance': futures[fut], 'error': repr(e)})
+                    continue
+                row = {'repo': bench.repo, 'category': bench.category, 'clean_policy': args.clean, 'bench': bench.name,
+                       'op': 'burst', 'elapsed': m.elapsed(), 'runtime': runner.docker, 'start_time': tstr,
+                       'run_id': runner.cleaner.run_id, 'backend': args.backend,
+                       'phases': m.phases, 'metrics': m.metrics,
+                       'concurrency': concurrency, 'instance': i, 'trial': trial}
+                row.update(m.extra)
+                runner.monitor.observe(row)
+                write_row(f, row)
+                rows.append(row)
+        wall = time.monotonic() - wall_start
+    finally:
+        runner.release()
+    xs = [r['elapsed'] for r in rows]
+    row = {'type': 'burst', 'bench': bench.name, 'category': bench.category, 'op': 'burst',
+           'clean_policy': args.clean, 'runtime': runner.docker, 'start_time': tstr,
+           'concurrency': concurrency, 'trial': trial, 'wall': wall,
+           'throughput': len(rows) / wall, 'errors': len(errors), 'failures': errors,
+           'min': None, 'median': None, 'mean': None, 'p95': None, 'max': None}
+    if len(xs) > 0:
+        row.update({'min': min(xs), 'median': statistics.median(xs), 'mean': statistics.mean(xs),
+                    'p95': percentile(xs, 95), 'max': max(xs)})
+    return row
+
+
+def run_bursts(f, runner, args, benches, tstr):
+    levels = [int(c) for c in args.concurrency.split(',')]
+    assert(all(c >= 1 for c in levels))
+    for trial in range(args.warmup):
+        for bench in benches:
+            runner.operation('run', bench, verbose=args.verbose)
+            runner.release()
+    results = []
+    for trial in range(args.repeat):
+        for bench in benches:
+            for c in levels:
+                row = clean_each(runner, args, [bench], lambda: run_burst(f, runner, args, bench, tstr, c, trial))
+                write_row(f, row)
+                results.append(row)
+    template = '%-20s %6s %5s %6s %9s %12s %9s %9s %9s'
+    print(template % ('NAME', 'CONCUR', 'TRIAL', 'ERRORS', 'WALL', 'STARTS/SEC', 'MEDIAN', 'P95', 'MAX'))
+    for r in results:
+        print(template % (r['bench'], r['concurrency'], r['trial'], r['errors'], '%.3f' % r['wall'],
+                          '%.2f' % r['throughput'],
+                          *['-' if r[k] is None else '%.3f' % r[k] for k in ('median', 'p95', 'max')]))
+
+
+class Histogram:
+    # HDR-style log-linear histogram of durations: values are kept in microseconds,
+    # exactly below 2 * 2**bits and with 2**bits buckets per power of two above,
+    # i.e. within 1 / 2**bits (0.8% for the default) of the recorded value
+    def __init__(self, bits=7):
+        self.bits = bits
+        self.sub = 1 << bits
+        self.counts = collections.Counter()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def index(self, v):
+        shift = max(0, v.bit_length() - self.bits - 1)
+        return shift * self.sub + (v >> shift)
+
+    def value(self, i):
+        # midpoint of bucket i, in microseconds
+        shift = max(0, i // self.sub - 1)
+        return ((i - shift * self.sub) << shift) + ((1 << shift) - 1) / 2.0
+
+    def record(self, seconds):
+        self.counts[self.index(int(seconds * 1e6))] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def add(self, other):
+        self.counts.update(other.counts)
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, p):
+        if self.count == 0:
+            return None
+        rank = max(1, int(math.ceil(self.count * p / 100.0)))
+        seen = 0
+        for i in sorted(self.counts):
+            seen += self.counts[i]
+            if seen >= rank:
+                return min(self.value(i) / 1e6, self.max)
+
+    def summary(self):
+        return {'count': self.count,
+                'mean': self.total / self.count if self.count > 0 else None,
+                'p50': self.percentile(50),
+                'p99': self.percentile(99),
+                'p999': self.percentile(99.9),
+                'max': self.max if self.count > 0 else None}
+
+
+def percentile(samples, p):
+    xs = sorted(samples)
+    k = (len(xs) - 1) * p / 100.0
+    lo = int(math.floor(k))
+    hi = int(math.ceil(k))
+    return xs[lo] + (xs[hi] - xs[lo]) * (k - lo)
+
+
+def bootstrap_ci(samples, stat=statistics.median, iters=1000, confidence=0.95, rng=random):
+    if len(samples) < 2:
+        return (samples[0], samples[0])
+    stats = sorted(stat(rng.choices(samples, k=len(samples))) for _ in range(iters))
+    alpha = (1.0 - confidence) / 2
+    return (percentile(stats, alpha * 100), percentile(stats, (1.0 - alpha) * 100))
+
+
+def ci_relative_width(samples, args):
+    if len(samples) < 2:
+        return float('inf')
+    lo, hi = bootstrap_ci(samples, iters=args.bootstrap, confidence=args.confidence)
+    median = statistics.median(samples)
+    return (hi - lo) / median if median > 0 else float('inf')
+
+
+def summarize(samples, args):
+    lo, hi = bootstrap_ci(samples, iters=args.bootstrap, confidence=args.confidence)
+    return {'n': len(samples),
+            'min': min(samples),
+            'median': statistics.median(samples),
+            'mean': statistics.mean(samples),
+            'stddev': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+            'p95': percentile(samples, 95),
+            'p99': percentile(samples, 99),
+            'ci_low': lo,
+            'ci_high': hi,
+            'confidence': args.confidence}
+
+
+def write_summaries(f, args, benches, samples, tstr, runtime):
+    rows = []
+    by_category = collections.OrderedDict()
+    for bench in benches:
+        xs = samples[bench.name]
+        by_category.setdefault(bench.category, []).extend(xs)
+        row = {'type': 'summary', 'group': 'bench', 'bench': bench.name, 'category': bench.category}
+        row.update(summarize(xs, args))
+        rows.append(row)
+    for category, xs in by_category.items():
+        row = {'type': 'summary', 'group': 'category', 'category': category}
+        row.update(summarize(xs, args))
+        rows.append(row)
+    template = '%-9s %-20s %4s %9s %9s %9s %9s %9s %9s %21s'
+    print('runtime: %s' % runtime)
+    print(template % ('GROUP', 'NAME', 'N', 'MIN', 'MEDIAN', 'MEAN', 'STDDEV', 'P95', 'P99', 'CI'))
+    for row in rows:
+        row.update({'op': args.op, 'clean_policy': args.clean, 'runtime': runtime, 'start_time': tstr})
+        print(template % (row['group'], row.get('bench', row['category']), row['n'],
+                          '%.3f' % row['min'], '%.3f' % row['median'], '%.3f' % row['mean'],
+                          '%.3f' % row['stddev'], '%.3f' % row['p95'], '%.3f' % row['p99'],
+                          '[%.3f, %.3f]' % (row['ci_low'], row['ci_high'])))
+        write_row(f, row, echo=False)
+
+
+def load_results(path):
+    # plain result rows of a hello3.py output file, keyed by (runtime, op, bench) so the
+    # samples of different runtimes (a --docker matrix) or ops are never pooled
+    samples = collections.OrderedDict()
+    categories = {}
+    with open(path) as f:
+        for l in f:
+            if l.startswith('#') or l.strip() == '':
+                continue
+            row = json.loads(l)
+            if 'type' in row or 'elapsed' not in row:
+                continue
+            key = (row.get('runtime', 'docker'), row.get('op', 'run'), row['bench'])
+            samples.setdefault(key, []).append(row['elapsed'])
+            categories[key] = row.get('category', 'other')
+    return samples, categories
+
+
+def mann_whitney(xs, ys):
+    # two-sided p-value of the Mann-Whitney U test (normal approximation with tie correction)
+    n1, n2 = len(xs), len(ys)
+    n = n1 + n2
+    values = sorted([(v, 0) for v in xs] + [(v, 1) for v in ys])
+    r1 = 0.0
+    ties = 0.0
+    i = 0
+    while i < n:
+        j = i
+        while j + 1 < n and values[j + 1][0] == values[i][0]:
+            j += 1
+        rank = (i + j) / 2.0 + 1
+        r1 += rank * sum(1 for k in range(i, j + 1) if values[k][1] == 0)
+        t = j - i + 1
+        ties += t ** 3 - t
+        i = j + 1
+    u1 = r1 - n1 * (n1 + 1) / 2.0
+    sigma = math.sqrt(n1 * n2 / 12.0 * ((n + 1) - ties / (n * (n - 1)))) if n > 1 else 0.0
+    if sigma == 0:
+        return 1.0
+    z = max(0.0, abs(u1 - n1 * n2 / 2.0) - 0.5) / sigma
+    return math.erfc(z / math.sqrt(2))
+
+
+def bootstrap_ratio_ci(xs, ys, iters=1000, confidence=0.95, rng=random):
+    # CI of median(ys) / median(xs)
+    stats = sorted(statistics.median(rng.choices(ys, k=len(ys))) /
+                   statistics.median(rng.choices(xs, k=len(xs))) for _ in range(iters))
+    alpha = (1.0 - confidence) / 2
+    return (percentile(stats, alpha * 100), percentile(stats, (1.0 - alpha) * 100))
+
+
+def compare_results(args):
+    assert(len(args.input) == 2), '--op compare needs --input <baseline> <candidate>'
+    base, base_cat = load_results(args.input[0])
+    new, new_cat = load_results(args.input[1])
+    rows = []
+    for key in base:
+        if key not in new:
+            continue
+        runtime, op, name = key
+        xs, ys = base[key], new[key]
+        ratio = statistics.median(ys) / statistics.median(xs)
+        p = mann_whitney(xs, ys)
+        lo, hi = bootstrap_ratio_ci(xs, ys, iters=args.bootstrap, confidence=args.confidence)
+        if args.test == 'bootstrap':
+            significant = lo > 1.0 or hi < 1.0
+        else:
+            significant = p < 1.0 - args.confidence
+        bench = BenchRunner.ALL.get(name)
+        rows.append({'bench': name, 'runtime': runtime, 'op': op,
+                     'category': bench.category if bench else base_cat.get(key, new_cat.get(key)),
+                     'n_base': len(xs), 'n_new': len(ys),
+                     'median_base': statistics.median(xs), 'median_new': statistics.median(ys),
+                     'delta': ratio - 1.0, 'p': p, 'ci_low': lo - 1.0, 'ci_high': hi - 1.0,
+                     'regression': significant and ratio - 1.0 > args.threshold,
+                     'improvement': significant and 1.0 - ratio > args.threshold})
+    template = '%-20s %-10s %-6s %-14s %9s %9s %8s %17s %7s  %s'
+    print(template % ('NAME', 'RUNTIME', 'OP', 'CATEGORY', 'BASE', 'NEW', 'DELTA', 'CI', 'P', ''))
+    for r in rows:
+        flag = 'REGRESSION' if r['regression'] else 'improved' if r['improvement'] else ''
+        print(template % (r['bench'], r['runtime'], r['op'], r['category'],
+                          '%.3f' % r['median_base'], '%.3f' % r['median_new'],
+                          '%+.1f%%' % (r['delta'] * 100),
+                          '[%+.1f%%, %+.1f%%]' % (r['ci_low'] * 100, r['ci_high'] * 100),
+                          '%.3f' % r['p'], flag))
+    # per category: geometric mean of the median ratios
+    by_category = collections.OrderedDict()
+    for r in rows:
+        by_category.setdefault(r['category'], []).append(r)
+    print()
+    template = '%-14s %6s %12s %12s %9s'
+    print(template % ('CATEGORY', 'BENCHES', 'REGRESSIONS', 'IMPROVEMENTS', 'GEOMEAN'))
+    for category, rs in by_category.items():
+        geomean = math.exp(statistics.mean([math.log(1.0 + r['delta']) for r in rs])) - 1.0
+        print(template % (category, len(rs), sum(r['regression'] for r in rs),
+                          sum(r['improvement'] for r in rs), '%+.1f%%' % (geomean * 100)))
+    for key in list(base.keys()) + list(new.keys()):
+        if (key in base) != (key in new):
+            print('only in %s: %s' % (args.input[0] if key in base else args.input[1], ' '.join(key)))
+    return rows
+
+
+def index_images(f, runner, args, benches, tstr):
+    for bench in benches:
+        entry = runner.index.describe(bench.repo, ref=runner.image(bench.repo),
+                                      digest=runner.engine.image_digest(runner.image(bench.repo)))
+        print('%-20s %s %10d %3d' % (bench.name, entry['digest'], entry['compressed_size'], entry['layers']))
+    bases = runner.index.lineage()
+    for bench in benches:
+        entry = runner.index.lookup(bench.repo)
+        row = {'type': 'image', 'bench': bench.name, 'category': bench.category, 'start_time': tstr,
+               'base': bases.get(entry['digest'])}
+        row.update(dict((k, v) for k, v in entry.items() if k != 'diff_ids'))
+        write_row(f, row, echo=False)
+
+
+def report_images(args, benches):
+    # joins result rows with the image index: latency per MB and per layer, and
+    # images whose latency the size does not explain
+    index = ImageIndex(args.image_index)
+    samples = collections.OrderedDict()
+    digests = {}
+    for path in args.input:
+        with open(path) as f:
+            for l in f:
+                if l.startswith('#') or l.strip() == '':
+                    continue
+                row = json.loads(l)
+                if 'type' in row or 'elapsed' not in row:
+                    continue
+                samples.setdefault(row['bench'], []).append(row['elapsed'])
+                if 'image' in row:
+                    digests[row['bench']] = row['image']['digest']
+    bases = index.lineage()
+    rows = []
+    names = set(b.name for b in benches)
+    for name, xs in samples.items():
+        bench = BenchRunner.ALL.get(name)
+        entry = index.lookup(bench.repo if bench else name, digests.get(name))
+        if name not in names or entry is None:
+            continue
+        mb = entry['compressed_size'] / 1e6
+        median = statistics.median(xs)
+        rows.append({'bench': name, 'n': len(xs), 'median': median, 'mb': mb, 'layers': entry['layers'],
+                     'per_mb': median / mb if mb > 0 else None,
+                     'per_layer': median / entry['layers'] if entry['layers'] > 0 else None,
+                     'base': bases.get(entry['digest'])})
+    # least squares fit of latency on size; robust z-scores (median/MAD) of the residuals
+    if len(rows) >= 3:
+        mx = statistics.mean(r['mb'] for r in rows)
+        my = statistics.mean(r['median'] for r in rows)
+        sxx = sum((r['mb'] - mx) ** 2 for r in rows)
+        slope = sum((r['mb'] - mx) * (r['median'] - my) for r in rows) / sxx if sxx > 0 else 0.0
+        res = [r['median'] - (my + slope * (r['mb'] - mx)) for r in rows]
+        med = statistics.median(res)
+        mad = statistics.median([abs(x - med) for x in res])
+        for r, x in zip(rows, res):
+            r['z'] = 0.6745 * (x - med) / mad if mad > 0 else 0.0
+            r['outlier'] = r['z'] > args.outlier_z
+    template = '%-20s %4s %9s %9s %6s %10s %10s %8s %-16s %s'
+    print(template % ('NAME', 'N', 'MEDIAN', 'MB', 'LAYERS', 'S/MB', 'MS/LAYER', 'Z', 'BASE', ''))
+    for r in sorted(rows, key=lambda r: -r.get('z', 0.0)):
+        print(template % (r['bench'], r['n'], '%.3f' % r['median'], '%.1f' % r['mb'], r['layers'],
+                          '-' if r['per_mb'] is None else '%.4f' % r['per_mb'],
+                          '-' if r['per_layer'] is None else '%.1f' % (r['per_layer'] * 1000),
+                          '%.2f' % r['z'] if 'z' in r else '-', r['base'] or '-',
+                          'OUTLIER' if r.get('outlier') else ''))
+    return rows
+
+
+def write_row(f, row, echo=True):
+    js = json.dumps(row)
+    if echo:
+        print(js)
+    print(js, file=f)
+    f.flush()
+    f.record(row)
+
+
+def write_matrix(f, args, runners, benches, samples, tstr):
+    # side-by-side median latency per bench; ratios are relative to the first runtime
+    names = [os.path.basename(r.docker) for r in runners]
+    template = '%-20s' + ' %12s' * len(names) + ' %12s' * (len(names) - 1)
+    print(template % tuple(['NAME'] + names + ['%s/%s' % (n, names[0]) for n in names[1:]]))
+    for bench in benches:
+        medians = [statistics.median(samples[(r.docker, bench.name)]) for r in runners]
+        print(template % tuple([bench.name] + ['%.3f' % x for x in medians] +
+                               ['%.2f' % (x / medians[0]) if medians[0] > 0 else '-' for x in medians[1:]]))
+        row = {'type': 'matrix', 'bench': bench.name, 'category': bench.category, 'op': args.op,
+               'clean_policy': args.clean, 'order': args.order, 'start_time': tstr,
+               'median': collections.OrderedDict((r.docker, x) for r, x in zip(runners, medians))}
+        write_row(f, row, echo=False)
+
+
+def run_benches(f, runners, args, benches, tstr):
+    jobs = args.jobs if args.op in PARALLEL_OPS else 1
+    assert(jobs >= 1)
+    assert(jobs == 1 or args.clean != 'each'), '--clean each cannot be combined with --jobs'
+    if args.op == 'burst':
+        for runner in runners:
+            run_bursts(f, runner, args, benches, tstr)
+        return
+    if args.op == 'analyze':
+        analyze_traces(f, runners[0], args, benches, tstr)
+        return
+    if args.op == 'index':
+        index_images(f, runners[0], args, benches, tstr)
+        return
+    if args.op == 'calibrate':
+        calibrate(f, runners[0], args, benches, tstr)
+        return
+    if args.op == 'churn':
+        for runner in runners:
+            for bench in benches:
+                run_churn(f, runner, args, bench, tstr)
+        return
+    for trial in range(args.warmup):
+        run_trial(None, args, matrix(runners, benches, args.order, trial), tstr, jobs, trial=-1)
+    wall_start = time.time()
+    samples = collections.OrderedDict(((r.docker, b.name), []) for r in runners for b in benches)
+    cleanup = 0.0
+    trial = 0
+    pending = matrix(runners, benches, args.order, trial)
+    while len(pending) > 0:
+        for row in run_trial(f, args, pending, tstr, jobs, trial):
+            samples[(row['runtime'], row['bench'])].append(row['elapsed'])
+            cleanup += row.get('cleanup', {}).get('elapsed', 0.0)
+        trial += 1
+        cells = matrix(runners, benches, args.order, trial)
+        if trial < args.repeat:
+            pending = cells
+        elif args.ci_width is None or trial >= args.max_repeat:
+            pending = []
+        else:
+            pending = [(r, b) for r, b in cells if ci_relative_width(samples[(r.docker, b.name)], args) > args.ci_width]
+    wall = time.time() - wall_start
+    row = {'type': 'total', 'op': args.op, 'jobs': jobs, 'benches': len(benches), 'trials': trial,
+           'elapsed': wall, 'cleanup': cleanup, 'runtime': args.docker, 'start_time': tstr}
+    write_row(f, row)
+    if trial > 1:
+        for r in runners:
+            xs = dict((b.name, samples[(r.docker, b.name)]) for b in benches)
+            write_summaries(f, args, benches, xs, tstr, r.docker)
+    if len(runners) > 1:
+        write_matrix(f, args, runners, benches, samples, tstr)
+
+
+def at_least(lo):
+    return lambda v: isinstance(v, int) and not isinstance(v, bool) and v >= lo
+
+
+def positive(v):
+    return isinstance(v, (int, float)) and not isinstance(v, bool) and v > 0
+
+
+# The options a coordinator may set for a shard, with the values a worker accepts.
+# Anything else (trace files, clean scope, runtimes, ...) is configured on the worker
+# host and cannot be changed by a peer.
+SHARD_ARGS = collections.OrderedDict([
+    ('repeat', at_least(1)), ('warmup', at_least(0)), ('ci_width', lambda v: v is None or positive(v)),
+    ('max_repeat', at_least(1)), ('confidence', lambda v: positive(v) and v < 1), ('bootstrap', at_least(1)),
+    ('clean', lambda v: v in ('first', 'each', 'none')),
+    ('order', lambda v: v in ('sequential', 'random', 'balanced')),
+    ('concurrency', lambda v: isinstance(v, str) and re.match(r'^[0-9]+(,[0-9]+)*$', v) is not None),
+    ('jobs', at_least(1)), ('host_stats', lambda v: isinstance(v, bool)),
+    ('rate', positive), ('duration', positive), ('window', positive),
+    ('arrival', lambda v: v in ('poisson', 'uniform')), ('max_inflight', at_least(1))])
+WORKER_OPS = ['run', 'pull', 'push', 'tag', 'move', 'burst', 'churn']
+TOKEN_ENV = 'HELLO_BENCH_TOKEN'
+
+
+def check_shard(msg):
+    # returns why a shard message from a peer is refused, or None
+    if set(msg['args']) - set(SHARD_ARGS) - set(['op']):
+        return 'options not allowed: %s' % ', '.join(sorted(set(msg['args']) - set(SHARD_ARGS) - set(['op'])))
+    if msg['args'].get('op') not in WORKER_OPS:
+        return 'op not allowed: %r' % msg['args'].get('op')
+    for k, v in msg['args'].items():
+        if k != 'op' and not SHARD_ARGS[k](v):
+            return 'bad value of %s: %r' % (k, v)
+    unknown = [b for b in msg['benches'] if not isinstance(b, str) or b not in BenchRunner.ALL]
+    if unknown:
+        return 'unknown benches: %r' % unknown
+    if not isinstance(msg['start_time'], str):
+        return 'bad start_time: %r' % msg['start_time']
+    return None
+
+
+def parse_addr(addr):
+    host, port = addr.rsplit(':', 1)
+    return host, int(port)
+
+
+class WorkerStream:
+    # result file of a worker: rows are sent to the coordinator instead of written to disk
+    def __init__(self, send, shard):
+        self.send = send
+        self.shard = shard
+
+    def write(self, s):
+        pass
+
+    def flush(self):
+        pass
+
+    def record(self, row):
+        self.send({'msg': 'row', 'shard': self.shard, 'row': row})
+
+
+def serve_coordinator(args, runners, conn):
+    # one newline-delimited JSON message per line in both directions
+    lock = threading.Lock()
+    r = conn.makefile('r')
+    w = conn.makefile('w')
+
+    def send(msg):
+        with lock:
+            w.write(json.dumps(msg) + '\n')
+            w.flush()
+
+    token = os.environ.get(TOKEN_ENV)
+    for line in r:
+        msg = json.loads(line)
+        if token is not None:
+            # the first message must carry the shared token
+            if msg.get('msg') != 'hello' or not hmac.compare_digest(str(msg.get('token')), token):
+                send({'msg': 'error', 'shard': msg.get('shard'), 'error': 'authentication failed'})
+                return
+            token = None
+            continue
+        if msg['msg'] == 'hello':
+            continue
+        if msg['msg'] == 'bye':
+            return
+        shard = msg.get('shard')
+        try:
+            refused = check_shard(msg)
+        except (KeyError, TypeError, AttributeError) as e:
+            refused = 'malformed shard: %r' % e
+        if refused is not None:
+            print('refusing shard %s: %s' % (shard, refused))
+            send({'msg': 'error', 'shard': shard, 'error': 'refused: ' + refused})
+            continue
+        a = argparse.Namespace(**vars(args))
+        vars(a).update(msg['args'])
+        benches = [BenchRunner.ALL[b] for b in msg['benches']]
+        done = threading.Event()
+
+        def heartbeat():
+            # lets the coordinator tell a long bench from a dead worker
+            while not done.wait(args.heartbeat):
+                send({'msg': 'alive', 'shard': shard})
+
+        hb = threading.Thread(target=heartbeat, daemon=True)
+        hb.start()
+        try:
+            run_benches(WorkerStream(send, shard), runners, a, benches, msg['start_time'])
+            reply = {'msg': 'done', 'shard': shard}
+        except Exception as e:
+            reply = {'msg': 'error', 'shard': shard, 'error': repr(e)}
+        finally:
+            done.set()
+            hb.join()
+        send(reply)
+
+
+def serve_worker(args, runners):
+    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    host, port = parse_addr(args.listen)
+    srv.bind((host, port))
+    srv.listen(1)
+    print('worker listening on %s' % args.listen)
+    if TOKEN_ENV not in os.environ and not ipaddress.ip_address(socket.gethostbyname(host)).is_loopback:
+        print('warning: anyone who can reach %s can run benches here; set %s on the workers and the '
+              'coordinator to require a shared token' % (args.listen, TOKEN_ENV))
+    while True:
+        conn, peer = srv.accept()
+        try:
+            serve_coordinator(args, runners, conn)
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            print('coordinator %s:%d: %r' % (peer[0], peer[1], e))
+        finally:
+            conn.close()
+
+
+def coordinate(f, args, benches, tstr):
+    # shards go to whichever worker is free; rows of a shard are only merged once it
+    # completes, so a shard reassigned after a worker failure is never counted twice
+    shards = [benches[i:i + args.shard_size] for i in range(0, len(benches), args.shard_size)]
+    pending = list(enumerate(shards))
+    attempts = collections.Counter()
+    failed = []
+    inflight = [0]
+    cond = threading.Condition()
+    shard_args = dict((k, getattr(args, k)) for k in SHARD_ARGS)
+    shard_args['op'] = args.worker_op
+    samples = collections.OrderedDict()
+
+    def run_shard(r, w, n, shard):
+        w.write(json.dumps({'msg': 'shard', 'shard': n, 'benches': [b.name for b in shard],
+                            'args': shard_args, 'start_time': tstr}) + '\n')
+        w.flush()
+        rows = []
+        while True:
+            line = r.readline()
+            if line == '':
+                raise ConnectionError('connection closed')
+            msg = json.loads(line)
+            if msg['msg'] == 'row':
+                rows.append(msg['row'])
+            elif msg['msg'] == 'done':
+                return rows
+            elif msg['msg'] == 'error':
+                raise RuntimeError(msg['error'])
+
+    def merge(addr, n, rows):
+        for row in rows:
+            # per-shard totals and summaries are replaced by the merged ones below
+            if row.get('type') in ('total', 'summary', 'matrix'):
+                continue
+            row.update({'worker': addr, 'shard': n})
+            write_row(f, row)
+            if 'type' not in row:
+                samples.setdefault(row['runtime'], collections.OrderedDict()).setdefault(
+                    row['bench'], []).append(row['elapsed'])
+
+    def requeue(addr, n, shard, e):
+        print('worker %s: shard %d failed: %s' % (addr, n, e))
+        attempts[n] += 1
+        if attempts[n] <= args.shard_retries:
+            pending.append((n, shard))
+        else:
+            failed.append(n)
+
+    def worker(addr):
+        try:
+            conn = socket.create_connection(parse_addr(addr), timeout=args.worker_timeout)
+        except OSError as e:
+            print('worker %s: %s' % (addr, e))
+            return
+        r = conn.makefile('r')
+        w = conn.makefile('w')
+        try:
+            if TOKEN_ENV in os.environ:
+                w.write(json.dumps({'msg': 'hello', 'token': os.environ[TOKEN_ENV]}) + '\n')
+                w.flush()
+            while True:
+                with cond:
+                    while len(pending) == 0 and inflight[0] > 0:
+                        cond.wait()
+                    if len(pending) == 0:
+                        w.write(json.dumps({'msg': 'bye'}) + '\n')
+                        w.flush()
+                        return
+                    n, shard = pending.pop(0)
+                    inflight[0] += 1
+                try:
+                    rows = run_shard(r, w, n, shard)
+                except RuntimeError as e:
+                    # the bench failed, the worker is still fine
+                    with cond:
+                        inflight[0] -= 1
+                        requeue(addr, n, shard, e)
+                        cond.notify_all()
+                    continue
+                except (OSError, ValueError) as e:
+                    # dead, hung or garbled: the worker gets no more shards
+                    with cond:
+                        inflight[0] -= 1
+                        requeue(addr, n, shard, e)
+                        cond.notify_all()
+                    return
+                with cond:
+                    merge(addr, n, rows)
+                    inflight[0] -= 1
+                    cond.notify_all()
+        except OSError as e:
+            print('worker %s: %s' % (addr, e))
+        finally:
+            conn.close()
+
+    wall_start = time.time()
+    threads = [threading.Thread(target=worker, args=(addr,)) for addr in args.workers.split(',')]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    failed += [n for n, _ in pending]
+    wall = time.time() - wall_start
+    row = {'type': 'total', 'op': args.worker_op, 'workers': len(threads), 'benches': len(benches),
+           'shards': len(shards), 'failed_shards': sorted(failed), 'elapsed': wall, 'start_time': tstr}
+    write_row(f, row)
+    a = argparse.Namespace(**vars(args))
+    a.op = args.worker_op
+    for runtime, xs in samples.items():
+        if max(len(x) for x in xs.values()) > 1:
+            write_summaries(f, a, [b for b in benches if b.name in xs], xs, tstr, runtime)
+    return len(failed) == 0
+
+
 def main():
     args = parser.parse_args()
     t = datetime.datetime.utcnow() + datetime.timedelta(hours=9)
     tstr = t.strftime("%Y-%m-%d-%H-%M-%S")
     assert((args.trace_file is None and args.trace_dir is None) or
-           (args.trace_file is not None and args.trace_dir is not None))
+           (args.trace_file is not None and args.trace_dir is not None) or
+           (args.op == 'analyze' and args.trace_dir is not None))
 
     if args.list:
         list_bench()
@@ -563,9 +4145,6 @@ def main():
         list_bench(as_json=True)
         exit(0)
 
-    if args.clean != 'none':
-        clean_images(docker=args.docker, verbose=args.verbose)
-
     benches = []
     for bench in args.benchmarks.split(','):
         if bench == 'all':
@@ -574,18 +4153,106 @@ def main():
         else:
             benches.append(BenchRunner.ALL[bench])
 
-    kvargs = {}
-    if args.docker:
-        kvargs['docker'] = args.docker
+    if args.op in ('ingest', 'query') and args.db is None:
+        parser.error('--op %s needs --db' % args.op)
+
+    if args.op == 'ingest':
+        store = ResultStore(args.db)
+        for path in args.input:
+            print('%s: %d rows' % (path, store.ingest(path)))
+        store.close()
+        exit(0)
+
+    if args.op == 'query':
+        query_store(args, benches)
+        exit(0)
+
+    if args.op == 'compare':
+        rows = compare_results(args)
+        # a non-zero status lets rollout scripts stop on regressions
+        exit(1 if any(r['regression'] for r in rows) else 0)
+
+    if args.op == 'report':
+        report_images(args, benches)
+        exit(0)
+
+    if args.op == 'export-snapshot':
+        st = OCISnapshot(args.snapshot, jobs=args.snapshot_jobs).export(args.registry, [b.repo for b in benches],
+                                                                         verbose=args.verbose)
+        print('%s: %d images, %d blobs (%d fetched, %d bytes)' %
+              (args.snapshot, st['images'], st['blobs'], st['fetched'], st['bytes']))
+        exit(0)
+
+    if args.op == 'import-snapshot':
+        st = OCISnapshot(args.snapshot).import_into(args.registry_storage, verbose=args.verbose)
+        print('%s: %d images, %d blobs (%d bytes), %d already present' %
+              (args.registry_storage, st['images'], st['blobs'], st['bytes'], st['skipped']))
+        exit(0)
+
+    outpath = args.out
+    if args.add_time_postfix:
+        outpath += '.{}'.format(tstr)
+
+    if args.op == 'coordinate':
+        assert(args.workers is not None), '--op coordinate needs --workers'
+        store = ResultStore(args.db) if args.db else None
+        try:
+            with open(outpath, 'w') as f:
+                f = ResultFile(f, store)
+                print("#", ' '.join(sys.argv), file=f)
+                ok = coordinate(f, args, benches, tstr)
+        finally:
+            if store is not None:
+                store.close()
+        exit(0 if ok else 1)
 
+    dockers = args.docker.split(',')
+    assert(len(set(dockers)) == len(dockers)), 'runtimes must be unique'
+    socks = args.docker_sock.split(',')
+    assert(len(socks) in (1, len(dockers))), 'give one --docker-sock per runtime'
+    socks = socks * len(dockers) if len(socks) == 1 else socks
+
+    if args.clean != 'none' and args.clean_scope == 'global':
+        for docker in dockers:
+            clean_images(docker=docker, verbose=args.verbose)
+
+    kvargs = {}
     kvargs['registry'] = args.registry
+    kvargs['ready_probe'] = args.ready_probe
+    kvargs['backend'] = args.backend
+    kvargs['move_engine'] = args.move_engine
+    kvargs['move_jobs'] = args.move_jobs
+    kvargs['mount_mode'] = args.mount_mode
+    kvargs['probe_container_ip'] = args.probe_container_ip
+    kvargs['run_id'] = args.run_id or '%s-%d' % (tstr, os.getpid())
+    kvargs['clean_jobs'] = args.clean_jobs
+    kvargs['sample_interval'] = args.sample_interval
+    if args.op == 'calibrate':
+        args.backend = kvargs['backend'] = 'fake-cli'
+    if args.backend in ('fake', 'fake-cli') and args.probe_container_ip:
+        parser.error('fake containers have no network; their ports are published on the host, '
+                     'so --probe-container-ip does not work with --backend %s' % args.backend)
+    if args.backend == 'fake-cli' and args.fake_dist != 'const':
+        parser.error('the fake runtime binary of --backend fake-cli and --op calibrate has constant latencies only')
+    if args.backend in ('fake', 'fake-cli'):
+        kvargs['backend_opts'] = {'latency': dict((k, float(v)) for k, v in
+                                                  (kv.split('=') for kv in args.fake_latency.split(',') if kv)),
+                                  'dist': args.fake_dist}
+    if args.calibration is not None and args.op != 'calibrate':
+        with open(args.calibration) as f:
+            calibration = json.load(f)
+        # the overhead of one backend's code path says nothing about another's
+        if calibration.get('backend') != args.backend:
+            parser.error('%s calibrates the %s backend, not --backend %s' %
+                         (args.calibration, calibration.get('backend') or 'in-process fake', args.backend))
+        kvargs['calibration'] = calibration
+    kvargs['probe_opts'] = {'timeout': args.probe_timeout,
+                            'backoff': args.probe_backoff,
+                            'max_backoff': args.probe_max_backoff}
 
     if args.registry2:
         kvargs['registry2'] = args.registry2
     print(kvargs)
-    outpath = args.out
-    if args.add_time_postfix:
-        outpath += '.{}'.format(tstr)
     if args.verbose:
         print('docker:   ', args.docker)
         print('op:       ', args.op)
@@ -594,26 +4261,44 @@ def main():
         print('registry: ', args.registry)
         print('registry2:', args.registry2)
     # run benchmarks
-    runner = BenchRunner(**kvargs)
-    with open(outpath, 'w') as f:
-        print("#", ' '.join(sys.argv), file=f)
-        for bench in benches:
-            if args.clean == 'each':
-                clean_images(docker=args.docker, verbose=args.verbose)
-            if args.verbose:
-                print("start {}".format(bench.repo))
-            start = time.time()
-            runner.operation(args.op, bench, verbose=args.verbose)
-            elapsed = time.time() - start
-            row = {'repo': bench.repo, 'category': bench.category, 'clean_policy': args.clean, 'bench': bench.name, 'op': args.op, 'elapsed': elapsed, 'runtime': args.docker, 'start_time': tstr}
-            js = json.dumps(row)
-            if args.trace_file is not None:
-                src = args.trace_file
-                dst = os.path.join(args.trace_dir, bench.repo + ".trace")
-                shutil.copy2(src, dst)
-                row['trace'] = dst
-            print(js)
-            print(js, file=f)
+    ports = PortAllocator()
+    monitor = Monitor(progress=args.progress)
+    if args.metrics_port is not None:
+        monitor.serve(args.metrics_port)
+    runners = [BenchRunner(docker=docker, docker_sock=sock, ports=ports, monitor=monitor, **kvargs)
+               for docker, sock in zip(dockers, socks)]
+    cache = None
+    if args.cache:
+        upstream = args.cache_upstream or upstream_url(args.registry)
+        cache = RegistryCache(runners[0].engine, upstream, port=args.cache_port or ports.allocate(),
+                              storage=args.cache_dir)
+        cache.start(verbose=args.verbose)
+        for runner in runners:
+            runner.use_cache(cache)
+    if args.index_images or args.op == 'index':
+        for runner in runners:
+            runner.index = ImageIndex(args.image_index, args.registry, runner.engine)
+    if args.clean != 'none' and args.clean_scope == 'targeted':
+        # leftovers of an earlier run with the same --run-id and the images of the selected
+        # benches; containers of other runs, which may be going on right now, stay
+        for runner in runners:
+            cleanup = runner.cleaner.clean(refs=runner.refs(benches), verbose=args.verbose)
+            print('clean %s: %d containers, %d images in %.3fs' %
+                  (runner.docker, cleanup['containers'], cleanup['images'], cleanup['elapsed']))
+    store = ResultStore(args.db) if args.db else None
+    try:
+        if args.op == 'worker':
+            serve_worker(args, runners)
+        else:
+            with open(outpath, 'w') as f:
+                f = ResultFile(f, store)
+                print("#", ' '.join(sys.argv), file=f)
+                run_benches(f, runners, args, benches, tstr)
+    finally:
+        if store is not None:
+            store.close()
+        if cache is not None:
+            cache.stop(verbose=args.verbose)
 
 
 if __name__ == '__main__':
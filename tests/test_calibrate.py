@@ -0,0 +1,128 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import hello3  # noqa: E402
+
+HELLO = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'hello3.py')
+
+
+class FakeCliTest(unittest.TestCase):
+    # the DockerCli code path against the fake runtime binary
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cli = hello3.FakeCli({'pull': 0.01, 'create': 0.01, 'ready': 0.2, 'remove': 0.01}, root=self.dir)
+
+    def tearDown(self):
+        for cid in self.cli.containers([]):
+            self.cli.remove(cid, force=True, verbose=False)
+        shutil.rmtree(self.dir)
+
+    def test_containers(self):
+        events = []
+        self.assertFalse(self.cli.image_exists('localhost:5000/redis'))
+        self.assertEqual(self.cli.pull('localhost:5000/redis', verbose=False,
+                                       progress=lambda t, layer, status: events.append(status)), 0)
+        self.assertEqual(events, ['Pulling fs layer', 'Download complete', 'Pull complete'])
+        self.assertTrue(self.cli.image_exists('localhost:5000/redis'))
+        cid = self.cli.create('localhost:5000/redis', 'redis_bench_1', labels={'hello-bench.run': 'r1'},
+                              verbose=False)
+        self.assertEqual(self.cli.containers(['hello-bench.run=r1']), [cid])
+        self.assertEqual(self.cli.containers(['hello-bench.run=r2']), [])
+        self.cli.start(cid, verbose=False)
+        self.assertEqual(self.cli.logs(cid), '')
+        self.assertEqual(self.cli.wait(cid), 0)
+        self.assertEqual(self.cli.logs(cid), 'hello\nReady to accept connections\n')
+        self.cli.remove(cid, force=True, verbose=False)
+        self.assertEqual(self.cli.containers([]), [])
+        self.assertEqual(dict(self.cli.injected()), {'pull': 0.01, 'create': 0.01, 'ready': 0.2, 'remove': 0.01})
+        self.cli.reset_injected()
+        self.assertEqual(self.cli.injected(), {})
+
+    def test_published_port_listens_once_ready(self):
+        self.cli.pull('nginx', verbose=False)
+        port = hello3.PortAllocator().allocate()
+        cid = self.cli.create('nginx', 'nginx_bench_1', ports=[(port, 80)], verbose=False)
+        t = time.monotonic()
+        self.cli.start(cid, verbose=False)
+        probe = hello3.HTTPProbe('127.0.0.1', port, timeout=10)
+        probe.wait()
+        self.assertEqual(probe.status, 200)
+        self.assertGreaterEqual(probe.ready_at - t, 0.2)
+        self.cli.remove(cid, force=True, verbose=False)
+        with self.assertRaises(OSError):
+            urllib.request.urlopen('http://127.0.0.1:%d/' % port, timeout=1)
+
+
+class CalibrateTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_overhead_excludes_injected_latency(self):
+        p = subprocess.run([sys.executable, HELLO, '--op=calibrate', '--repeat=2', '--calibration=cal.json',
+                            '--fake-latency=pull=0.05,create=0.02,start=0.02,ready=0.2,remove=0.3',
+                            'alpine,redis,nginx,php'], cwd=self.dir, stdout=subprocess.PIPE,
+                           stderr=subprocess.STDOUT, timeout=120)
+        self.assertEqual(p.returncode, 0, p.stdout.decode())
+        with open(os.path.join(self.dir, 'bench.out')) as f:
+            rows = [json.loads(l) for l in f if not l.startswith('#') and '"overhead"' in l]
+        self.assertEqual(len(rows), 2 * 2 * 4)
+        for row in rows:
+            self.assertEqual(row['backend'], 'fake-cli')
+            # the removal in the teardown is neither in elapsed nor subtracted
+            self.assertAlmostEqual(row['injected'], 0.05 if row['op'] == 'pull' else 0.24)
+            self.assertGreater(row['overhead'], 0.0)
+            self.assertLess(row['overhead'], 0.2)
+        with open(os.path.join(self.dir, 'cal.json')) as f:
+            cal = json.load(f)
+        self.assertEqual(sorted(cal['overhead']), sorted('%s:%s' % (op, kind) for op in ('run', 'pull')
+                                                         for kind in ('echo_hello', 'cmd_arg_wait', 'http',
+                                                                      'cmd_stdin')))
+        self.assertEqual((cal['backend'], cal['ops']), ('cli', ['run', 'pull']))
+
+    def run_with(self, *opts):
+        p = subprocess.run([sys.executable, HELLO, '--calibration=cal.json', '--out=run.out'] + list(opts) +
+                           ['alpine'], cwd=self.dir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=60)
+        return p.returncode, p.stdout
+
+    def test_overhead_applies_to_the_cli_backend_only(self):
+        with open(os.path.join(self.dir, 'cal.json'), 'w') as f:
+            json.dump({'backend': 'cli', 'ops': ['run'], 'overhead': {'run:echo_hello': {'median': 0.01}}}, f)
+        for backend in ('fake', 'fake-cli', 'engine'):
+            rc, out = self.run_with('--backend=' + backend)
+            self.assertEqual(rc, 2)
+            self.assertIn(b'calibrates the cli backend, not --backend ' + backend.encode(), out)
+        # the cli backend, here driving the fake runtime binary
+        cli = hello3.FakeCli(root=os.path.join(self.dir, 'runtime'))
+        rc, out = self.run_with('--backend=cli', '--docker=' + cli.docker)
+        self.assertEqual(rc, 0, out.decode())
+        with open(os.path.join(self.dir, 'run.out')) as f:
+            row = [json.loads(l) for l in f if l.startswith('{"repo"')][0]
+        self.assertAlmostEqual(row['elapsed_corrected'], row['elapsed'] - 0.01)
+
+    def test_fake_backends_have_no_container_ips(self):
+        for backend in ('fake', 'fake-cli'):
+            p = subprocess.run([sys.executable, HELLO, '--backend=' + backend, '--probe-container-ip', 'nginx'],
+                               cwd=self.dir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=60)
+            self.assertEqual(p.returncode, 2)
+            self.assertIn(b'--probe-container-ip does not work with --backend ' + backend.encode(), p.stdout)
+
+    def test_calibrate_needs_constant_latencies(self):
+        p = subprocess.run([sys.executable, HELLO, '--op=calibrate', '--fake-dist=exp', 'alpine'], cwd=self.dir,
+                           stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=60)
+        self.assertEqual(p.returncode, 2)
+        self.assertIn(b'constant latencies', p.stdout)
+
+
+if __name__ == '__main__':
+    unittest.main()
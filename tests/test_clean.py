@@ -0,0 +1,54 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import hello3  # noqa: E402
+
+
+class LabelledEngine:
+    # containers with labels, filtered like `docker ps --filter label=k=v`
+    def __init__(self):
+        self.ctrs = {'a': {'hello-bench.run': 'r1'}, 'b': {'hello-bench.run': 'r2'}, 'c': {}}
+        self.imgs = set(['sha256:base'])
+        self.removed_images = []
+
+    def containers(self, filters):
+        def match(labels, f):
+            k, _, v = f.partition('=')
+            return k in labels and (v == '' or labels[k] == v)
+        return [cid for cid, labels in self.ctrs.items() if all(match(labels, f) for f in filters)]
+
+    def remove(self, cid, force=False, verbose=True):
+        del self.ctrs[cid]
+
+    def images(self):
+        return set(self.imgs)
+
+    def remove_image(self, ref, verbose=True):
+        self.removed_images.append(ref)
+        self.imgs.discard(ref)
+        return 0
+
+
+class CleanerTest(unittest.TestCase):
+    def test_only_this_runs_containers(self):
+        engine = LabelledEngine()
+        st = hello3.Cleaner(engine, 'r1').clean(refs=['localhost:5000/redis'])
+        self.assertEqual(sorted(engine.ctrs), ['b', 'c'])
+        self.assertEqual((st['containers'], st['images']), (1, 1))
+
+    def test_images_since_snapshot(self):
+        engine = LabelledEngine()
+        cleaner = hello3.Cleaner(engine, 'r3')
+        since = cleaner.snapshot()
+        engine.imgs.add('sha256:new')
+        st = cleaner.clean(since=since)
+        self.assertEqual(engine.removed_images, ['sha256:new'])
+        self.assertEqual(sorted(engine.ctrs), ['a', 'b', 'c'])
+        self.assertEqual(st['containers'], 0)
+        self.assertEqual(cleaner.labels('redis'), {'hello-bench.run': 'r3', 'hello-bench.bench': 'redis'})
+
+
+if __name__ == '__main__':
+    unittest.main()
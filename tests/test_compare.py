@@ -0,0 +1,82 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import hello3  # noqa: E402
+
+
+class MannWhitneyTest(unittest.TestCase):
+    def test_separated_samples(self):
+        # no overlap: U = 0, z = (12.5 - 0.5) / sqrt(22.9) with the continuity correction
+        p = hello3.mann_whitney([1, 2, 3, 4, 5], [6, 7, 8, 9, 10])
+        self.assertAlmostEqual(p, 0.0119, places=3)
+        self.assertEqual(p, hello3.mann_whitney([6, 7, 8, 9, 10], [1, 2, 3, 4, 5]))
+
+    def test_same_distribution(self):
+        rng = random.Random(3)
+        xs = [rng.gauss(1.0, 0.1) for _ in range(50)]
+        ys = [rng.gauss(1.0, 0.1) for _ in range(50)]
+        self.assertGreater(hello3.mann_whitney(xs, ys), 0.05)
+        self.assertLess(hello3.mann_whitney(xs, [y + 0.1 for y in ys]), 0.001)
+
+    def test_ties(self):
+        self.assertEqual(hello3.mann_whitney([1, 1, 1], [1, 1, 1]), 1.0)
+        self.assertLess(hello3.mann_whitney([1, 1, 1, 1, 2], [2, 3, 3, 3, 3]), 0.05)
+
+    def test_bootstrap_ratio_ci(self):
+        lo, hi = hello3.bootstrap_ratio_ci([1.0, 1.1, 0.9, 1.0] * 5, [2.0, 2.2, 1.8, 2.0] * 5,
+                                           iters=200, rng=random.Random(1))
+        self.assertLessEqual(lo, 2.0)
+        self.assertGreaterEqual(hi, 2.0)
+        self.assertGreater(lo, 1.5)
+        self.assertLess(hi, 2.5)
+
+
+class CompareTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, rows):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as f:
+            for r in rows:
+                f.write(json.dumps(r) + '\n')
+        return path
+
+    def rows(self, runtime, op, elapsed):
+        return [{'bench': 'redis', 'category': 'database', 'runtime': runtime, 'op': op, 'elapsed': e,
+                 'trial': i} for i, e in enumerate(elapsed)]
+
+    def test_runtimes_and_ops_are_not_pooled(self):
+        fast, slow = [1.0, 1.01, 0.99, 1.02, 0.98] * 4, [2.0, 2.02, 1.98, 2.01, 1.99] * 4
+        # the baseline is a matrix run of two runtimes; only podman regressed
+        base = self.write('base', self.rows('docker', 'run', fast) + self.rows('podman', 'run', fast) +
+                          self.rows('docker', 'pull', slow) + [{'type': 'total', 'op': 'run', 'elapsed': 99.0}])
+        new = self.write('new', self.rows('docker', 'run', fast) + self.rows('podman', 'run', slow) +
+                         self.rows('docker', 'pull', slow))
+        samples, _ = hello3.load_results(base)
+        self.assertEqual(list(samples), [('docker', 'run', 'redis'), ('podman', 'run', 'redis'),
+                                         ('docker', 'pull', 'redis')])
+        args = argparse.Namespace(input=[base, new], bootstrap=200, confidence=0.95, test='mwu', threshold=0.05)
+        with contextlib.redirect_stdout(io.StringIO()):
+            rows = hello3.compare_results(args)
+        flags = dict(((r['runtime'], r['op']), r['regression']) for r in rows)
+        self.assertEqual(flags, {('docker', 'run'): False, ('podman', 'run'): True, ('docker', 'pull'): False})
+        podman = [r for r in rows if r['runtime'] == 'podman'][0]
+        self.assertAlmostEqual(podman['delta'], 1.0, places=2)
+        self.assertEqual((podman['n_base'], podman['n_new']), (20, 20))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import hello3  # noqa: E402
+
+HELLO = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'hello3.py')
+BENCHES = ['alpine', 'busybox', 'redis', 'nginx', 'php', 'perl']
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class DistributedTest(unittest.TestCase):
+    # workers are separate processes driving the fake runtime
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.workers = []
+        self.env = dict(os.environ)
+        self.env.pop(hello3.TOKEN_ENV, None)
+
+    def tearDown(self):
+        for p in self.workers:
+            p.kill()
+            p.wait()
+        shutil.rmtree(self.dir)
+
+    def worker(self, ready=0.02, env=None):
+        port = free_port()
+        d = tempfile.mkdtemp(dir=self.dir)
+        p = subprocess.Popen([sys.executable, HELLO, '--op=worker', '--listen=127.0.0.1:%d' % port,
+                              '--backend=fake', '--fake-latency=create=0.005,start=0.005,ready=%s' % ready],
+                             cwd=d, env=env or self.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.workers.append(p)
+        deadline = time.monotonic() + 20
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                self.assertLess(time.monotonic(), deadline, 'worker did not come up')
+                time.sleep(0.05)
+        return p, '127.0.0.1:%d' % port
+
+    def coordinate(self, workers, *opts, env=None):
+        out = os.path.join(self.dir, 'bench.out')
+        p = subprocess.run([sys.executable, HELLO, '--op=coordinate', '--workers=' + ','.join(workers),
+                            '--out=' + out, '--worker-timeout=10', '--heartbeat=0.5'] + list(opts) +
+                           [','.join(BENCHES)], cwd=self.dir, env=env or self.env,
+                           stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=120)
+        with open(out) as f:
+            rows = [json.loads(l) for l in f if not l.startswith('#')]
+        return p.returncode, rows
+
+    def test_shards_spread_over_workers(self):
+        addrs = [self.worker()[1] for _ in range(3)]
+        rc, rows = self.coordinate(addrs, '--repeat=2')
+        self.assertEqual(rc, 0)
+        runs = [r for r in rows if 'type' not in r]
+        self.assertEqual(sorted((r['bench'], r['trial']) for r in runs),
+                         sorted((b, t) for b in BENCHES for t in range(2)))
+        self.assertGreater(len(set(r['worker'] for r in runs)), 1)
+        total = [r for r in rows if r.get('type') == 'total'][0]
+        self.assertEqual((total['workers'], total['shards'], total['failed_shards']), (3, 6, []))
+        # summaries are computed over the merged rows
+        summaries = [r for r in rows if r.get('type') == 'summary' and r['group'] == 'bench']
+        self.assertEqual(sorted((r['bench'], r['n']) for r in summaries), sorted((b, 2) for b in BENCHES))
+
+    def test_dead_worker_shard_is_reassigned(self):
+        slow, slow_addr = self.worker(ready=30)
+        addrs = [slow_addr, self.worker()[1], self.worker()[1]]
+        killer = subprocess.Popen(['sh', '-c', 'sleep 2; kill -9 %d' % slow.pid])
+        try:
+            rc, rows = self.coordinate(addrs)
+        finally:
+            killer.wait()
+        self.assertEqual(rc, 0)
+        runs = [r for r in rows if 'type' not in r]
+        # every bench exactly once, none from the killed worker
+        self.assertEqual(sorted(r['bench'] for r in runs), sorted(BENCHES))
+        self.assertNotIn(slow_addr, [r['worker'] for r in runs])
+
+    def test_shared_token(self):
+        env = dict(self.env, **{hello3.TOKEN_ENV: 'secret'})
+        _, addr = self.worker(env=env)
+        rc, rows = self.coordinate([addr], env=dict(self.env, **{hello3.TOKEN_ENV: 'wrong'}))
+        self.assertEqual(rc, 1)
+        self.assertEqual([r for r in rows if 'type' not in r], [])
+        rc, rows = self.coordinate([addr], env=env)
+        self.assertEqual(rc, 0)
+        self.assertEqual(len([r for r in rows if 'type' not in r]), len(BENCHES))
+
+    def test_worker_refuses_options_outside_the_whitelist(self):
+        _, addr = self.worker()
+        conn = socket.create_connection(hello3.parse_addr(addr), timeout=10)
+        r, w = conn.makefile('r'), conn.makefile('w')
+
+        def shard(n, args, benches=['alpine']):
+            w.write(json.dumps({'msg': 'shard', 'shard': n, 'benches': benches, 'args': args,
+                                'start_time': 't'}) + '\n')
+            w.flush()
+            return json.loads(r.readline())
+
+        for n, (args, benches) in enumerate([({'op': 'run', 'trace_file': '/etc/passwd', 'trace_dir': '/tmp'},
+                                              ['alpine']),
+                                             ({'op': 'run', 'clean': 'each', 'clean_scope': 'global'}, ['alpine']),
+                                             ({'op': 'ingest'}, ['alpine']),
+                                             ({'op': 'run', 'clean': 'everything'}, ['alpine']),
+                                             ({'op': 'run', 'repeat': '1; rm -rf /'}, ['alpine']),
+                                             ({'op': 'run'}, ['../../etc'])]):
+            reply = shard(n, args, benches)
+            self.assertEqual((reply['msg'], reply['shard']), ('error', n))
+            self.assertTrue(reply['error'].startswith('refused: '), reply)
+        # the connection is still usable for a valid shard
+        reply = shard(9, {'op': 'run', 'repeat': 1, 'clean': 'none'})
+        while reply['msg'] in ('row', 'alive'):
+            reply = json.loads(r.readline())
+        self.assertEqual(reply, {'msg': 'done', 'shard': 9})
+        w.write(json.dumps({'msg': 'bye'}) + '\n')
+        w.flush()
+        conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+import http.server
+import json
+import os
+import shutil
+import socketserver
+import struct
+import sys
+import tempfile
+import threading
+import unittest
+import urllib.parse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import hello3  # noqa: E402
+
+
+def frame(stream, data):
+    return struct.pack('>BxxxI', stream, len(data)) + data
+
+
+class FakeDaemon(http.server.BaseHTTPRequestHandler):
+    # the handful of Engine API endpoints the DockerEngine backend talks to
+    protocol_version = 'HTTP/1.1'
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, body=None):
+        data = b'' if body is None else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_chunked(self, chunks):
+        self.send_response(200)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for c in chunks:
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(c), c))
+        self.wfile.write(b'0\r\n\r\n')
+
+    def handle_any(self):
+        u = urllib.parse.urlparse(self.path)
+        q = dict(urllib.parse.parse_qsl(u.query))
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        FakeDaemon.requests.append((self.command, u.path, q, body))
+        if u.path == '/images/create':
+            events = [{'status': 'Pulling from library/redis', 'id': 'latest'},
+                      {'status': 'Pulling fs layer', 'id': 'aaa'},
+                      {'status': 'Downloading', 'id': 'aaa', 'progressDetail': {'current': 10, 'total': 20}},
+                      {'status': 'Pull complete', 'id': 'aaa'}]
+            data = b''.join(json.dumps(e).encode() + b'\r\n' for e in events)
+            # chunk boundaries fall in the middle of the json lines
+            self.send_chunked([data[i:i + 7] for i in range(0, len(data), 7)])
+        elif u.path == '/images/redis/json':
+            self.send_json(200, {'Id': 'sha256:1', 'Size': 123, 'RepoDigests': ['redis@sha256:abc']})
+        elif u.path.startswith('/images/'):
+            self.send_json(404, {'message': 'no such image'})
+        elif u.path == '/containers/create':
+            self.send_json(201, {'Id': 'c1'})
+        elif u.path == '/containers/c1/start':
+            self.send_json(204)
+        elif u.path == '/containers/c1/wait':
+            self.send_json(200, {'StatusCode': 0})
+        elif u.path == '/containers/c1/logs':
+            data = frame(1, b'out 1\n') + frame(2, b'err 1\n') + frame(1, b'Ready to accept connections\n')
+            # frames split across chunks, including inside the 8 byte headers
+            self.send_chunked([data[i:i + 5] for i in range(0, len(data), 5)])
+        elif u.path == '/containers/c1/attach':
+            self.send_response(101)
+            self.send_header('Connection', 'Upgrade')
+            self.send_header('Upgrade', 'tcp')
+            self.end_headers()
+            self.wfile.flush()
+            stdin = self.rfile.read()  # until the client shuts down its side
+            self.wfile.write(frame(1, stdin.upper()) + frame(2, b'warning\n'))
+            self.close_connection = True
+        elif u.path == '/containers/c1/json':
+            self.send_json(200, {'Id': 'c1', 'State': {'Running': True, 'Pid': 4321}})
+        elif u.path == '/containers/c2/json':
+            self.send_json(200, {'Id': 'c2', 'State': {'Running': False, 'Pid': 0}})
+        elif u.path == '/containers/c1' and self.command == 'DELETE':
+            self.send_json(204)
+        else:
+            self.send_json(404, {'message': 'unexpected %s %s' % (self.command, self.path)})
+
+    do_GET = do_POST = do_DELETE = handle_any
+
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class DockerEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.sock = os.path.join(self.dir, 'docker.sock')
+        self.server = UnixServer(self.sock, FakeDaemon)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        FakeDaemon.requests = []
+        self.engine = hello3.DockerEngine(self.sock)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dir)
+
+    def test_requests_reuse_the_connection(self):
+        self.assertTrue(self.engine.image_exists('redis'))
+        self.assertFalse(self.engine.image_exists('nginx'))
+        self.assertEqual(self.engine.image_digest('redis'), 'sha256:abc')
+        cid = self.engine.create('redis', name='r1', cmd='redis-server --port 1', env={'A': 'b'},
+                                 ports=[(8080, 80)], labels={'hello-bench.run': 'x'}, verbose=False)
+        self.assertEqual(cid, 'c1')
+        _, path, q, body = FakeDaemon.requests[-1]
+        self.assertEqual(q, {'name': 'r1'})
+        body = json.loads(body)
+        self.assertEqual(body['Cmd'], ['redis-server', '--port', '1'])
+        self.assertEqual(body['HostConfig']['PortBindings'], {'80/tcp': [{'HostPort': '8080'}]})
+        self.assertEqual(body['Labels'], {'hello-bench.run': 'x'})
+
+    def test_chunked_pull_progress(self):
+        events = []
+        rc = self.engine.pull('redis', verbose=False, progress=lambda *ev: events.append(ev[1:]))
+        self.assertEqual(rc, 0)
+        self.assertEqual(events, [('latest', 'Pulling from library/redis', None, None),
+                                  ('aaa', 'Pulling fs layer', None, None),
+                                  ('aaa', 'Downloading', 10, 20),
+                                  ('aaa', 'Pull complete', None, None)])
+        self.assertEqual(FakeDaemon.requests[-1][2], {'fromImage': 'redis', 'tag': 'latest'})
+
+    def test_multiplexed_logs(self):
+        self.assertEqual(self.engine.logs('c1'), 'out 1\nerr 1\nReady to accept connections\n')
+        p = self.engine.follow_logs('c1')
+        probe = hello3.LogLineProbe(p.stdout, 'Ready to accept', timeout=5.0)
+        probe.wait()
+        probe.close()
+        p.kill()
+        p.wait()
+        self.assertEqual(probe.stream.nlines, 3)
+
+    def test_attach_hijack(self):
+        rc, out = self.engine.start_attach('c1', stdin=b'echo hello\n', verbose=False)
+        self.assertEqual(rc, 0)
+        self.assertEqual(out, b'ECHO HELLO\nwarning\n')
+        paths = [(m, p) for m, p, _, _ in FakeDaemon.requests]
+        # the attach is established before the container starts
+        self.assertEqual(paths, [('POST', '/containers/c1/attach'), ('POST', '/containers/c1/start'),
+                                 ('POST', '/containers/c1/wait')])
+
+    def test_container_pid(self):
+        self.assertEqual(self.engine.container_pid('c1'), 4321)
+        self.assertIsNone(self.engine.container_pid('c2'))  # not running
+        self.assertIsNone(self.engine.container_pid('c3'))  # gone
+
+    def test_demux_stream(self):
+        data = frame(1, b'a' * 70000) + frame(2, b'') + frame(2, b'b')
+        chunks = [data[i:i + 4096] for i in range(0, len(data), 4096)]
+        pending = []
+
+        def read(n):
+            # returns short reads like a socket
+            if not pending and chunks:
+                pending.append(chunks.pop(0))
+            if not pending:
+                return b''
+            c = pending.pop()
+            if len(c) > n:
+                pending.append(c[n:])
+            return c[:n]
+
+        self.assertEqual(list(hello3.demux_stream(read)), [(1, b'a' * 70000), (2, b''), (2, b'b')])
+
+
+if __name__ == '__main__':
+    unittest.main()
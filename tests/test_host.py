@@ -0,0 +1,125 @@
+import collections
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import hello3  # noqa: E402
+
+
+class HostDeltaTest(unittest.TestCase):
+    def test_delta_and_rates(self):
+        m = hello3.Measurement()
+        m.phases['pull'] = 2.0
+        before = collections.Counter({'net_rx_bytes': 100, 'disk_write_bytes': 0, 'data_root_bytes': 10})
+        after = collections.Counter({'net_rx_bytes': 1100, 'disk_write_bytes': 3000, 'data_root_bytes': 2010})
+        d = hello3.host_delta(before, after, m)
+        self.assertEqual((d['net_rx_bytes'], d['disk_write_bytes'], d['data_root_bytes']), (1000, 3000, 2000))
+        self.assertEqual(d['pull_throughput'], 500.0)
+        self.assertEqual(d['write_amplification'], 3.0)
+
+    def test_host_without_network_or_disks(self):
+        # only lo and no physical disk: the counters are empty
+        m = hello3.Measurement()
+        m.phases['pull'] = 1.0
+        self.assertEqual(hello3.host_delta(collections.Counter(), collections.Counter(), m), {})
+        d = hello3.host_delta(collections.Counter(), collections.Counter({'net_rx_bytes': 10}), m)
+        self.assertEqual(d['write_amplification'], 0.0)
+
+    def test_counters_of_this_host(self):
+        c = hello3.host_counters(data_root='/')
+        self.assertGreater(c['data_root_bytes'], 0)
+        for k, v in c.items():
+            self.assertGreaterEqual(v, 0, k)
+
+
+class CgroupSamplerTest(unittest.TestCase):
+    CID = 'c' * 64
+
+    def setUp(self):
+        # a fake /proc and cgroup v2 tree with a rootful podman container
+        self.dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.dir, 'cgroup')
+        self.proc = os.path.join(self.dir, 'proc')
+        self.cgroup = os.path.join(self.root, 'machine.slice', 'libpod-%s.scope' % self.CID)
+        os.makedirs(self.cgroup)
+        os.makedirs(os.path.join(self.proc, '4321'))
+        with open(os.path.join(self.proc, '4321', 'cgroup'), 'w') as f:
+            f.write('1:name=systemd:/machine.slice/libpod-%s.scope\n' % self.CID)
+            f.write('0::/machine.slice/libpod-%s.scope\n' % self.CID)
+        self.usage(1000, 0)
+        self.calls = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def usage(self, usec, memory, io=None):
+        with open(os.path.join(self.cgroup, 'cpu.stat'), 'w') as f:
+            f.write('usage_usec %d\nuser_usec %d\nsystem_usec %d\nnr_periods 0\n' % (usec, usec * 3 // 4, usec // 4))
+        with open(os.path.join(self.cgroup, 'memory.current'), 'w') as f:
+            f.write('%d\n' % memory)
+        if io is not None:
+            with open(os.path.join(self.cgroup, 'io.stat'), 'w') as f:
+                f.write(io)
+
+    def pid(self):
+        # like the runtime: no pid until the container runs
+        self.calls += 1
+        return 4321 if self.calls > 2 else None
+
+    def sampler(self):
+        return hello3.CgroupSampler(self.CID, 0.005, pid=self.pid, root=self.root, proc=self.proc)
+
+    def wait_samples(self, sampler, n):
+        deadline = time.monotonic() + 5
+        while len(sampler.series['t']) < n:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.005)
+
+    def test_without_io_controller(self):
+        sampler = self.sampler()
+        sampler.start()
+        self.wait_samples(sampler, 2)
+        self.usage(51000, 8 << 20)
+        self.wait_samples(sampler, len(sampler.series['t']) + 2)
+        self.usage(61000, 4 << 20)
+        self.wait_samples(sampler, len(sampler.series['t']) + 2)
+        st = sampler.stop()
+        self.assertGreaterEqual(self.calls, 3)
+        self.assertEqual(st['path'], self.cgroup)
+        self.assertEqual((st['cpu_usec'], st['user_usec'], st['system_usec']), (61000, 45750, 15250))
+        self.assertEqual(st['memory_peak'], 8 << 20)
+        self.assertEqual((st['io_rbytes'], st['io_wios']), (None, None))
+        self.assertGreater(st['cpu_util'], 0)
+        self.assertEqual(set(st['series']['io_rbytes']), set([None]))
+
+    def test_io_stat_of_several_devices(self):
+        self.usage(1000, 1 << 20, io='8:0 rbytes=4096 wbytes=0 rios=1 wios=0 dbytes=0 dios=0\n'
+                                     '253:0 rbytes=8192 wbytes=512 rios=2 wios=1 dbytes=0 dios=0\n')
+        sampler = self.sampler()
+        sampler.start()
+        self.wait_samples(sampler, 1)
+        st = sampler.stop()
+        self.assertEqual((st['io_rbytes'], st['io_wbytes'], st['io_rios'], st['io_wios']), (12288, 512, 3, 1))
+
+    def test_stops_when_the_cgroup_is_removed(self):
+        sampler = self.sampler()
+        sampler.start()
+        self.wait_samples(sampler, 1)
+        shutil.rmtree(self.cgroup)
+        sampler.thread.join(5)
+        self.assertFalse(sampler.thread.is_alive())
+        self.assertGreater(sampler.stop()['samples'], 0)
+
+    def test_container_without_a_pid(self):
+        sampler = hello3.CgroupSampler(self.CID, 0.005, root=self.root, proc=self.proc)
+        sampler.start()
+        time.sleep(0.05)
+        self.assertEqual(sampler.stop(), {'path': None, 'interval': 0.005, 'samples': 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
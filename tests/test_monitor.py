@@ -0,0 +1,111 @@
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import unittest
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import hello3  # noqa: E402
+
+SAMPLE = re.compile(r'^([a-z_]+)(\{.*\})? (\S+)$')
+
+
+def parse(text):
+    # {(name, ((label, value), ...)): value} of the samples
+    samples = {}
+    for l in text.splitlines():
+        if l.startswith('#'):
+            continue
+        name, labels, value = SAMPLE.match(l).groups()
+        labels = tuple(re.findall(r'([a-z_]+)="((?:[^"\\]|\\.)*)"', labels or ''))
+        samples[(name, labels)] = float(value)
+    return samples
+
+
+class MonitorTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.monitor = hello3.Monitor(progress=os.path.join(self.dir, 'progress.jsonl'))
+        self.srv = self.monitor.serve(0)
+        self.url = 'http://127.0.0.1:%d' % self.srv.server_address[1]
+
+    def tearDown(self):
+        self.srv.shutdown()
+        self.srv.server_close()
+        self.monitor.progress.close()
+        shutil.rmtree(self.dir)
+
+    def scrape(self):
+        with urllib.request.urlopen(self.url + '/metrics', timeout=5) as resp:
+            self.assertEqual(resp.headers['Content-Type'], hello3.Monitor.CONTENT_TYPE)
+            return resp.read().decode()
+
+    def run_bench(self, bench, elapsed, phases):
+        with self.monitor.track(bench, 'run', 'docker'):
+            pass
+        self.monitor.observe({'bench': bench.name, 'category': bench.category, 'op': 'run', 'runtime': 'docker',
+                              'elapsed': elapsed, 'phases': phases})
+
+    def test_scrape(self):
+        alpine = hello3.BenchRunner.ALL['alpine']
+        for elapsed in (0.04, 0.3, 0.3, 7.0, 900.0):
+            self.run_bench(alpine, elapsed, {'create': elapsed / 2, 'start': elapsed / 2})
+        with self.assertRaises(RuntimeError):
+            with self.monitor.track(alpine, 'run', 'docker'):
+                raise RuntimeError('start failed')
+        text = self.scrape()
+        self.assertTrue(text.endswith('\n# EOF\n'))
+        self.assertEqual(text.count('# EOF'), 1)
+        samples = parse(text)
+        key = (('bench', 'alpine'), ('category', 'distro'), ('op', 'run'), ('runtime', 'docker'))
+        # counters carry the _total suffix, their family name does not
+        self.assertIn('# TYPE hello_bench_runs counter', text)
+        self.assertEqual(samples[('hello_bench_runs_total', key + (('status', 'ok'),))], 5)
+        self.assertEqual(samples[('hello_bench_runs_total', key + (('status', 'error'),))], 1)
+        self.assertEqual([n for n, _ in samples if n.startswith('hello_bench_runs')],
+                         ['hello_bench_runs_total'] * 2)
+        # buckets are cumulative and +Inf is the count
+        buckets = [(labels[-1][1], v) for (n, labels), v in samples.items()
+                   if n == 'hello_bench_elapsed_seconds_bucket' and labels[:-1] == key]
+        self.assertEqual([le for le, _ in buckets], [str(le) for le in hello3.Monitor.BUCKETS] + ['+Inf'])
+        counts = [v for _, v in buckets]
+        self.assertEqual(counts, sorted(counts))
+        self.assertEqual(dict(buckets)['0.05'], 1)
+        self.assertEqual(dict(buckets)['0.5'], 3)
+        self.assertEqual(dict(buckets)['600.0'], 4)
+        self.assertEqual(dict(buckets)['+Inf'], samples[('hello_bench_elapsed_seconds_count', key)])
+        self.assertEqual(samples[('hello_bench_elapsed_seconds_count', key)], 5)
+        self.assertAlmostEqual(samples[('hello_bench_elapsed_seconds_sum', key)], 907.64)
+        phase = key + (('phase', 'create'), ('le', '+Inf'))
+        self.assertEqual(samples[('hello_bench_phase_seconds_bucket', phase)], 5)
+        # nothing is running any more
+        self.assertEqual(samples[('hello_bench_in_progress', key)], 0)
+        self.assertNotIn('hello_bench_in_progress_started_seconds{', text)
+
+    def test_in_progress_and_label_escaping(self):
+        bench = hello3.Bench('quote"back\\slash', category='odd')
+        with self.monitor.track(bench, 'pull', 'podman'):
+            text = self.scrape()
+        samples = parse(text)
+        key = (('bench', 'quote\\"back\\\\slash'), ('category', 'odd'), ('op', 'pull'), ('runtime', 'podman'))
+        self.assertEqual(samples[('hello_bench_in_progress', key)], 1)
+        self.assertGreater(samples[('hello_bench_in_progress_started_seconds', key)], 0)
+        self.assertTrue(text.endswith('\n# EOF\n'))
+
+    def test_other_paths_and_progress_events(self):
+        with self.assertRaises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(self.url + '/', timeout=5)
+        self.assertEqual(e.exception.code, 404)
+        self.run_bench(hello3.BenchRunner.ALL['redis'], 1.5, {'ready': 1.0})
+        with open(os.path.join(self.dir, 'progress.jsonl')) as f:
+            events = [json.loads(l) for l in f]
+        self.assertEqual([e['event'] for e in events], ['start', 'finish'])
+        self.assertEqual((events[1]['bench'], events[1]['elapsed']), ('redis', 1.5))
+
+
+if __name__ == '__main__':
+    unittest.main()
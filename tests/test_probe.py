@@ -0,0 +1,252 @@
+import os
+import re
+import socket
+import struct
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import hello3  # noqa: E402
+
+
+class Server:
+    # loopback listener; the first `refuse` connections are closed (or reset) at once,
+    # like docker-proxy does while the app in the container is not listening yet; later
+    # ones get the responses in turn, the last one repeated
+    def __init__(self, refuse=0, reset=False, responses=[]):
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(16)
+        self.port = self.sock.getsockname()[1]
+        self.refuse = refuse
+        self.reset = reset
+        self.responses = list(responses)
+        self.accepted = 0
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                c, _ = self.sock.accept()
+            except OSError:
+                return
+            self.accepted += 1
+            if self.accepted <= self.refuse:
+                if self.reset:
+                    c.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+                c.close()
+                continue
+            if len(self.responses) > 0:
+                c.recv(4096)
+                c.sendall(self.responses.pop(0) if len(self.responses) > 1 else self.responses[0])
+            else:
+                c.recv(4096)  # held open until the probe closes it
+            c.close()
+
+    def close(self):
+        self.sock.close()
+
+
+class TCPProbeTest(unittest.TestCase):
+    def test_ready(self):
+        srv = Server()
+        try:
+            t = time.monotonic()
+            probe = hello3.TCPProbe('127.0.0.1', srv.port, timeout=5)
+            self.assertGreaterEqual(probe.wait(), t)
+            self.assertEqual(probe.attempts, 1)
+        finally:
+            srv.close()
+
+    def test_closed_connections_are_not_ready(self):
+        for reset in (False, True):
+            srv = Server(refuse=3, reset=reset)
+            try:
+                probe = hello3.TCPProbe('127.0.0.1', srv.port, timeout=5, settle=0.1)
+                probe.wait()
+                self.assertEqual(probe.attempts, 4)
+            finally:
+                srv.close()
+
+    def test_timeout_and_backoff(self):
+        # bound but not listening: connections are refused and nobody else gets the port
+        s = socket.socket()
+        s.bind(('127.0.0.1', 0))
+        probe = hello3.TCPProbe('127.0.0.1', s.getsockname()[1], timeout=0.3, backoff=0.02, max_backoff=0.08)
+        t = time.monotonic()
+        try:
+            with self.assertRaises(hello3.ProbeTimeout):
+                probe.wait()
+        finally:
+            s.close()
+        self.assertGreaterEqual(time.monotonic() - t, 0.3)
+        # sleeps of 0.02, 0.04 and then 0.08 fit about 6 attempts into 0.3s
+        self.assertGreaterEqual(probe.attempts, 4)
+        self.assertLessEqual(probe.attempts, 8)
+
+
+class HTTPProbeTest(unittest.TestCase):
+    def test_waits_for_an_accepted_status(self):
+        srv = Server(refuse=1, responses=[b'HTTP/1.1 503 Service Unavailable\r\n\r\n', b'garbage\r\n\r\n',
+                                          b'HTTP/1.0 200 OK\r\nContent-Length: 6\r\n\r\nhello\n'])
+        try:
+            probe = hello3.HTTPProbe('127.0.0.1', srv.port, timeout=5)
+            probe.wait()
+            self.assertEqual(probe.attempts, 4)
+            self.assertEqual(probe.status, 200)
+            self.assertTrue(probe.response.startswith(b'HTTP/1.0 200 OK\r\n'))
+        finally:
+            srv.close()
+
+    def test_custom_status_and_timeout(self):
+        srv = Server(responses=[b'HTTP/1.1 404 Not Found\r\n\r\n'])
+        try:
+            probe = hello3.HTTPProbe('127.0.0.1', srv.port, timeout=5, ok=lambda status: status == 404)
+            probe.wait()
+            self.assertEqual((probe.attempts, probe.status), (1, 404))
+            probe = hello3.HTTPProbe('127.0.0.1', srv.port, timeout=0.2)
+            with self.assertRaises(hello3.ProbeTimeout):
+                probe.wait()
+            self.assertEqual(probe.status, 404)
+            self.assertGreater(probe.attempts, 1)
+        finally:
+            srv.close()
+
+
+def writer(w, chunks):
+    # writes (delay, bytes) chunks to the pipe fd w from a thread, then closes it
+    def run():
+        for delay, data in chunks:
+            time.sleep(delay)
+            os.write(w, data)
+        os.close(w)
+    t = threading.Thread(target=run, daemon=True)
+    t.start()
+    return t
+
+
+class LogStreamTest(unittest.TestCase):
+    def test_lines_of_several_pipes(self):
+        r1, w1 = os.pipe()
+        r2, w2 = os.pipe()
+        f2 = os.fdopen(r2, 'rb')
+        stream = hello3.LogStream(r1, f2)
+        os.write(w1, b'one\ntw')
+        os.write(w2, b'err\n')
+        deadline = time.monotonic() + 5
+        lines = []
+        while len(lines) < 2:
+            lines += stream.read(deadline)
+        self.assertEqual(sorted(l for _, l in lines), [b'err', b'one'])
+        self.assertEqual(stream.first_line_at, lines[0][0])
+        os.write(w1, b'o\nthree')  # the last line has no newline
+        os.close(w1)
+        os.close(w2)
+        while True:
+            try:
+                lines += stream.read(deadline)
+            except EOFError:
+                break
+        self.assertEqual([l for _, l in lines][2:], [b'two', b'three'])
+        self.assertEqual(stream.nlines, 4)
+        with self.assertRaises(EOFError):
+            stream.read(deadline)
+        stream.close()
+        os.close(r1)
+        f2.close()
+
+    def test_read_returns_at_the_deadline(self):
+        r, w = os.pipe()
+        stream = hello3.LogStream(r)
+        t = time.monotonic()
+        self.assertEqual(stream.read(t + 0.1), [])
+        self.assertGreaterEqual(time.monotonic() - t, 0.1)
+        stream.close()
+        os.close(r)
+        os.close(w)
+
+
+class LogMatcherTest(unittest.TestCase):
+    def test_first_match(self):
+        m = hello3.LogMatcher(['ready for connections', re.compile(r'listening on port \d+')])
+        self.assertFalse(m.feed(1.0, b'starting'))
+        self.assertTrue(m.feed(2.0, b'INFO listening on port 8080 (tcp)'))
+        self.assertEqual(dict(m.matched), {r'listening on port \d+': 2.0})
+
+    def test_plain_strings_are_not_regexes(self):
+        m = hello3.LogMatcher('] started')
+        self.assertFalse(m.feed(1.0, b'node started'))
+        self.assertTrue(m.feed(2.0, b'[node] started'))
+
+    def test_match_all(self):
+        m = hello3.LogMatcher([re.compile(b'^db up$'), 'cache up'], match_all=True)
+        self.assertFalse(m.feed(1.0, b'cache up'))
+        self.assertFalse(m.feed(2.0, b'the db up'))
+        self.assertFalse(m.feed(3.0, b'cache up'))  # a repeated line keeps its first time
+        self.assertTrue(m.feed(4.0, b'db up'))
+        self.assertEqual(list(m.matched.items()), [('cache up', 1.0), (b'^db up$', 4.0)])
+
+
+class LogLineProbeTest(unittest.TestCase):
+    def test_line_arrives(self):
+        r, w = os.pipe()
+        t = time.monotonic()
+        th = writer(w, [(0.05, b'booting\n'), (0.1, b'Ready to accept connections\n'), (0.5, b'more\n')])
+        probe = hello3.LogLineProbe(r, 'Ready to accept connections', timeout=5)
+        try:
+            ready_at = probe.wait()
+        finally:
+            probe.close()
+        self.assertGreaterEqual(ready_at - t, 0.15)
+        self.assertLess(ready_at - t, 0.5)
+        self.assertLess(probe.stream.first_line_at, ready_at)
+        th.join()
+        os.close(r)
+
+    def test_eof_before_the_line_fails_fast(self):
+        # the container exited without printing the wait line: no waiting for the timeout
+        r, w = os.pipe()
+        th = writer(w, [(0.05, b'booting\n'), (0.05, b'fatal: no config\n')])
+        probe = hello3.LogLineProbe(r, 'Ready to accept connections', timeout=60)
+        t = time.monotonic()
+        try:
+            with self.assertRaisesRegex(hello3.ProbeError, 'log stream closed'):
+                probe.wait()
+        finally:
+            probe.close()
+        self.assertNotIsInstance(hello3.ProbeError(), hello3.ProbeTimeout)
+        self.assertLess(time.monotonic() - t, 5)
+        th.join()
+        os.close(r)
+
+    def test_timeout_while_the_stream_is_open(self):
+        r, w = os.pipe()
+        probe = hello3.LogLineProbe(r, 'never', timeout=0.2)
+        try:
+            with self.assertRaises(hello3.ProbeTimeout):
+                probe.wait()
+        finally:
+            probe.close()
+            os.close(r)
+            os.close(w)
+
+    def test_match_all(self):
+        r, w = os.pipe()
+        th = writer(w, [(0.02, b'db up\n'), (0.05, b'cache warming\n'), (0.05, b'cache up\n')])
+        probe = hello3.LogLineProbe(r, ['cache up', 'db up'], match_all=True, timeout=5)
+        try:
+            ready_at = probe.wait()
+        finally:
+            probe.close()
+        self.assertEqual(list(probe.matcher.matched), ['db up', 'cache up'])
+        self.assertEqual(probe.matcher.matched['cache up'], ready_at)
+        self.assertLess(probe.matcher.matched['db up'], ready_at)
+        th.join()
+        os.close(r)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import hello3  # noqa: E402
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+class PullTrackerTest(unittest.TestCase):
+    def feed(self, tracker, lines):
+        # lines: (seconds since the pull started, layer, status)
+        tracker.start = 0.0
+        for t, layer, status in lines:
+            tracker.event(t, layer, status)
+
+    def test_cli_markers(self):
+        tracker = hello3.PullTracker('redis')
+        self.feed(tracker, [(0.0, 'latest', 'Pulling from library/redis'),
+                            (0.1, 'aaaaaaaaaaaa', 'Pulling fs layer'),
+                            (0.1, 'bbbbbbbbbbbb', 'Pulling fs layer'),
+                            (0.1, 'cccccccccccc', 'Pulling fs layer'),
+                            (0.1, 'cccccccccccc', 'Waiting'),
+                            (0.5, 'bbbbbbbbbbbb', 'Verifying Checksum'),
+                            (0.6, 'bbbbbbbbbbbb', 'Download complete'),
+                            (1.0, 'aaaaaaaaaaaa', 'Download complete'),
+                            (1.5, 'aaaaaaaaaaaa', 'Pull complete'),
+                            (1.8, 'bbbbbbbbbbbb', 'Pull complete'),
+                            (1.9, 'cccccccccccc', 'Download complete'),
+                            (2.0, 'cccccccccccc', 'Pull complete')])
+        a, b, c = tracker.layers.values()
+        self.assertEqual((a['download_start'], a['download_end']), (0.1, 1.0))
+        self.assertEqual((b['download_start'], b['verify_start'], b['download_end']), (0.1, 0.5, 0.6))
+        # c got the slot b freed
+        self.assertEqual((c['download_start'], c['download_end']), (0.6, 1.9))
+        # layers extract in order, each after its download and its predecessor
+        self.assertEqual((a['extract_start'], a['extract_end']), (1.0, 1.5))
+        self.assertEqual((b['extract_start'], b['extract_end']), (1.5, 1.8))
+        self.assertEqual((c['extract_start'], c['extract_end']), (1.9, 2.0))
+
+    def test_engine_progress(self):
+        tracker = hello3.PullTracker('redis')
+        tracker.start = 0.0
+        for t, layer, status, current, total in [(0.1, 'aaaaaaaaaaaa', 'Pulling fs layer', None, None),
+                                                 (0.2, 'aaaaaaaaaaaa', 'Downloading', 10, 100),
+                                                 (0.4, 'aaaaaaaaaaaa', 'Downloading', 100, 100),
+                                                 (0.5, 'aaaaaaaaaaaa', 'Download complete', None, None),
+                                                 (0.7, 'aaaaaaaaaaaa', 'Extracting', 10, 100),
+                                                 (0.9, 'aaaaaaaaaaaa', 'Pull complete', None, None)]:
+            tracker.event(t, layer, status, current, total)
+        m = hello3.Measurement()
+        m.phases['pull'] = 1.0
+        tracker.describe(m, [1000])
+        l = m.extra['layers'][0]
+        self.assertEqual((l['download_start'], l['extract_start'], l['extract_end']), (0.1, 0.7, 0.9))
+        self.assertEqual((l['compressed'], l['uncompressed']), (100, 1000))
+        self.assertAlmostEqual(l['throughput'], 250.0)
+        self.assertEqual(m.metrics['pull_bytes'], 100)
+
+    def test_captured_cli_output(self):
+        # the output `docker pull` prints without a tty, fed through the cli backend
+        d = tempfile.mkdtemp()
+        try:
+            docker = os.path.join(d, 'docker')
+            with open(docker, 'w') as f:
+                f.write('#!/bin/sh\nwhile IFS= read -r l; do echo "$l"; sleep 0.005; done < %s\n' %
+                        os.path.join(DATA, 'docker-pull-redis.txt'))
+            os.chmod(docker, os.stat(docker).st_mode | stat.S_IEXEC)
+            tracker = hello3.PullTracker('redis')
+            rc = hello3.DockerCli(docker).pull('redis', verbose=False, progress=tracker.event)
+        finally:
+            shutil.rmtree(d)
+        self.assertEqual(rc, 0)
+        layers = list(tracker.layers.values())
+        self.assertEqual([l['id'] for l in layers], ['a2abf6c4d29d', 'c7a4e4382001', '4044b9ba67c9',
+                                                     'c8388a79482f', '413c8bb60be2', '1abfd3011519'])
+        self.assertEqual(layers[0], {'id': 'a2abf6c4d29d', 'cached': True})
+        for l in layers[1:]:
+            self.assertLess(l['download_start'], l['download_end'])
+            self.assertLessEqual(l['download_end'], l['extract_start'])
+            self.assertLess(l['extract_start'], l['extract_end'])
+        for prev, l in zip(layers[1:], layers[2:]):
+            self.assertLessEqual(prev['extract_end'], l['extract_start'])
+        # the waiting layers start when c7a4e4382001 and 4044b9ba67c9 free their slots
+        self.assertEqual(layers[4]['download_start'], layers[2]['download_end'])
+        self.assertEqual(layers[5]['download_start'], layers[1]['download_end'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,287 @@
+import hashlib
+import http.server
+import json
+import os
+import shutil
+import socketserver
+import sys
+import tempfile
+import threading
+import unittest
+import urllib.parse
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import hello3  # noqa: E402
+
+MANIFEST_V2 = 'application/vnd.docker.distribution.manifest.v2+json'
+
+
+class FakeRegistry(http.server.BaseHTTPRequestHandler):
+    # registry v2 API subset with optional bearer auth; state lives on the server
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def body(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            data, n = b'', 0
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    self.server.patch_chunks.append(n)
+                    return data
+                data += self.rfile.read(size)
+                self.rfile.readline()
+                n += 1
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def send(self, status, data=b'', headers={}):
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+
+    def handle_any(self):
+        srv = self.server
+        u = urllib.parse.urlparse(self.path)
+        q = dict(urllib.parse.parse_qsl(u.query))
+        data = self.body()
+        if u.path == '/token':
+            srv.token_requests.append(q)
+            repo = q['scope'].split(':')[1]
+            return self.send(200, json.dumps({'token': 'tok-' + repo}).encode())
+        parts = u.path[len('/v2/'):].split('/')
+        i = parts.index('blobs') if 'blobs' in parts else parts.index('manifests')
+        repo, kind, rest = '/'.join(parts[:i]), parts[i], parts[i + 1:]
+        srv.log.append((self.command, repo, kind, rest[0] if rest else ''))
+        if srv.auth and self.headers.get('Authorization') != 'Bearer tok-' + repo:
+            challenge = 'Bearer realm="http://127.0.0.1:%d/token",service="fake",scope="repository:%s:pull,push"'
+            return self.send(401, headers={'WWW-Authenticate': challenge % (srv.server_address[1], repo)})
+        blobs = srv.repos.setdefault(repo, set())
+        if kind == 'manifests':
+            if self.command == 'PUT':
+                srv.manifests[(repo, rest[0])] = (data, self.headers['Content-Type'])
+                return self.send(201)
+            if (repo, rest[0]) not in srv.manifests:
+                return self.send(404)
+            m, mtype = srv.manifests[(repo, rest[0])]
+            return self.send(200, m, {'Content-Type': mtype})
+        if rest[0] == 'uploads':
+            if self.command == 'POST':
+                if 'mount' in q and srv.mounts and q['mount'] in srv.repos.get(q['from'], ()):
+                    blobs.add(q['mount'])
+                    return self.send(201)
+                uid = str(uuid.uuid4())
+                srv.uploads[uid] = b''
+                return self.send(202, headers={'Location': '/v2/%s/blobs/uploads/%s?_state=a' % (repo, uid)})
+            uid = rest[1]
+            if self.command == 'PATCH':
+                srv.uploads[uid] += data
+                return self.send(202, headers={'Location': '/v2/%s/blobs/uploads/%s?_state=b' % (repo, uid)})
+            if self.command == 'DELETE':
+                del srv.uploads[uid]
+                return self.send(204)
+            blob = srv.uploads.pop(uid) + data
+            assert 'sha256:' + hashlib.sha256(blob).hexdigest() == q['digest']
+            srv.blobs[q['digest']] = blob
+            blobs.add(q['digest'])
+            return self.send(201)
+        if rest[0] not in blobs:
+            return self.send(404)
+        return self.send(200, srv.blobs[rest[0]])
+
+    do_GET = do_HEAD = do_PUT = do_POST = do_PATCH = do_DELETE = handle_any
+
+
+class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, auth=False, mounts=True):
+        http.server.HTTPServer.__init__(self, ('127.0.0.1', 0), FakeRegistry)
+        self.auth = auth
+        self.mounts = mounts
+        self.repos, self.blobs, self.manifests, self.uploads = {}, {}, {}, {}
+        self.log, self.token_requests, self.patch_chunks = [], [], []
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def address(self):
+        return 'localhost:%d' % self.server_address[1]
+
+    def add_blob(self, repo, data):
+        digest = 'sha256:' + hashlib.sha256(data).hexdigest()
+        self.blobs[digest] = data
+        self.repos.setdefault(repo, set()).add(digest)
+        return {'mediaType': 'application/octet-stream', 'digest': digest, 'size': len(data)}
+
+    def add_image(self, repo, layers):
+        cfg = self.add_blob(repo, json.dumps({'repo': repo}).encode())
+        m = {'schemaVersion': 2, 'mediaType': MANIFEST_V2, 'config': cfg,
+             'layers': [self.add_blob(repo, l) for l in layers]}
+        self.manifests[(repo, 'latest')] = (json.dumps(m).encode(), MANIFEST_V2)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class RegistryTest(unittest.TestCase):
+    BASE = b'base' * (700 * 1024)  # larger than RegistryClient.CHUNK
+
+    def setUp(self):
+        self.servers = []
+
+    def tearDown(self):
+        for s in self.servers:
+            s.stop()
+
+    def server(self, **kwargs):
+        s = Server(**kwargs)
+        self.servers.append(s)
+        return s
+
+    def test_bearer_token(self):
+        src = self.server(auth=True)
+        src.add_image('redis', [b'redis'])
+        client = hello3.RegistryClient(src.address())
+        data, mtype = client.get_manifest('redis', 'latest')
+        self.assertEqual(mtype, MANIFEST_V2)
+        self.assertEqual(json.loads(data)['layers'][0]['size'], 5)
+        self.assertEqual(src.token_requests, [{'service': 'fake', 'scope': 'repository:redis:pull,push'}])
+        # the token is reused for later requests
+        client.has_blob('redis', json.loads(data)['config']['digest'])
+        self.assertEqual(len(src.token_requests), 1)
+
+    def test_move_copies_then_skips(self):
+        src, dst = self.server(auth=True), self.server(auth=True)
+        src.add_image('redis', [self.BASE, b'redis'])
+        st = hello3.RegistryMover(src.address(), dst.address(), jobs=2).move('redis')
+        self.assertEqual((st['blobs_copied'], st['blobs_skipped'], st['blobs_mounted']), (3, 0, 0))
+        self.assertEqual(st['bytes_copied'], len(self.BASE) + 5 + len(json.dumps({'repo': 'redis'})))
+        self.assertEqual(dst.manifests[('redis', 'latest')], src.manifests[('redis', 'latest')])
+        # the large layer went up as a chunked PATCH of several chunks
+        self.assertEqual(max(dst.patch_chunks), 3)
+        n = len(dst.log)
+        st = hello3.RegistryMover(src.address(), dst.address()).move('redis')
+        self.assertEqual((st['blobs_copied'], st['blobs_skipped']), (0, 3))
+        self.assertEqual(set(m for m, _, _, _ in dst.log[n:]), set(['HEAD', 'PUT']))
+
+    def test_cross_repo_mount(self):
+        src, dst = self.server(), self.server()
+        src.add_image('redis', [self.BASE, b'redis'])
+        src.add_image('nginx', [self.BASE, b'nginx'])
+        mover = hello3.RegistryMover(src.address(), dst.address())
+        mover.move('redis')
+        st = mover.move('nginx')
+        self.assertEqual((st['blobs_copied'], st['blobs_mounted']), (2, 1))
+        self.assertEqual(st['bytes_mounted'], len(self.BASE))
+        self.assertIn(('POST', 'nginx', 'blobs', 'uploads'), dst.log)
+
+    def test_refused_mount_falls_back_to_copy(self):
+        src, dst = self.server(), self.server(mounts=False)
+        src.add_image('redis', [self.BASE, b'redis'])
+        src.add_image('nginx', [self.BASE, b'nginx'])
+        mover = hello3.RegistryMover(src.address(), dst.address())
+        mover.move('redis')
+        st = mover.move('nginx')
+        self.assertEqual((st['blobs_copied'], st['blobs_mounted']), (3, 0))
+        # the upload session the refused mount opened is cancelled
+        self.assertIn('DELETE', [m for m, repo, _, _ in dst.log if repo == 'nginx'])
+        self.assertEqual(dst.uploads, {})
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.src = Server()
+        self.src.add_image('redis', [b'base', b'redis'])
+        self.src.add_image('nginx', [b'base', b'nginx'] + [b'layer%d' % i for i in range(20)])
+
+    def tearDown(self):
+        self.src.stop()
+        shutil.rmtree(self.dir)
+
+    def test_export_counts_every_blob(self):
+        layout = os.path.join(self.dir, 'layout')
+        st = hello3.OCISnapshot(layout, jobs=8).export(self.src.address(), ['redis', 'nginx'], verbose=False)
+        # two configs, the shared base once, redis, nginx and the 20 extra layers
+        self.assertEqual((st['images'], st['blobs'], st['fetched'], st['skipped']), (2, 25, 25, 0))
+        self.assertEqual(st['bytes'], sum(len(b) for b in self.src.blobs.values()))
+        st = hello3.OCISnapshot(layout, jobs=8).export(self.src.address(), ['redis', 'nginx'], verbose=False)
+        self.assertEqual((st['fetched'], st['skipped']), (0, 25))
+
+    def test_digest_mismatch_leaves_no_temp_file(self):
+        layout = os.path.join(self.dir, 'layout')
+        digest = json.loads(self.src.manifests[('redis', 'latest')][0])['layers'][1]['digest']
+        self.src.blobs[digest] = b'tampered'
+        with self.assertRaisesRegex(hello3.RegistryError, 'digest mismatch'):
+            hello3.OCISnapshot(layout).export(self.src.address(), ['redis'], verbose=False)
+        blobs = os.listdir(os.path.join(layout, 'blobs', 'sha256'))
+        self.assertEqual([n for n in blobs if n.endswith('.tmp')], [])
+        self.assertNotIn(digest.split(':')[1], blobs)
+
+    def test_import_into_registry_storage(self):
+        layout = os.path.join(self.dir, 'layout')
+        storage = os.path.join(self.dir, 'storage')
+        hello3.OCISnapshot(layout).export(self.src.address(), ['redis', 'nginx'], verbose=False)
+        st = hello3.OCISnapshot(layout).import_into(storage, verbose=False)
+        # 25 blobs and the two manifests
+        self.assertEqual((st['images'], st['blobs'], st['skipped']), (2, 27, 0))
+        v2 = os.path.join(storage, 'docker', 'registry', 'v2')
+        with open(os.path.join(v2, 'repositories', 'redis', '_manifests', 'tags', 'latest', 'current', 'link')) as f:
+            digest = f.read()
+        hexd = digest.split(':')[1]
+        with open(os.path.join(v2, 'blobs', 'sha256', hexd[:2], hexd, 'data'), 'rb') as f:
+            self.assertEqual(json.loads(f.read()), json.loads(self.src.manifests[('redis', 'latest')][0]))
+        st = hello3.OCISnapshot(layout).import_into(storage, verbose=False)
+        self.assertEqual((st['blobs'], st['skipped']), (0, 27))
+
+    def test_import_of_a_tampered_blob(self):
+        layout = os.path.join(self.dir, 'layout')
+        storage = os.path.join(self.dir, 'storage')
+        hello3.OCISnapshot(layout).export(self.src.address(), ['redis'], verbose=False)
+        digest = json.loads(self.src.manifests[('redis', 'latest')][0])['layers'][1]['digest']
+        hexd = digest.split(':')[1]
+        with open(os.path.join(layout, 'blobs', 'sha256', hexd), 'wb') as f:
+            f.write(b'tampered')
+        with self.assertRaisesRegex(hello3.RegistryError, 'digest mismatch'):
+            hello3.OCISnapshot(layout).import_into(storage, verbose=False)
+        blob = os.path.join(storage, 'docker', 'registry', 'v2', 'blobs', 'sha256', hexd[:2], hexd)
+        self.assertEqual(os.listdir(blob), [])
+
+
+class ImageIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_concurrent_writes(self):
+        # several indexes on one root, as with --jobs or parallel runs
+        indexes = [hello3.ImageIndex(self.dir) for _ in range(4)]
+        errors = []
+
+        def writer(index, n):
+            try:
+                for i in range(50):
+                    index.write('refs.json', {'redis': 'sha256:%d-%d' % (n, i)})
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=writer, args=(index, n)) for n, index in enumerate(indexes)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(os.listdir(self.dir), ['refs.json'])
+        self.assertRegex(hello3.ImageIndex(self.dir).refs['redis'], r'^sha256:[0-3]-49$')
+
+
+if __name__ == '__main__':
+    unittest.main()
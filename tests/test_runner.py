@@ -0,0 +1,95 @@
+import argparse
+import io
+import os
+import socket
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import hello3  # noqa: E402
+
+
+class RecordingEngine:
+    # just enough of a backend for run_http; the container answers on its host port
+    def __init__(self, ports, fail_start=False):
+        self.ports = ports
+        self.fail_start = fail_start
+        self.calls = []
+        self.servers = {}
+
+    def image_exists(self, ref):
+        return True
+
+    def create(self, ref, name, cmd='', env={}, ports=[], mounts=[], stdin=False, labels={}, verbose=True):
+        self.calls.append(('create', [h for h, _ in ports]))
+        return name
+
+    def start(self, cid, verbose=True):
+        if self.fail_start:
+            raise RuntimeError('start failed')
+        host_port = self.calls[-1][1][0]
+        srv = self.servers[cid] = socket.create_server(('127.0.0.1', host_port))
+        threading.Thread(target=self.accept, args=(srv,), daemon=True).start()
+
+    def accept(self, srv):
+        try:
+            srv.accept()[0].close()
+        except OSError:
+            pass  # removed before the thread got to run
+
+    def remove(self, cid, force=False, verbose=True):
+        # the port must still be reserved while the container holds it
+        self.calls.append(('remove', sorted(self.ports.reserved)))
+        srv = self.servers.pop(cid, None)
+        if srv is not None:
+            srv.close()
+
+
+class RunHTTPTest(unittest.TestCase):
+    def runner(self, **kwargs):
+        r = hello3.BenchRunner(ready_probe='tcp', probe_opts={'timeout': 5.0})
+        r.engine = RecordingEngine(r.ports, **kwargs)
+        r.cleaner.engine = r.engine
+        return r
+
+    def test_port_released_after_remove(self):
+        r = self.runner()
+        r.run_http('nginx', 80, verbose=False, m=hello3.Measurement())
+        (_, [port]), (_, reserved) = r.engine.calls
+        self.assertEqual(reserved, [port])
+        self.assertEqual(r.ports.reserved, set())
+
+    def test_failed_start_removes_container_and_releases_port(self):
+        r = self.runner(fail_start=True)
+        m = hello3.Measurement()
+        with self.assertRaises(RuntimeError):
+            r.run_http('nginx', 80, verbose=False, m=m)
+        (_, [port]), (_, reserved) = r.engine.calls
+        self.assertEqual(reserved, [port])
+        self.assertEqual(r.ports.reserved, set())
+        self.assertIn('teardown', m.phases)
+
+
+class ChurnTest(unittest.TestCase):
+    def test_latency_leaves_out_the_removal(self):
+        r = hello3.BenchRunner(backend='fake',
+                               backend_opts={'latency': {'create': 0.005, 'ready': 0.02, 'remove': 0.2}})
+        args = argparse.Namespace(rate=20.0, duration=1.0, window=0.5, arrival='uniform', max_inflight=32,
+                                  verbose=False)
+        out = io.StringIO()
+        bench = hello3.BenchRunner.ALL['alpine']
+        row = hello3.run_churn(hello3.ResultFile(out), r, args, bench, 't')
+        self.assertEqual((row['arrivals'], row['errors']), (20, 0))
+        # startup is create + ready, the removal is its own series
+        self.assertLess(row['latency']['p50'], 0.1)
+        self.assertLess(row['service']['p50'], 0.1)
+        self.assertGreaterEqual(row['teardown']['p50'], 0.19)
+        self.assertEqual(row['teardown']['count'], 20)
+        # every arrival shows up in the live metrics
+        self.assertEqual(r.monitor.runs[(bench.name, bench.category, 'churn', r.docker, 'ok')], 20)
+        self.assertIn('churn', r.monitor.render())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import argparse
+import math
+import os
+import random
+import statistics
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import hello3  # noqa: E402
+
+
+class StatsTest(unittest.TestCase):
+    def test_percentile_interpolates(self):
+        xs = [4.0, 1.0, 3.0, 2.0]
+        self.assertEqual(hello3.percentile(xs, 0), 1.0)
+        self.assertEqual(hello3.percentile(xs, 50), 2.5)
+        self.assertEqual(hello3.percentile(xs, 100), 4.0)
+        self.assertAlmostEqual(hello3.percentile(xs, 95), 3.85)
+        self.assertEqual(hello3.percentile([7.0], 99), 7.0)
+
+    def test_bootstrap_ci_covers_the_median(self):
+        rng = random.Random(1)
+        xs = [rng.gauss(10.0, 1.0) for _ in range(200)]
+        lo, hi = hello3.bootstrap_ci(xs, iters=500, rng=random.Random(2))
+        self.assertLess(lo, statistics.median(xs))
+        self.assertGreater(hi, statistics.median(xs))
+        # the CI of the median of 200 samples with sd 1 is a few tenths wide
+        self.assertLess(hi - lo, 0.6)
+        # wider at a higher confidence level
+        lo99, hi99 = hello3.bootstrap_ci(xs, iters=500, confidence=0.99, rng=random.Random(2))
+        self.assertGreater(hi99 - lo99, hi - lo)
+
+    def test_bootstrap_ci_degenerate(self):
+        self.assertEqual(hello3.bootstrap_ci([3.0]), (3.0, 3.0))
+        self.assertEqual(hello3.bootstrap_ci([2.0, 2.0, 2.0], iters=10), (2.0, 2.0))
+
+    def test_summarize(self):
+        args = argparse.Namespace(bootstrap=200, confidence=0.9)
+        s = hello3.summarize([1.0, 2.0, 3.0, 4.0, 5.0], args)
+        self.assertEqual((s['n'], s['min'], s['median'], s['mean']), (5, 1.0, 3.0, 3.0))
+        self.assertAlmostEqual(s['stddev'], statistics.stdev([1.0, 2.0, 3.0, 4.0, 5.0]))
+        self.assertLessEqual(s['ci_low'], s['median'])
+        self.assertGreaterEqual(s['ci_high'], s['median'])
+        self.assertEqual(s['confidence'], 0.9)
+        self.assertEqual(hello3.ci_relative_width([1.0], args), float('inf'))
+        self.assertEqual(hello3.ci_relative_width([2.0, 2.0], args), 0.0)
+
+
+class HistogramTest(unittest.TestCase):
+    def test_buckets(self):
+        h = hello3.Histogram()
+        # exact below 2 * 2**bits microseconds
+        for us in range(256):
+            self.assertEqual(h.value(h.index(us)), us)
+        # within 1 / 2**bits above; bucket indexes never decrease with the value
+        prev = -1
+        for us in [256, 257, 300, 1000, 4095, 4096, 123456, 10 ** 7, 2 ** 40 + 12345]:
+            i = h.index(us)
+            self.assertGreaterEqual(i, prev)
+            self.assertLessEqual(abs(h.value(i) - us) / us, 1.0 / 128)
+            prev = i
+
+    def test_percentiles_track_the_samples(self):
+        rng = random.Random(3)
+        xs = [rng.lognormvariate(math.log(0.05), 1.0) for _ in range(20000)]
+        h = hello3.Histogram()
+        for x in xs:
+            h.record(x)
+        for p in (50, 90, 99, 99.9):
+            exact = hello3.percentile(xs, p)
+            self.assertLess(abs(h.percentile(p) - exact) / exact, 0.01, p)
+        self.assertEqual(h.percentile(100), max(xs))
+        s = h.summary()
+        self.assertEqual((s['count'], s['max']), (len(xs), max(xs)))
+        self.assertAlmostEqual(s['mean'], statistics.mean(xs))
+
+    def test_add(self):
+        a, b, both = hello3.Histogram(), hello3.Histogram(), hello3.Histogram()
+        for i, x in enumerate([0.001, 0.002, 0.5, 0.003, 1.5, 0.0001]):
+            (a if i % 2 else b).record(x)
+            both.record(x)
+        a.add(b)
+        self.assertEqual((a.counts, a.count, a.max), (both.counts, both.count, both.max))
+        self.assertAlmostEqual(a.total, both.total)
+        self.assertEqual(a.summary()['p50'], both.summary()['p50'])
+
+    def test_empty(self):
+        self.assertEqual(hello3.Histogram().summary(), {'count': 0, 'mean': None, 'p50': None, 'p99': None,
+                                                        'p999': None, 'max': None})
+
+
+if __name__ == '__main__':
+    unittest.main()
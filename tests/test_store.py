@@ -0,0 +1,76 @@
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import hello3  # noqa: E402
+
+
+def row(bench, trial, elapsed, runtime='docker', run_id='r1', **kwargs):
+    r = {'bench': bench, 'category': 'database', 'op': 'run', 'runtime': runtime, 'clean_policy': 'none',
+         'start_time': '2026-01-01-00-00-00', 'run_id': run_id, 'trial': trial, 'elapsed': elapsed,
+         'phases': {'pull': 0.0, 'create': elapsed / 4, 'start': elapsed / 4, 'ready': elapsed / 2}}
+    r.update(kwargs)
+    return r
+
+
+class ResultStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db = os.path.join(self.dir, 'results.db')
+        self.out = os.path.join(self.dir, 'bench.out')
+        rows = [row('redis', t, 1.0 + t) for t in range(3)] + [row('mysql', t, 4.0) for t in range(2)]
+        rows.append({'type': 'total', 'op': 'run', 'elapsed': 11.0, 'start_time': '2026-01-01-00-00-00'})
+        with open(self.out, 'w') as f:
+            f.write('# a comment line\n')
+            for r in rows:
+                f.write(json.dumps(r) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_ingest_and_query(self):
+        store = hello3.ResultStore(self.db)
+        self.assertEqual(store.ingest(self.out), 6)
+        res = store.query(group_by=['bench'])
+        self.assertEqual([(r['key']['bench'], r['n'], r['min'], r['mean'], r['max']) for r in res],
+                         [('mysql', 2, 4.0, 4.0, 4.0), ('redis', 3, 1.0, 2.0, 3.0)])
+        self.assertAlmostEqual(res[1]['stddev'], 1.0)
+        res = store.query(group_by=['bench'], benches=['redis'], phase='ready')
+        self.assertEqual((res[0]['n'], res[0]['mean']), (3, 1.0))
+        self.assertEqual(store.query(group_by=['bench'], where={'runtime': 'podman'}), [])
+        store.close()
+
+    def test_ingest_twice_keeps_one_copy(self):
+        store = hello3.ResultStore(self.db)
+        store.ingest(self.out)
+        store.ingest(self.out)
+        # the same rows mirrored live by a run
+        store.insert([row('redis', 0, 1.0)])
+        self.assertEqual(store.db.execute('SELECT COUNT(*) FROM results').fetchone()[0], 6)
+        self.assertEqual(store.db.execute('SELECT COUNT(*) FROM phases').fetchone()[0], 20)
+        # other runs, runtimes and burst instances are distinct measurements
+        store.insert([row('redis', 0, 1.0, run_id='r2'), row('redis', 0, 1.0, runtime='podman'),
+                      row('redis', 0, 1.0, op='burst', instance=0), row('redis', 0, 1.0, op='burst', instance=1)])
+        self.assertEqual(store.db.execute('SELECT COUNT(*) FROM results').fetchone()[0], 10)
+        store.close()
+
+    def test_old_store_gets_the_uid_column(self):
+        db = sqlite3.connect(self.db)
+        db.execute('CREATE TABLE results (id INTEGER PRIMARY KEY, type TEXT, bench TEXT, category TEXT, op TEXT, '
+                   'runtime TEXT, clean_policy TEXT, start_time TEXT, trial INTEGER, elapsed REAL, row TEXT)')
+        db.commit()
+        db.close()
+        store = hello3.ResultStore(self.db)
+        store.ingest(self.out)
+        store.ingest(self.out)
+        self.assertEqual(store.db.execute('SELECT COUNT(*) FROM results').fetchone()[0], 6)
+        store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
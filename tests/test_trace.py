@@ -0,0 +1,55 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import hello3  # noqa: E402
+
+TRACE = '''# json, whitespace and strace lines mixed
+{"path": "/usr/bin/redis-server", "offset": 0, "size": 4096}
+{"file": "/usr/bin/redis-server", "offset": 2048, "len": 4096}
+read /etc/redis.conf 0 100
+1234  read(3</lib/libc.so.6>, "\\177ELF"..., 832) = 832
+1234  read(3</lib/libc.so.6>, ""..., 832) = 200
+1234  pread64(3</lib/libc.so.6>, ""..., 784, 64) = 784
+{"path": "/usr/bin/redis-server", "offset": 10000, "size": 0}
+'''
+
+
+class TraceIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_parse_and_merge(self):
+        index = hello3.TraceIndex()
+        for l in TRACE.splitlines():
+            index.parse_line(l)
+        # files keep the order of their first access
+        self.assertEqual(list(index.files), ['/usr/bin/redis-server', '/etc/redis.conf', '/lib/libc.so.6'])
+        self.assertEqual(index.ranges('/usr/bin/redis-server'), [[0, 6144]])
+        # plain read() continues at the cursor; pread64 is positioned and overlaps it
+        self.assertEqual(index.ranges('/lib/libc.so.6'), [[0, 1032]])
+        self.assertEqual(index.bytes(), 6144 + 100 + 1032)
+
+    def test_analyze_trace_writes_index_and_prefetch(self):
+        trace = os.path.join(self.dir, 'redis.trace')
+        with open(trace, 'w') as f:
+            f.write(TRACE)
+        summary = hello3.analyze_trace(trace, image_bytes=72760)
+        self.assertEqual((summary['files'], summary['bytes']), (3, 7276))
+        self.assertAlmostEqual(summary['fraction'], 0.1)
+        with open(os.path.join(self.dir, 'redis.index.json')) as f:
+            self.assertEqual(json.load(f)['/etc/redis.conf'], [[0, 100]])
+        with open(summary['prefetch']) as f:
+            self.assertEqual(f.read().splitlines(), ['/usr/bin/redis-server 0 6144', '/etc/redis.conf 0 100',
+                                                     '/lib/libc.so.6 0 1032'])
+
+
+if __name__ == '__main__':
+    unittest.main()